@@ -0,0 +1,276 @@
+import json
+import os
+import shutil
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from app import app
+from app.cube import MSMCube
+from app.dataProcessing import msm_time_axis, interpolate_msm
+
+def _as_date(value):
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+def _month_end(day):
+    if day.month == 12:
+        return day.replace(day=31)
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+def _day_after(day):
+    """
+    The next day, or None after the last day a date can hold.
+    """
+    return None if day == date.max else day + timedelta(days=1)
+
+class CPGAggregates(object):
+    """
+    Materialized CPG matrices for one user, kept next to their MSMCube: one
+    per calendar month and one per calendar year (the leaves and parents of a
+    two-level segment tree), plus one for the last ROLLING_DAYS days. Each
+    upload folds the new run's matrix into its month, its year and (if
+    recent enough) the rolling block with np.maximum, so a date range is
+    answered from a handful of blocks rather than every run in it.
+
+    Every change bumps a version number, which callers can use as a cache key.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.cube = MSMCube(user_id)
+        self.directory = self.cube.directory + 'aggregates/'
+        self.meta_path = self.directory + 'aggregates.json'
+
+    def _settings(self):
+        settings = MSMCube._configured_meta()
+        del settings['run_ids']
+        return settings
+
+    def _slab_shape(self):
+        return self.cube._slab_shape(self._settings())
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta['settings'] != self._settings():
+            return None
+        return meta
+
+    def _write_meta(self, meta):
+        meta['version'] += 1
+        meta['updated'] = datetime.utcnow().isoformat()
+        with open(self.meta_path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def _load_meta(self):
+        """
+        Reads the metadata, starting afresh if there is none or it was built
+        with different settings. Must be called under the cube's lock.
+        """
+        meta = self._read_meta()
+        if meta is None:
+            meta = self._fresh_meta()
+        return meta
+
+    def _fresh_meta(self):
+        previous = self._read_any_version()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        return {'settings': self._settings(), 'version': previous,
+                'updated': None, 'rolling_as_of': None}
+
+    def _read_any_version(self):
+        # Versions keep increasing across resets, so cache keys never repeat
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                return json.load(meta_file)['version']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _block_path(self, key):
+        return self.directory + key + '.f32'
+
+    def _read_block(self, key):
+        if not os.path.isfile(self._block_path(key)):
+            return None
+        return np.memmap(self._block_path(key), dtype='<f4', mode='r', \
+                         shape=self._slab_shape())
+
+    def _fold(self, key, msm):
+        path = self._block_path(key)
+        if not os.path.isfile(path):
+            np.asarray(msm, dtype='<f4').tofile(path)
+            return
+        block = np.memmap(path, dtype='<f4', mode='r+', shape=self._slab_shape())
+        np.maximum(block, msm, out=block)
+        block.flush()
+
+    def _runs_max(self, runs_query):
+        """
+        The element-wise maximum of the cube slabs of the runs in a query.
+        Runs which are not in the cube (yet) are ignored.
+        """
+        result = np.zeros(self._slab_shape(), dtype=np.float32)
+        cube = self.cube.runs()
+        if cube is None:
+            return result
+        index = {run_id: i for i, run_id in enumerate(self.cube.run_ids())}
+        slabs = sorted(index[run_id] for (run_id,) in runs_query \
+                        if run_id in index)
+        for slab in slabs:
+            np.maximum(result, cube[slab], out=result)
+        return result
+
+    def _runs_between(self, start_date, end_date):
+        from app import db
+        from app.models import Run
+        return db.session.query(Run.id).filter(Run.user_id == self.user_id, \
+                    Run.date >= start_date, Run.date <= end_date)
+
+    def _run_dates(self):
+        """
+        The dates of the user's first and last runs, or (None, None).
+        """
+        from app import db
+        from app.models import Run
+        return db.session.query(db.func.min(Run.date), db.func.max(Run.date)) \
+                    .filter(Run.user_id == self.user_id).one()
+
+    def _rebuild_period(self, day):
+        """
+        Recomputes the month and year blocks containing a day from the
+        individual runs, for when a run's matrix was replaced (and so may
+        have gone down).
+        """
+        month_start = day.replace(day=1)
+        month = self._runs_max(self._runs_between(month_start, _month_end(month_start)))
+        month.tofile(self._block_path(month_start.strftime('%Y-%m')))
+        year = np.zeros(self._slab_shape(), dtype=np.float32)
+        for month_number in range(1, 13):
+            block = self._read_block('{}-{:02d}'.format(day.year, month_number))
+            if block is not None:
+                np.maximum(year, block, out=year)
+        year.tofile(self._block_path(str(day.year)))
+
+    def add_run(self, run, msm, replaced=False):
+        """
+        Folds a run's max speed matrix into the aggregates. Pass replaced=True
+        when the run was already counted with values which have since gone
+        down (see MSMCube.append), so its period is recomputed.
+        """
+        with self.cube._lock():
+            meta = self._load_meta()
+            if replaced:
+                self._rebuild_period(run.date)
+                meta['rolling_as_of'] = None
+            else:
+                self._fold(run.date.strftime('%Y-%m'), msm)
+                self._fold(str(run.date.year), msm)
+                as_of = meta['rolling_as_of']
+                if as_of is not None and run.date > _as_date(as_of) - \
+                        timedelta(days=app.config['ROLLING_DAYS']):
+                    self._fold('rolling', msm)
+            self._write_meta(meta)
+
+    def reset(self):
+        with self.cube._lock():
+            self._write_meta(self._fresh_meta())
+
+    def touch(self):
+        """
+        Bumps the version without changing any block, for changes (such as a
+        run being uploaded or finishing processing) which don't affect the
+        matrices but do affect what is shown.
+        """
+        with self.cube._lock():
+            self._write_meta(self._load_meta())
+
+    def version(self):
+        meta = self._read_meta()
+        return 0 if meta is None else meta['version']
+
+    def updated(self):
+        meta = self._read_meta()
+        if meta is None or meta['updated'] is None:
+            return None
+        return datetime.strptime(meta['updated'][:19], '%Y-%m-%dT%H:%M:%S')
+
+    def range_max(self, start_date=None, end_date=None):
+        """
+        The CPG matrix (time x gradient) over every run between two dates,
+        inclusive. Whole years and whole months come from their blocks; only
+        the runs in partially covered months at either end are read. The
+        range is first narrowed to the user's runs, so an open end (None) or
+        a far-off date costs nothing extra.
+        """
+        result = np.zeros(self._slab_shape(), dtype=np.float32)
+        first_run, last_run = self._run_dates()
+        if first_run is None:
+            return result
+        # Whole years, so that they still come from their blocks
+        start_date = max(_as_date(start_date or first_run), date(first_run.year, 1, 1))
+        end_date = min(_as_date(end_date or last_run), date(last_run.year, 12, 31))
+        partial = []
+        month_start = start_date.replace(day=1)
+        while month_start is not None and month_start <= end_date:
+            month_end = _month_end(month_start)
+            if month_start.month == 1 and start_date <= month_start and \
+                    date(month_start.year, 12, 31) <= end_date:
+                block = self._read_block(str(month_start.year))
+                month_start = _day_after(date(month_start.year, 12, 31))
+            elif start_date <= month_start and month_end <= end_date:
+                block = self._read_block(month_start.strftime('%Y-%m'))
+                month_start = _day_after(month_end)
+            else:
+                partial.append((max(start_date, month_start), min(end_date, month_end)))
+                block = None
+                month_start = _day_after(month_end)
+            if block is not None:
+                np.maximum(result, block, out=result)
+
+        for partial_start, partial_end in partial:
+            np.maximum(result, self._runs_max(self._runs_between(partial_start, \
+                                                                 partial_end)), out=result)
+        return result
+
+    def rolling_max(self, today=None):
+        """
+        The CPG matrix over the last ROLLING_DAYS days. The block is kept up
+        to date by add_run, and recomputed from range_max once a day (since
+        runs can only be added to a maximum, not taken away).
+        """
+        today = today or date.today()
+        with self.cube._lock():
+            meta = self._load_meta()
+            if meta['rolling_as_of'] != today.isoformat():
+                start_date = today - timedelta(days=app.config['ROLLING_DAYS'] - 1)
+                self.range_max(start_date, today).tofile(self._block_path('rolling'))
+                meta['rolling_as_of'] = today.isoformat()
+                self._write_meta(meta)
+            return np.array(self._read_block('rolling'))
+
+def CPG_matrix_df(msm):
+    """
+    A CPG matrix stored on the configured time axis as a DataFrame, with a
+    row for every second and the gradients (as integers) as columns.
+    """
+    gradient_interval = np.arange(app.config['MIN_GRADIENT'], \
+                                  app.config['MAX_GRADIENT'] + 1)
+    return pd.DataFrame(interpolate_msm(msm, msm_time_axis()), \
+                        columns=gradient_interval)
+
+def CPG_matrix_by_date(user_id, start_date, end_date):
+    """
+    Given a starting and ending date (as dates or YYYY-MM-DD strings), return
+    the user's CPG matrix for only those dates as a DataFrame with a row
+    for every second and the gradients (as integers) as columns.
+    """
+    return CPG_matrix_df(CPGAggregates(user_id).range_max(start_date, end_date))
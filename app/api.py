@@ -0,0 +1,167 @@
+import hashlib
+from datetime import datetime
+from xml.etree.ElementTree import ParseError
+import numpy as np
+from flask import jsonify, request, abort, make_response
+from flask_login import login_required
+from app import app
+from app.models import User
+from app.aggregates import CPGAggregates
+from app.cache import cached
+from app.cube import MSMCube
+from app.dataProcessing import msm_time_axis, interpolate_msm
+from app.gpxReader import read_gpx_route
+from app.prediction import PaceModel, estimate_route
+
+# Number of log-spaced time points returned when resolution is not given,
+# and the most that may be asked for
+DEFAULT_RESOLUTION = 120
+MAX_RESOLUTION = 1000
+# The shortest and longest splits a route estimate may be asked for, in meters
+MIN_SPLIT_METERS = 100
+MAX_SPLIT_METERS = 100 * 1000
+
+def log_spaced_seconds(resolution, max_seconds):
+    """
+    Up to resolution whole numbers of seconds, log-spaced from 1 to
+    max_seconds (fewer at the short end, where they would repeat).
+    """
+    seconds = np.rint(np.geomspace(1, max_seconds, resolution)).astype(np.int64)
+    return np.unique(seconds)
+
+def _parse_args():
+    """
+    Reads and checks the query arguments of the CPG endpoint, aborting with
+    400 if any are malformed.
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        for value in (start, end):
+            if value is not None:
+                datetime.strptime(value, '%Y-%m-%d')
+        min_gradient = app.config['MIN_GRADIENT']
+        max_gradient = app.config['MAX_GRADIENT']
+        gradients = request.args.get('gradients')
+        if gradients:
+            gradients = tuple(int(gradient) for gradient in gradients.split(','))
+        else:
+            gradients = tuple(range(min_gradient, max_gradient + 1))
+        resolution = int(request.args.get('resolution', DEFAULT_RESOLUTION))
+    except ValueError:
+        abort(400)
+    if not 2 <= resolution <= MAX_RESOLUTION or any(gradient < min_gradient or gradient > max_gradient \
+                             for gradient in gradients):
+        abort(400)
+    return start, end, gradients, resolution
+
+def CPG_curves(user_id, start, end, gradients, resolution):
+    """
+    The user's CPG matrix between two dates (all time if neither is given)
+    reduced to log-spaced times (interpolated between the stored windows)
+    and the requested gradients. Returns the seconds and a (gradients x
+    seconds) float32 array, one curve per row.
+    """
+    if start is None and end is None:
+        matrix = MSMCube(user_id).alltime_max()
+    else:
+        matrix = CPGAggregates(user_id).range_max(start, end)
+    seconds = log_spaced_seconds(resolution, 60*app.config['MAX_MINUTES'])
+    columns = np.array(gradients) - app.config['MIN_GRADIENT']
+    if matrix is None:
+        return seconds, np.zeros((len(columns), len(seconds)), dtype=np.float32)
+    curves = interpolate_msm(np.asarray(matrix)[:, columns], msm_time_axis(), seconds)
+    curves = np.ascontiguousarray(curves.T)
+    return seconds, curves
+
+@app.route('/api/users/<username>/cpg')
+@login_required
+def user_cpg(username):
+    """
+    A user's CPG curves: for each gradient, the fastest speed (meters per
+    second) held for each of a set of log-spaced times, from 1 second to
+    MAX_MINUTES.
+
+    Query arguments:
+        start, end: YYYY-MM-DD dates to restrict the runs to (default all)
+        gradients: comma-separated gradients (slope * 100) (default all)
+        resolution: the number of log-spaced times (default 120, at most
+                    1000)
+        format: 'json' (default), or 'binary' for the little-endian float32
+                (gradients x seconds) array, with the seconds and gradients
+                in the X-CPG-Seconds and X-CPG-Gradients headers
+
+    The ETag and Last-Modified headers come from the user's aggregate
+    version, so a repeat request with If-None-Match gets a 304 until they
+    upload another run.
+    """
+    user = User.query.filter_by(username=username).first_or_404()
+    start, end, gradients, resolution = _parse_args()
+    binary = request.args.get('format', 'json') == 'binary'
+
+    aggregates = CPGAggregates(user.id)
+    version = aggregates.version()
+    arguments = repr((start, end, gradients, resolution, binary)).encode()
+    etag = '{}-{}-{}'.format(user.id, version, \
+                             hashlib.sha1(arguments).hexdigest()[:16])
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        seconds, curves = cached(user.id, 'cpg', CPG_curves, user.id, start, end, \
+                                 gradients, resolution)
+        if binary:
+            response = make_response(curves.astype('<f4').tobytes())
+            response.mimetype = 'application/octet-stream'
+            response.headers['X-CPG-Seconds'] = ','.join(str(s) for s in seconds)
+            response.headers['X-CPG-Gradients'] = ','.join(str(g) for g in gradients)
+        else:
+            response = jsonify({'user': user.username, 'start': start, 'end': end,
+                                'seconds': seconds.tolist(),
+                                'gradients': list(gradients),
+                                'speed': {str(gradient): np.round(curve.astype(float), 3).tolist() \
+                                          for gradient, curve in zip(gradients, curves)}})
+    response.set_etag(etag)
+    response.last_modified = aggregates.updated()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/users/<username>/route-estimate', methods=['POST'])
+@login_required
+def user_route_estimate(username):
+    """
+    How long a user would take over a planned route at a steady effort,
+    from their pace model (see prediction.estimate_route). The route is a
+    GPX file, sent as the multipart field 'file' or as the request body;
+    track points are used if it has any, otherwise route points, and times
+    are ignored.
+
+    Query arguments:
+        split: the length of the splits, in meters (default 1000), from
+               MIN_SPLIT_METERS to MAX_SPLIT_METERS
+
+    Answers 400 if the route is not a GPX file with at least two points,
+    all with a latitude and longitude, and 404 if the user has no runs to fit a pace model to.
+    """
+    user = User.query.filter_by(username=username).first_or_404()
+    try:
+        split_meters = float(request.args.get('split', 1000))
+    except ValueError:
+        abort(400)
+    if not MIN_SPLIT_METERS <= split_meters <= MAX_SPLIT_METERS:
+        abort(400)
+    coefficients = PaceModel(user.id).refresh()
+    if coefficients is None:
+        abort(404)
+
+    upload = request.files.get('file')
+    try:
+        route = read_gpx_route(upload.stream if upload is not None else request.stream)
+    except ParseError:
+        abort(400)
+    if len(route) < 2 or not (np.isfinite(route.latitude).all() \
+                              and np.isfinite(route.longitude).all()):
+        abort(400)
+    estimate = estimate_route(coefficients, route, split_meters)
+    estimate.update(user=user.username, route=route.name)
+    return jsonify(estimate)
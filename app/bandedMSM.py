@@ -0,0 +1,175 @@
+import numpy as np
+
+class BandedMSM(object):
+    """
+    A max speed matrix stored band by band: only the gradient columns the
+    run ever visited, and for each of them only the windows (rows) up to the
+    last non-zero one. A flat run touches a handful of the gradient columns,
+    and every column ends at the longest window spent at that gradient, so
+    most of the dense (time x gradient) matrix is never stored.
+
+    The dense matrix is only built when asked for (to_dense, or anything
+    which calls np.asarray), and np.maximum with a dense array or another
+    BandedMSM works band by band, so reductions over many runs never
+    densify the individual matrices.
+
+    Attributes:
+        n_rows: rows of the dense matrix
+        min_gradient, max_gradient: the gradients of its first and last columns
+        columns: the dense column index of each stored column, ascending
+        lengths: the number of rows stored for each column
+        data: the stored rows of every column, one column after the other
+    """
+    # Makes NumPy defer to __array_ufunc__ in mixed operations
+    __array_priority__ = 20
+
+    def __init__(self, n_rows, min_gradient, max_gradient, columns, lengths, data):
+        self.n_rows = int(n_rows)
+        self.min_gradient = int(min_gradient)
+        self.max_gradient = int(max_gradient)
+        self.columns = np.asarray(columns, dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths, dtype=np.int64)))
+        self._dense = None
+
+    @classmethod
+    def from_dense(cls, msm, min_gradient, max_gradient):
+        msm = np.asarray(msm, dtype=np.float32)
+        nonzero = msm != 0
+        columns = np.flatnonzero(nonzero.any(axis=0))
+        # One past the last non-zero row of each visited column
+        lengths = msm.shape[0] - np.argmax(nonzero[::-1, columns], axis=0)
+        data = np.empty(int(lengths.sum()), dtype=np.float32)
+        offset = 0
+        for column, length in zip(columns, lengths):
+            data[offset:offset + length] = msm[:length, column]
+            offset += length
+        return cls(msm.shape[0], min_gradient, max_gradient, columns, lengths, data)
+
+    def __repr__(self):
+        return '<BandedMSM {} of {} columns, {} of {} cells>'.format( \
+                    len(self.columns), self.shape[1], len(self.data), \
+                    self.shape[0] * self.shape[1])
+
+    @property
+    def shape(self):
+        return (self.n_rows, self.max_gradient - self.min_gradient + 1)
+
+    @property
+    def nbytes(self):
+        return self.columns.nbytes + self.lengths.nbytes + self.data.nbytes
+
+    @property
+    def gradients(self):
+        """
+        The gradients (slope * 100) of the stored columns.
+        """
+        return self.columns + self.min_gradient
+
+    def band(self, i):
+        """
+        The stored rows of the i-th stored column (a view).
+        """
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def column(self, gradient):
+        """
+        The full column for a gradient, as a dense array of n_rows speeds.
+        """
+        result = np.zeros(self.n_rows, dtype=np.float32)
+        i = np.searchsorted(self.columns, gradient - self.min_gradient)
+        if i < len(self.columns) and self.columns[i] == gradient - self.min_gradient:
+            band = self.band(i)
+            result[:len(band)] = band
+        return result
+
+    def to_dense(self):
+        """
+        The dense (time x gradient) matrix, built on first use and then kept.
+        """
+        if self._dense is None:
+            self._dense = self.fold_into(np.zeros(self.shape, dtype=np.float32))
+        return self._dense
+
+    def __array__(self, dtype=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def _check_compatible(self, shape, min_gradient=None):
+        if tuple(shape) != self.shape or (min_gradient is not None and \
+                                          min_gradient != self.min_gradient):
+            raise ValueError('Cannot combine a {} max speed matrix with a {} one' \
+                             .format(self.shape, tuple(shape)))
+
+    def fold_into(self, out):
+        """
+        Folds this matrix into a dense array in place (out = max(out, self)),
+        one band at a time. Returns out.
+        """
+        self._check_compatible(out.shape)
+        for i, (column, length) in enumerate(zip(self.columns, self.lengths)):
+            target = out[:length, column]
+            np.maximum(target, self.band(i), out=target)
+        return out
+
+    def maximum(self, other):
+        """
+        The element-wise maximum with another BandedMSM, as a BandedMSM:
+        the union of the two sets of columns, each as long as the longer of
+        the two bands.
+        """
+        self._check_compatible(other.shape, other.min_gradient)
+        columns = np.union1d(self.columns, other.columns).astype(np.int32)
+        lengths = np.zeros(len(columns), dtype=np.int32)
+        for matrix in (self, other):
+            index = np.searchsorted(columns, matrix.columns)
+            lengths[index] = np.maximum(lengths[index], matrix.lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        data = np.zeros(int(offsets[-1]), dtype=np.float32)
+        for matrix in (self, other):
+            index = np.searchsorted(columns, matrix.columns)
+            for i, j in enumerate(index):
+                band = matrix.band(i)
+                target = data[offsets[j]:offsets[j] + len(band)]
+                np.maximum(target, band, out=target)
+        return BandedMSM(self.n_rows, self.min_gradient, self.max_gradient, \
+                         columns, lengths, data)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        out = kwargs.pop('out', None)
+        if ufunc is not np.maximum or method != '__call__' or kwargs:
+            # Anything but a plain np.maximum works on the dense matrices
+            inputs = [np.asarray(x) if isinstance(x, BandedMSM) else x for x in inputs]
+            if out is not None:
+                kwargs['out'] = tuple(np.asarray(x) if isinstance(x, BandedMSM) else x \
+                                      for x in out)
+            return getattr(ufunc, method)(*inputs, **kwargs)
+
+        banded = [x for x in inputs if isinstance(x, BandedMSM)]
+        dense = [x for x in inputs if not isinstance(x, BandedMSM)]
+        if not dense and out is None:
+            return banded[0].maximum(banded[1])
+        if out is not None:
+            target = out[0]
+            if dense and dense[0] is not target:
+                np.copyto(target, dense[0])
+            elif not dense:
+                target.fill(0)
+        else:
+            target = np.array(dense[0], dtype=np.float32)
+        for matrix in banded:
+            matrix.fold_into(target)
+        return target
+
+def maximum_reduce(matrices, out=None):
+    """
+    The element-wise maximum of any number of max speed matrices (dense
+    arrays or BandedMSMs), folded into out (or a new float32 array) one at a
+    time. BandedMSMs are folded band by band, without being densified.
+    """
+    for matrix in matrices:
+        if out is None:
+            out = np.zeros(matrix.shape, dtype=np.float32)
+        np.maximum(out, matrix, out=out)
+    return out
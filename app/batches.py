@@ -0,0 +1,247 @@
+import os
+import re
+import time
+import tarfile
+import zipfile
+from xml.etree.ElementTree import ParseError
+from app import app, db
+from app.models import Run, Job, Batch
+from app.fileIO import allowed_file, metadata_from_gpx, save_upload, discard_upload
+from app.jobs import enqueue_run, enqueue_import
+
+# Why queue_upload did not queue a run
+DUPLICATE = 'duplicate'
+NO_TRACK = 'no_track'
+INVALID = 'invalid'
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Chunked uploads are named by the client, e.g. with a UUID
+UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+
+def _existing_runs(query):
+    """
+    Sorts the runs matched by query into the first which makes an upload a
+    duplicate (one which is complete, or still has a job queued or running)
+    and the first whose processing failed, which the upload may take over.
+    Returns both (either may be None).
+    """
+    failed = None
+    for run in query:
+        if run.complete or run.jobs.filter(Job.status.in_((Job.QUEUED, Job.RUNNING))) \
+                                   .first() is not None:
+            return run, None
+        failed = failed or run
+    return None, failed
+
+def queue_upload(stream, user_id, batch=None):
+    """
+    Saves an uploaded gpx file (see fileIO.save_upload) and queues a new run
+    for it, unless the user already has a run with identical content, or
+    with the same name, date and time, which is complete or waiting to be
+    processed. A run whose processing failed is queued again with the new
+    file instead. Returns the job (or None) and why no run was queued
+    (DUPLICATE, NO_TRACK, INVALID if the file is not valid GPX, or None).
+    The caller is responsible for committing the session.
+    """
+    gpx_hash, filename, new_file = save_upload(stream, user_id)
+
+    def reject(problem):
+        # Only a file this upload created is deleted, never an existing run's
+        if new_file:
+            discard_upload(filename)
+        return None, problem
+
+    # Identical content short-circuits before the file is even parsed
+    duplicate, failed = _existing_runs(Run.query.filter_by(user_id=user_id, \
+                                                           gpx_hash=gpx_hash))
+    if duplicate is not None:
+        return reject(DUPLICATE)
+    try:
+        name, date, time = metadata_from_gpx(filename)
+    except (ParseError, ValueError):
+        return reject(INVALID)
+    if name is None and date is None:
+        return reject(NO_TRACK)
+    duplicate, failed_by_name = _existing_runs(Run.query.filter_by(name=name, \
+                                    date=date, time=time, user_id=user_id))
+    if duplicate is not None:
+        return reject(DUPLICATE)
+    run = failed or failed_by_name
+    if run is None:
+        run = Run(user_id=user_id, complete=False)
+        db.session.add(run)
+    run.name, run.date, run.time, run.gpx_hash = name, date, time, gpx_hash
+    # Flush so the run has an id for the job to refer to
+    db.session.flush()
+    return enqueue_run(run, filename, batch), None
+
+def archive_type(filename):
+    """
+    'zip', 'tar' or 'gpx' for the files import_archive takes, by their
+    extension, otherwise None.
+    """
+    lowered = filename.lower()
+    if lowered.endswith('.zip'):
+        return 'zip'
+    if lowered.endswith(TAR_SUFFIXES):
+        return 'tar'
+    if allowed_file(filename):
+        return 'gpx'
+    return None
+
+def archive_members(fileobj, filename):
+    """
+    Yields the name, size (None if unknown) and a stream of each gpx file in
+    a zip or tar archive (or of the file itself, if it is a gpx file), one
+    at a time. Tar archives are read strictly front to back, so they need
+    not be seekable; zip archives are read through their central directory.
+    Hidden files (such as the ._ files macOS adds) are left out.
+    """
+    kind = archive_type(filename)
+    if kind == 'gpx':
+        yield filename, None, fileobj
+    elif kind == 'zip':
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if _is_gpx_member(info.filename) and not info.is_dir():
+                    with archive.open(info) as member:
+                        yield info.filename, info.file_size, member
+    elif kind == 'tar':
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for info in archive:
+                if info.isfile() and _is_gpx_member(info.name):
+                    yield info.name, info.size, archive.extractfile(info)
+    else:
+        raise ValueError('{} is not a gpx file or archive'.format(filename))
+
+def _is_gpx_member(name):
+    basename = name.rstrip('/').rsplit('/', 1)[-1]
+    return allowed_file(basename) and not basename.startswith('.')
+
+def new_batch(filename, user_id):
+    batch = Batch(user_id=user_id, filename=filename[:255], files=0, queued=0, \
+                  duplicates=0, invalid=0)
+    db.session.add(batch)
+    db.session.commit()
+    return batch
+
+def import_archive(fileobj, filename, user_id, batch=None):
+    """
+    Queues every gpx file in an archive (see archive_members) as one bulk
+    import batch (a new one unless given), deduplicated as in queue_upload,
+    and returns the Batch.
+    Each file is streamed to GPX_FOLDER in turn, so the archive is never
+    held in memory, and the runs and jobs are committed IMPORT_COMMIT_FILES
+    files at a time: one commit for most archives, while workers can still
+    start on the first runs of a large one before the rest is read. If the
+    archive turns out to be corrupt, the runs queued so far are kept, the
+    file it broke off in is counted as invalid and the error is recorded on
+    the batch.
+    """
+    if batch is None:
+        batch = new_batch(filename, user_id)
+    try:
+        for _, size, stream in archive_members(fileobj, filename):
+            batch.files += 1
+            if size is not None and size > app.config['MAX_GPX_BYTES']:
+                batch.invalid += 1
+            else:
+                _, problem = queue_upload(stream, user_id, batch)
+                if problem == DUPLICATE:
+                    batch.duplicates += 1
+                elif problem in (NO_TRACK, INVALID):
+                    batch.invalid += 1
+                else:
+                    batch.queued += 1
+            if batch.files % app.config['IMPORT_COMMIT_FILES'] == 0:
+                db.session.commit()
+        db.session.commit()
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        # Every file queue_upload got through is still in the session, with
+        # its gpx file saved, so it is committed rather than rolled back
+        batch.invalid = batch.files - batch.queued - batch.duplicates
+        batch.error = '{}: {}'.format(type(e).__name__, e)[:255]
+        db.session.commit()
+    return batch
+
+def chunk_path(user_id, upload_id):
+    return app.config['CHUNK_FOLDER'] + str(user_id) + r'/' + upload_id + '.part'
+
+def expire_chunks(max_age_seconds=None):
+    """
+    Deletes the part files of chunked uploads which have not had a chunk
+    for max_age_seconds (by default CHUNK_EXPIRY_SECONDS).
+    """
+    if max_age_seconds is None:
+        max_age_seconds = app.config['CHUNK_EXPIRY_SECONDS']
+    cutoff = time.time() - max_age_seconds
+    for directory, _, filenames in os.walk(app.config['CHUNK_FOLDER']):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                if filename.endswith('.part') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                # Finished or deleted by another request meanwhile
+                pass
+
+def received_bytes(user_id, upload_id):
+    """
+    How much of a chunked upload has arrived so far, i.e. where the next
+    chunk must start.
+    """
+    try:
+        return os.path.getsize(chunk_path(user_id, upload_id))
+    except OSError:
+        return 0
+
+def append_chunk(user_id, upload_id, stream, start, stop, chunk_bytes=1 << 20):
+    """
+    Appends the bytes [start, stop) of a chunked upload, read from stream, to
+    the upload's part file. Chunks must arrive in order: raises ValueError
+    (and keeps nothing of the chunk) if start is not where the upload got
+    to, or if the stream did not hold exactly stop - start bytes. Returns
+    the number of bytes received so far.
+    """
+    path = chunk_path(user_id, upload_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as part_file:
+        if part_file.tell() != start:
+            raise ValueError('Expected the chunk starting at byte {}'.format(part_file.tell()))
+        for chunk in iter(lambda: stream.read(chunk_bytes), b''):
+            part_file.write(chunk)
+        if part_file.tell() != stop:
+            part_file.truncate(start)
+            raise ValueError('Chunk should have been {} bytes'.format(stop - start))
+        return part_file.tell()
+
+def queue_chunked_upload(user_id, upload_id, filename):
+    """
+    Queues the import of a chunked upload once its last chunk has arrived,
+    as a job (with no run) of a new batch: the part file is moved out of
+    the way of new uploads, and a worker imports it (see import_queued_archive).
+    Returns the Batch, whose counts stay at 0 until then.
+    """
+    batch = new_batch(filename, user_id)
+    archive = str(user_id) + r'/batch-{}.archive'.format(batch.id)
+    os.replace(chunk_path(user_id, upload_id), app.config['CHUNK_FOLDER'] + archive)
+    enqueue_import(batch, archive)
+    db.session.commit()
+    return batch
+
+def import_queued_archive(job):
+    """
+    Runs the import job of a chunked upload (see queue_chunked_upload) into
+    its batch, then deletes the archive. A job run again (see
+    jobs.sweep_stale_jobs) counts the archive's files afresh.
+    """
+    batch = job.batch
+    batch.files = batch.queued = batch.duplicates = batch.invalid = 0
+    batch.error = None
+    path = app.config['CHUNK_FOLDER'] + job.filename
+    try:
+        with open(path, 'rb') as archive:
+            import_archive(archive, batch.filename, batch.user_id, batch)
+    finally:
+        os.remove(path)
@@ -0,0 +1,189 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from app import app
+from app.aggregates import CPGAggregates
+
+class MemoryCache(object):
+    """
+    An in-process LRU cache holding at most max_bytes of pickled values.
+    Keys are tuples whose first element is the user id, so that all of a
+    user's entries can be dropped at once.
+
+    Hit, miss and eviction counters are kept per process.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                self.size -= len(self.entries.pop(key))
+
+    def stats(self):
+        return {'type': 'memory', 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries),
+                'bytes': self.size, 'max_bytes': self.max_bytes}
+
+class FileSystemCache(MemoryCache):
+    """
+    An LRU cache of pickled values under directory, one subdirectory per
+    user, shared by every process using the same directory. Recency is the
+    file's modification time, bumped on every hit; when the total size goes
+    over max_bytes the least recently used files are removed.
+    """
+
+    def __init__(self, directory, max_bytes):
+        super(FileSystemCache, self).__init__(max_bytes)
+        self.directory = directory
+
+    def _user_directory(self, user_id):
+        return self.directory + str(user_id) + r'/'
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key[1:]).encode()).hexdigest()
+        return self._user_directory(key[0]) + digest + '.pkl'
+
+    def _files(self):
+        files = []
+        for user_entry in os.scandir(self.directory):
+            if not user_entry.is_dir():
+                continue
+            for entry in os.scandir(user_entry.path):
+                if entry.name.endswith('.pkl'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                data = cache_file.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as cache_file:
+            cache_file.write(data)
+        os.replace(path + '.tmp', path)
+        self._evict()
+
+    def _evict(self):
+        files = self._files()
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in sorted(files):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= file_size
+            self.evictions += 1
+
+    def delete_user(self, user_id):
+        user_directory = self._user_directory(user_id)
+        if not os.path.isdir(user_directory):
+            return
+        for entry in os.scandir(user_directory):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self):
+        files = self._files() if os.path.isdir(self.directory) else []
+        return {'type': 'filesystem', 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(files),
+                'bytes': sum(file_size for _, file_size, _ in files),
+                'max_bytes': self.max_bytes}
+
+_cache = None
+
+def get_cache():
+    """
+    The configured cache (see CACHE_TYPE), created on first use, or None if
+    caching is turned off.
+    """
+    global _cache
+    cache_type = app.config['CACHE_TYPE']
+    if cache_type is None:
+        return None
+    if _cache is None:
+        if cache_type == 'memory':
+            _cache = MemoryCache(app.config['CACHE_MAX_BYTES'])
+        elif cache_type == 'filesystem':
+            _cache = FileSystemCache(app.config['CACHE_FOLDER'], \
+                                     app.config['CACHE_MAX_BYTES'])
+        else:
+            raise ValueError('Unknown cache type: {}'.format(cache_type))
+    return _cache
+
+def cached(user_id, name, compute, *args):
+    """
+    Returns compute(*args), from the cache if possible. Entries are keyed by
+    the user, their aggregates' version number, name and args, so anything
+    cached before the user's data last changed is never returned, even by
+    another process.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute(*args)
+    key = (user_id, CPGAggregates(user_id).version(), name) + args
+    value = cache.get(key)
+    if value is None:
+        value = compute(*args)
+        cache.set(key, value)
+    return value
+
+def invalidate_user(user_id):
+    """
+    Call after changing anything a user's cached views show. Bumps their
+    aggregates' version, so every process misses on the old entries, and
+    drops the entries from this process's cache. Other users are untouched.
+    """
+    CPGAggregates(user_id).touch()
+    cache = get_cache()
+    if cache is not None:
+        cache.delete_user(user_id)
@@ -0,0 +1,108 @@
+import os
+import time
+import click
+from app import app
+
+@app.cli.command()
+@click.option('--processes', '-p', type=int, default=None, \
+                help='Number of worker processes (defaults to JOB_WORKERS).')
+@click.option('--burst', is_flag=True, \
+                help='Exit once the queue is empty instead of polling.')
+def worker(processes, burst):
+    """Process queued GPX uploads in a pool of worker processes."""
+    from app.jobs import start_workers
+    start_workers(processes, burst=burst)
+
+@app.cli.command()
+@click.option('--processes', '-p', type=int, default=None, \
+                help='Size of the process pool (defaults to one per core).')
+@click.option('--force', is_flag=True, \
+                help='Rebuild every matrix, even those which are current.')
+def reprocess(processes, force):
+    """Rebuild stale max speed matrices for every GPX file in GPX_FOLDER."""
+    from app.fileIO import parse_unparsed_gpx
+    from app.jobs import available_cores
+    processes = processes or available_cores()
+    click.echo('Reprocessing {} on {} processes'.format( \
+                app.config['GPX_FOLDER'], processes))
+    start = time.perf_counter()
+    rebuilt, skipped, failed = parse_unparsed_gpx(processes, force, \
+                                                  report=click.echo)
+    minutes = (time.perf_counter() - start) / 60
+    click.echo('{} runs rebuilt, {} skipped, {} files failed in {:.1f} min ' \
+               '({:.1f} runs/min)'.format(rebuilt, skipped, failed, minutes, \
+                                          rebuilt / minutes if minutes else 0))
+
+@app.cli.command('convert-msm')
+@click.option('--keep-csv', is_flag=True, \
+                help='Keep the csv files after converting them.')
+def convert_msm(keep_csv):
+    """Convert every csv max speed matrix in MSM_FOLDER to the binary format."""
+    from app.fileIO import convert_msm_csv
+    csv_bytes = 0
+    msm_bytes = 0
+    converted = 0
+    for directory, _, filenames in os.walk(app.config['MSM_FOLDER']):
+        for filename in sorted(filenames):
+            if not filename.endswith('.csv'):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                csv_size, msm_size = convert_msm_csv(path, keep_csv)
+            except Exception as e:
+                click.echo('{}: failed ({})'.format(path, e))
+                continue
+            csv_bytes += csv_size
+            msm_bytes += msm_size
+            converted += 1
+    click.echo('Converted {} matrices: {:.1f} MB of csv to {:.1f} MB ' \
+               '({:.0f}x smaller)'.format(converted, csv_bytes / 1e6, \
+                                          msm_bytes / 1e6, \
+                                          csv_bytes / msm_bytes if msm_bytes else 0))
+
+@app.cli.command('rebuild-cubes')
+def rebuild_cubes():
+    """Rebuild every user's max speed matrix cube from their stored matrices."""
+    from app.cube import rebuild_cube
+    from app.models import User
+    from app.prediction import PaceModel
+    for user in User.query.order_by(User.id):
+        added = rebuild_cube(user)
+        PaceModel(user.id).refresh()
+        click.echo('{}: {} runs'.format(user.username, added))
+
+@app.cli.command('stage-timings')
+@click.option('--days', type=int, default=None, \
+                help='Only include runs processed in the last DAYS days.')
+def stage_timings(days):
+    """Report the p50/p95 time and peak RSS of each ingestion stage."""
+    from app.profiling import stage_percentiles
+    click.echo('{:<16} {:>7} {:>10} {:>10} {:>12}'.format('stage', 'runs', \
+                'p50 ms', 'p95 ms', 'peak RSS MB'))
+    for row in stage_percentiles(days):
+        click.echo('{:<16} {:>7} {:>10.1f} {:>10.1f} {:>12}'.format(row['stage'], \
+                    row['count'], 1000*row['p50'], 1000*row['p95'], \
+                    '' if row['peak_rss_mb'] is None else \
+                    '{:.0f}'.format(row['peak_rss_mb'])))
+
+@app.cli.command('profile-gpx')
+@click.argument('path')
+@click.option('--output', '-o', default=None, \
+                help='Also dump the cProfile stats to this file.')
+@click.option('--top', type=int, default=25, \
+                help='Number of functions to list, by cumulative time.')
+def profile_gpx(path, output, top):
+    """Profile the ingestion of one GPX file, without storing anything."""
+    import pstats
+    from app.ingestion import Ingestion
+    from app.profiling import profiled
+    ingestion = Ingestion(path, None)
+    output = output or os.devnull
+    with profiled(output) as profile:
+        ingestion.parse()
+        ingestion.validate()
+        ingestion.clean()
+        ingestion.summarize()
+        ingestion.compute_msm()
+    click.echo('{} points: {}'.format(ingestion.points, ingestion.timings_summary()))
+    pstats.Stats(profile).sort_stats('cumulative').print_stats(top)
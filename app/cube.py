@@ -0,0 +1,230 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from app import app
+from app.dataProcessing import msm_time_axis, interpolate_msm
+
+CUBE_VERSION = 1
+
+class MSMCube(object):
+    """
+    All of a user's max speed matrices, stacked into one memory-mapped
+    (runs x time x gradient) float32 array, together with the element-wise
+    maximum over every run (the user's all-time CPG matrix). New runs are
+    appended in place and folded into the maximum with a single
+    np.maximum, so the all-time CPG never needs to read an individual run.
+
+    Files, under CUBE_FOLDER/<user id>/:
+        runs.f32: the raw cube, one (time x gradient) slab per run
+        max.f32: the running maximum, one (time x gradient) slab
+        meta.json: version, shape, gradient range, time axis (see
+                   dataProcessing.msm_time_axis) and the run id of each slab
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.directory = app.config['CUBE_FOLDER'] + str(user_id) + r'/'
+        self.runs_path = self.directory + 'runs.f32'
+        self.max_path = self.directory + 'max.f32'
+        self.meta_path = self.directory + 'meta.json'
+
+    @staticmethod
+    def _configured_meta():
+        time_axis = msm_time_axis()
+        return {'version': CUBE_VERSION,
+                'min_gradient': app.config['MIN_GRADIENT'],
+                'max_gradient': app.config['MAX_GRADIENT'],
+                'time_step': app.config['RESAMPLE_SECONDS'] or 1,
+                'n_rows': len(time_axis),
+                'time_axis': time_axis.tolist(),
+                'run_ids': []}
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, 'r') as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, meta):
+        with open(self.meta_path + '.tmp', 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def _is_current(self, meta):
+        configured = self._configured_meta()
+        return meta is not None and all(meta.get(key) == configured[key] \
+                    for key in configured if key != 'run_ids')
+
+    @contextmanager
+    def _lock(self):
+        """
+        Serializes writers (e.g. several job workers) on this user's cube.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.directory + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _slab_shape(self, meta):
+        return (meta['n_rows'], meta['max_gradient'] - meta['min_gradient'] + 1)
+
+    def _reset(self):
+        """
+        Starts an empty cube for the configured settings. Called when there is
+        no cube yet, or by rebuild_cube, which then adds every run back.
+        """
+        for path in (self.runs_path, self.max_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        meta = self._configured_meta()
+        np.zeros(self._slab_shape(meta), dtype='<f4').tofile(self.max_path)
+        open(self.runs_path, 'wb').close()
+        self._write_meta(meta)
+        return meta
+
+    def append(self, run_id, msm):
+        """
+        Adds (or replaces) a run's max speed matrix. A new run is written
+        after the last slab and folded into the running maximum. A replaced
+        run is overwritten in place; the maximum is only recomputed from
+        every slab if one of the run's values went down where the old slab
+        held the maximum, so reprocessing runs whose matrices did not change
+        reads one slab each. Returns whether any of the run's values went
+        down (so maxima built from the old slab must be recomputed).
+
+        A cube built with other settings is stale: it is left untouched
+        (and alltime_max and runs return None) until rebuild_cube rebuilds
+        it from every run, so the run is not added and None is returned.
+        """
+        with self._lock():
+            meta = self._read_meta()
+            if meta is None:
+                meta = self._reset()
+            elif not self._is_current(meta):
+                app.logger.warning('The cube of user %s is stale; run flask '
+                                   'rebuild-cubes to include run %s', self.user_id, run_id)
+                return None
+            slab_shape = self._slab_shape(meta)
+            msm = np.asarray(msm, dtype='<f4')
+            if msm.shape != slab_shape:
+                raise ValueError('Expected a {} matrix, got {}'.format( \
+                                    slab_shape, msm.shape))
+
+            replacing = run_id in meta['run_ids']
+            if replacing:
+                index = meta['run_ids'].index(run_id)
+                old = np.array(self._runs(meta)[index])
+            else:
+                index = len(meta['run_ids'])
+            # Write at the slab's offset rather than appending, so that a
+            # slab left over from an interrupted append is simply overwritten
+            with open(self.runs_path, 'r+b') as runs_file:
+                runs_file.seek(index * msm.nbytes)
+                runs_file.write(msm.tobytes())
+
+            running_max = np.memmap(self.max_path, dtype='<f4', mode='r+', \
+                                    shape=slab_shape)
+            lowered = replacing and msm < old
+            if replacing and (lowered & (old >= running_max)).any():
+                del running_max
+                self._rebuild_max(meta)
+            else:
+                np.maximum(running_max, msm, out=running_max)
+                running_max.flush()
+                del running_max
+            if not replacing:
+                meta['run_ids'].append(run_id)
+                self._write_meta(meta)
+            return bool(np.any(lowered))
+
+    def _rebuild_max(self, meta, chunk_runs=64):
+        slab_shape = self._slab_shape(meta)
+        running_max = np.zeros(slab_shape, dtype='<f4')
+        cube = self._runs(meta)
+        for first in range(0, cube.shape[0], chunk_runs):
+            np.maximum(running_max, cube[first:first + chunk_runs].max(axis=0), \
+                       out=running_max)
+        running_max.tofile(self.max_path)
+
+    def _runs(self, meta):
+        n_runs = len(meta['run_ids'])
+        if n_runs == 0:
+            return np.zeros((0,) + self._slab_shape(meta), dtype='<f4')
+        return np.memmap(self.runs_path, dtype='<f4', mode='r', \
+                         shape=(n_runs,) + self._slab_shape(meta))
+
+    def run_ids(self):
+        meta = self._read_meta()
+        return [] if meta is None else meta['run_ids']
+
+    def runs(self):
+        """
+        The whole cube as a read-only (runs x time x gradient) memmap, in the
+        order given by run_ids(). None if the cube is missing or out of date.
+        """
+        meta = self._read_meta()
+        if not self._is_current(meta):
+            return None
+        return self._runs(meta)
+
+    def alltime_max(self):
+        """
+        The running maximum over every run as a read-only (time x gradient)
+        memmap. None if the cube is missing or out of date.
+        """
+        meta = self._read_meta()
+        if not self._is_current(meta):
+            return None
+        return np.memmap(self.max_path, dtype='<f4', mode='r', \
+                         shape=self._slab_shape(meta))
+
+    def alltime_CPG_matrix_df(self):
+        """
+        The user's all-time CPG matrix as a DataFrame, with a row for every
+        second and the gradients (as integers) as columns.
+        """
+        running_max = self.alltime_max()
+        if running_max is None:
+            return None
+        gradient_interval = np.arange(app.config['MIN_GRADIENT'], \
+                                      app.config['MAX_GRADIENT'] + 1)
+        return pd.DataFrame(interpolate_msm(running_max, msm_time_axis()), \
+                            columns=gradient_interval)
+
+def rebuild_cube(user):
+    """
+    Rebuilds a user's cube from scratch out of the max speed matrices of
+    their complete runs (e.g. for runs uploaded before cubes existed), along
+    with their CPG aggregates. Runs whose matrix was computed with other
+    settings are left out until they are reprocessed. Returns the number of
+    runs added.
+    """
+    from app.aggregates import CPGAggregates
+    from app.fileIO import msm_path, load_msm, expand_msm, msm_matches_config
+    from app.models import Run
+    cube = MSMCube(user.id)
+    aggregates = CPGAggregates(user.id)
+    with cube._lock():
+        cube._reset()
+    aggregates.reset()
+    added = 0
+    for run in user.runs.filter_by(complete=True).order_by(Run.id):
+        if not os.path.isfile(msm_path(run)):
+            continue
+        header, block = load_msm(msm_path(run))
+        if not msm_matches_config(header):
+            continue
+        msm = expand_msm(header, block)
+        cube.append(run.id, msm)
+        aggregates.add_run(run, msm)
+        added += 1
+    return added
@@ -2,6 +2,13 @@ import pandas as pd
 import numpy as np
 from app import app
 
+# Numba is optional; without it only the NumPy MSM backend is available
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
 def haversine_np(lon1, lat1, lon2, lat2):
     """
     Calculate the great circle distance between two points
@@ -21,46 +28,360 @@ def haversine_np(lon1, lat1, lon2, lat2):
     km = 6367 * c
     return km * 1000
 
+# Columns of a prepared track, in order (see prep_track)
+TRACK_COLUMNS = ('sec_elapsed', 'Elevation', 'dist_delta_meters', \
+                 'elev_delta_meters', 'time_delta_sec', 'speed_meters_sec', \
+                 'gradient', 'gradient_100')
+
+def _haversine_deltas(latitude, longitude, out, scratch):
+    """
+    Writes the distance in meters from each point to the next into out[1:]
+    (and 0 into out[0]), using the same formula as haversine_np but entirely
+    in place. scratch must be a (3, n) float64 array.
+    """
+    phi, lam, term = scratch
+    np.radians(latitude, out=phi)
+    np.radians(longitude, out=lam)
+    a = out[1:]
+    term = term[1:]
+
+    np.subtract(phi[1:], phi[:-1], out=a)
+    np.multiply(a, 0.5, out=a)
+    np.sin(a, out=a)
+    np.square(a, out=a)
+
+    np.subtract(lam[1:], lam[:-1], out=term)
+    np.multiply(term, 0.5, out=term)
+    np.sin(term, out=term)
+    np.square(term, out=term)
+    np.cos(phi, out=phi)
+    np.multiply(term, phi[1:], out=term)
+    np.multiply(term, phi[:-1], out=term)
+
+    np.add(a, term, out=a)
+    np.sqrt(a, out=a)
+    np.arcsin(a, out=a)
+    np.multiply(a, 2 * 6367 * 1000, out=a)
+    out[0] = 0.0
+
+def _median_filter(values, window):
+    """
+    Running median over window points, with the ends padded by repeating the
+    first and last values. An even window reaches one point further ahead
+    than behind, so every point still gets a median.
+    """
+    padded = np.pad(values, ((window - 1) // 2, window // 2), mode='edge')
+    return np.median(np.lib.stride_tricks.sliding_window_view(padded, window), axis=1)
+
+def resample_track(sec_elapsed, dist_delta, elevation, step, pause_seconds):
+    """
+    Projects a track onto a uniform time grid, one row every step seconds.
+    Cumulative distance and elevation are linearly interpolated onto the grid,
+    so the mean speed over any run of rows is the distance covered divided by
+    the time taken, however often the device logged.
+
+    Gaps between points longer than pause_seconds are treated as pauses: they
+    are collapsed to a single step, so the grid runs on moving time. The
+    distance covered across a pause is kept (so totals stay right), but the
+    rows it lands on get zero speed and gradient, since when it was covered is
+    unknown.
+
+    Returns a (len(TRACK_COLUMNS), rows) block with every column up to and
+    including speed_meters_sec filled in, and the boolean paused rows.
+    """
+    dist_cum = np.cumsum(dist_delta)
+
+    time_delta = np.diff(sec_elapsed, prepend=sec_elapsed[0])
+    pause = time_delta > pause_seconds
+    moving_time = sec_elapsed - np.cumsum(np.where(pause, time_delta - step, 0.0))
+
+    # np.interp needs strictly increasing sample times, so only the first of
+    # several points logged at the same second is kept
+    moving_time, first = np.unique(moving_time, return_index=True)
+    n_rows = int(np.floor(moving_time[-1] / step)) + 1
+    rows = np.empty((len(TRACK_COLUMNS), n_rows))
+    grid, grid_elevation, grid_dist_delta, elev_delta, grid_time_delta, speed = rows[:6]
+
+    np.multiply(np.arange(n_rows), step, out=grid)
+    grid_elevation[:] = np.interp(grid, moving_time, elevation[first])
+    grid_dist_delta[:] = np.interp(grid, moving_time, dist_cum[first])
+
+    # Flag every grid row whose interval overlaps a (collapsed) pause
+    pause_end = moving_time[pause[first]]
+    first_row = np.searchsorted(grid, pause_end - step, side='right')
+    last_row = np.searchsorted(grid, pause_end, side='left')
+    paused = np.zeros(n_rows + 1, dtype=np.int64)
+    np.add.at(paused, np.minimum(first_row, n_rows), 1)
+    np.add.at(paused, np.minimum(last_row + 1, n_rows), -1)
+    paused = np.cumsum(paused[:-1]) > 0
+
+    # Cumulative distance to deltas, in place
+    grid_dist_delta[1:] = np.diff(grid_dist_delta)
+    grid_dist_delta[0] = 0.0
+    np.subtract(grid_elevation[1:], grid_elevation[:-1], out=elev_delta[1:])
+    elev_delta[0] = 0.0
+    grid_time_delta.fill(float(step))
+    grid_time_delta[0] = 0.0
+    np.divide(grid_dist_delta, step, out=speed)
+    speed[paused] = 0.0
+    speed[0] = 0.0
+    return rows, paused
+
+def prep_track(time, latitude, longitude, elevation, resample_seconds=None, \
+               pause_seconds=None, elevation_window=None, max_speed=None, \
+               max_gradient=1):
+    """
+    Computes distance, elevation, time and speed deltas and the gradient of
+    a track in one vectorized pass over contiguous arrays, writing into
+    preallocated blocks rather than building a column at a time.
+
+    Attributes:
+        time: int64 nanoseconds (or datetime64[ns]) for each point
+        latitude, longitude, elevation: float64 arrays
+        resample_seconds: if set, the track is resampled onto a uniform grid
+                            with this step (see resample_track)
+        pause_seconds: gaps longer than this are pauses (when resampling)
+        elevation_window: if set, elevation is median-filtered over this many
+                            points first, to take out barometer/GPS noise
+        max_speed: if set, speeds above this (meters per second) are capped
+        max_gradient: gradients steeper than this (as a ratio) are replaced
+                        by the median gradient
+
+    Returns a dictionary mapping TRACK_COLUMNS (and 'paused', when
+    resampling) to arrays; the float columns are views of a single block.
+    """
+    time = np.ascontiguousarray(time).view(np.int64)
+    latitude = np.ascontiguousarray(latitude, dtype=np.float64)
+    longitude = np.ascontiguousarray(longitude, dtype=np.float64)
+    elevation = np.ascontiguousarray(elevation, dtype=np.float64)
+    n = len(latitude)
+
+    points = np.empty((2, n))
+    sec_elapsed, dist_delta = points
+    np.subtract(time, time[0], out=sec_elapsed, casting='unsafe')
+    np.multiply(sec_elapsed, 1e-9, out=sec_elapsed)
+    _haversine_deltas(latitude, longitude, dist_delta, np.empty((3, n)))
+    if elevation_window:
+        elevation = _median_filter(elevation, elevation_window)
+
+    if resample_seconds:
+        rows, paused = resample_track(sec_elapsed, dist_delta, elevation, \
+                                      resample_seconds, pause_seconds)
+        row_sec_elapsed, row_elevation, row_dist_delta, elev_delta, \
+            time_delta, speed, gradient, gradient_100 = rows
+    else:
+        paused = None
+        rows = np.empty((len(TRACK_COLUMNS), n))
+        row_sec_elapsed, row_elevation, row_dist_delta, elev_delta, \
+            time_delta, speed, gradient, gradient_100 = rows
+        row_sec_elapsed[:] = sec_elapsed
+        row_elevation[:] = elevation
+        row_dist_delta[:] = dist_delta
+        np.subtract(elevation[1:], elevation[:-1], out=elev_delta[1:])
+        elev_delta[0] = 0.0
+        np.subtract(sec_elapsed[1:], sec_elapsed[:-1], out=time_delta[1:])
+        time_delta[0] = 0.0
+        # 0/0 (no movement, no time) is a speed of 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(row_dist_delta, time_delta, out=speed)
+        np.nan_to_num(speed, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+    if max_speed:
+        np.minimum(speed, max_speed, out=speed)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(elev_delta, row_dist_delta, out=gradient)
+    np.nan_to_num(gradient, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+    if paused is not None:
+        gradient[paused] = 0.0
+
+    # Replace any gradient steeper than max_gradient (including the infinite
+    # ones from climbing on the spot) with the median gradient
+    np.abs(gradient, out=gradient_100)
+    too_steep = gradient_100 > max_gradient
+    if too_steep.any():
+        gradient[too_steep] = np.median(gradient)
+    np.multiply(gradient, 100, out=gradient_100)
+
+    columns = dict(zip(TRACK_COLUMNS, rows))
+    if paused is not None:
+        columns['paused'] = paused
+    return columns
+
+def track_df(time, latitude, longitude, elevation):
+    """
+    Runs prep_track with the configured cleaning settings and returns the
+    result as a DataFrame.
+    """
+    columns = prep_track(time, latitude, longitude, elevation, \
+                         resample_seconds=app.config['RESAMPLE_SECONDS'], \
+                         pause_seconds=app.config['PAUSE_SECONDS'], \
+                         elevation_window=app.config['ELEVATION_FILTER_POINTS'], \
+                         max_speed=app.config['MAX_SPEED_METERS_SEC'])
+    return pd.DataFrame(columns)
+
 def prep_df(df):
     """
     Parses, cleans and formats the data coming from the converted csv file.
+    When RESAMPLE_SECONDS is set the track is first resampled onto a uniform
+    time grid (see resample_track), so that one row is RESAMPLE_SECONDS
+    seconds; otherwise one row is one GPX point. Returns a new DataFrame
+    with the columns in TRACK_COLUMNS.
     """
-    # Compute time elapsed in seconds
-    start_time = pd.to_datetime(df['Timestamp'].iloc[0])
-    current_time = pd.to_datetime(df['Timestamp'])
-    df['sec_elapsed'] = (current_time - start_time) / np.timedelta64(1, 's')
+    timestamps = pd.to_datetime(df['Timestamp'])
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert(None)
+    return track_df(timestamps.values.astype('M8[ns]'), df['Latitude'].values, \
+                    df['Longitude'].values, df['Elevation'].values)
 
-    # Compute distance delta in meters
-    df['dist_delta_meters'] = haversine_np(df.Longitude.shift(), df.Latitude.shift(), \
-                                 df.loc[1:, 'Longitude'], df.loc[1:, 'Latitude']).fillna(0.0)
+def route_profile(latitude, longitude, elevation, segment_meters, \
+                  elevation_window=None, max_gradient=1):
+    """
+    Cuts a planned route (points without times) into equal segments of at
+    most segment_meters, for pace prediction. Distances come from the same
+    in-place haversine as prep_track, and elevation gets the same optional
+    median filter. Each segment's gradient is its net elevation change over
+    its length, so noise between points averages out, and segments steeper
+    than max_gradient (as a ratio) take the median gradient, as in
+    prep_track. Missing elevations are interpolated (or taken as flat).
 
-    # Compute the elevation difference (in meters) between successive points
-    df['elev_delta_meters'] = df['Elevation'].diff().fillna(0.0)
+    Returns the cumulative distance (meters) at the start of each segment
+    and at the end of the route, the elevation there, and the gradient
+    (slope * 100) of each segment.
+    """
+    latitude = np.ascontiguousarray(latitude, dtype=np.float64)
+    longitude = np.ascontiguousarray(longitude, dtype=np.float64)
+    elevation = np.array(elevation, dtype=np.float64)
+    n = len(latitude)
 
-    # Compute the time difference (in seconds) between successive points (NEEDS SPEED-UP WORK DONE)
-    df['time_delta_sec'] = pd.to_datetime(df['Timestamp']).diff().fillna(0.0) / np.timedelta64(1, 's')
+    distance = np.empty(n)
+    _haversine_deltas(latitude, longitude, distance, np.empty((3, n)))
+    np.cumsum(distance, out=distance)
+    known = np.isfinite(elevation)
+    if not known.any():
+        elevation[:] = 0.0
+    elif not known.all():
+        elevation[~known] = np.interp(distance[~known], distance[known], elevation[known])
+    if elevation_window:
+        elevation = _median_filter(elevation, elevation_window)
 
-    # Compute instantaneous speed (in meters per second)
-    df['speed_meters_sec'] = df['dist_delta_meters'] / df['time_delta_sec']
-    df['speed_meters_sec'] = df['speed_meters_sec'].fillna(0.0)
+    n_segments = max(1, int(np.ceil(distance[-1] / segment_meters)))
+    edges = np.linspace(0.0, distance[-1], n_segments + 1)
+    edge_elevation = np.interp(edges, distance, elevation)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gradient = np.diff(edge_elevation) / np.diff(edges)
+    np.nan_to_num(gradient, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    too_steep = np.abs(gradient) > max_gradient
+    if too_steep.any():
+        gradient[too_steep] = np.median(gradient)
+    return edges, edge_elevation, 100 * gradient
 
-    # Compute gradient (unitless)
-    df['gradient'] = df['elev_delta_meters'] / df['dist_delta_meters']
-    df['gradient'].fillna(0.0, inplace=True)
-    df['gradient_100'] = 100*df['gradient']
+# Best efforts stored on each run: column -> duration in seconds
+BEST_EFFORTS = (('best_speed_1min', 60), ('best_speed_5min', 300), \
+                ('best_speed_20min', 1200), ('best_speed_60min', 3600))
+# Gradient histogram stored on each run (as meters run in each bin): the bin
+# edges (slope * 100) and the column of each bin
+GRADIENT_BIN_EDGES = (-10, -3, 3, 10)
+GRADIENT_BIN_COLUMNS = ('distance_steep_downhill', 'distance_downhill', \
+                        'distance_flat', 'distance_uphill', 'distance_steep_uphill')
+# Every column set by summarize_track
+SUMMARY_COLUMNS = ('distance', 'elevation_gain', 'elevation_loss', 'moving_time', \
+                   'elapsed_time') + tuple(column for column, _ in BEST_EFFORTS) \
+                   + GRADIENT_BIN_COLUMNS
 
-    df.drop(['Latitude', 'Longitude'], axis=1, inplace=True)
+def elevation_change(elevation, hysteresis):
+    """
+    Total ascent and descent (in meters) of an elevation profile, ignoring
+    any up-and-down smaller than hysteresis meters. The profile is passed
+    through a backlash (play) filter of width hysteresis, which only moves
+    once the elevation has moved hysteresis / 2 away from it, and the gain
+    and loss are those of the filtered profile. The filter is inherently
+    sequential, but over a stretch where the elevation only rises (or only
+    falls) it ends up where the last point alone would take it, so only the
+    turning points of the profile, found in one vectorized pass, are looped
+    over: a few dozen for a typical run, rather than a point per second.
+    """
+    half_width = hysteresis / 2.0
+    values = np.asarray(elevation, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    if len(values) > 2:
+        values = values[np.concatenate(([True], np.diff(values) != 0))]
+        slope = np.diff(values)
+        turning = np.ones(len(values), dtype=bool)
+        turning[1:-1] = slope[:-1] * slope[1:] < 0
+        values = values[turning]
+    values = values.tolist()
+    if not values:
+        return 0.0, 0.0
+    gain = loss = 0.0
+    filtered = values[0]
+    for value in values:
+        if value - half_width > filtered:
+            gain += value - half_width - filtered
+            filtered = value - half_width
+        elif value + half_width < filtered:
+            loss += filtered - value - half_width
+            filtered = value + half_width
+    return gain, loss
 
-    max_gradient = 1 # Set a maximum gradient of 1 (45 degrees)
-    bad_index = df['gradient'].loc[np.abs(df['gradient']) > max_gradient].index
-    if len(bad_index) == 0:
-        pass
-    else:
-        df['gradient'].loc[bad_index] = np.median(df['gradient'].values)
+def summarize_track(columns, elapsed_seconds, step=None, hysteresis=None, \
+                    moving_speed=None):
+    """
+    Summary statistics of a prepared track (see prep_track), as a dictionary
+    mapping SUMMARY_COLUMNS to values, ready to be set on its Run.
+
+    Attributes:
+        columns: the prepared track, as a dictionary of arrays or a DataFrame
+        elapsed_seconds: the time from the first to the last point, pauses
+                            included (which a resampled track no longer has)
+        step: the resampling step in seconds, if the track was resampled;
+                otherwise each row is taken to be a second, as in the MSM
+        hysteresis: see elevation_change, defaults to ELEVATION_HYSTERESIS
+        moving_speed: rows slower than this (meters per second) don't count
+                        towards moving time, defaults to MOVING_SPEED_METERS_SEC
+    """
+    if hysteresis is None:
+        hysteresis = app.config['ELEVATION_HYSTERESIS']
+    if moving_speed is None:
+        moving_speed = app.config['MOVING_SPEED_METERS_SEC']
+    step = step or 1
+    speed = np.asarray(columns['speed_meters_sec'], dtype=np.float64)
+    dist_delta = np.asarray(columns['dist_delta_meters'], dtype=np.float64)
+    time_delta = np.asarray(columns['time_delta_sec'], dtype=np.float64)
+    moving = speed >= moving_speed
+    if 'paused' in columns:
+        moving &= ~np.asarray(columns['paused'])
+
+    summary = {'distance': float(dist_delta.sum()),
+               'moving_time': float(time_delta[moving].sum()),
+               'elapsed_time': float(elapsed_seconds)}
+    summary['elevation_gain'], summary['elevation_loss'] = \
+        elevation_change(columns['Elevation'], hysteresis)
+
+    # Non-finite speeds (distance covered in no time) count as standing still
+    speed_cumsum = np.concatenate(([0.0], np.cumsum(np.where(np.isfinite(speed), \
+                                                               speed, 0.0))))
+    for column, seconds in BEST_EFFORTS:
+        window = int(np.ceil(seconds / step))
+        if window > len(speed):
+            summary[column] = None
+        else:
+            best = (speed_cumsum[window:] - speed_cumsum[:-window]).max() / window
+            summary[column] = float(best)
 
-    return df
+    bins = np.digitize(columns['gradient_100'], GRADIENT_BIN_EDGES)
+    distances = np.bincount(bins, weights=dist_delta, \
+                            minlength=len(GRADIENT_BIN_COLUMNS))
+    for column, distance in zip(GRADIENT_BIN_COLUMNS, distances):
+        summary[column] = float(distance)
+    return summary
 
 def rolling_max_speed(rolling_window, df):
+    """
+    Reference implementation of a single row of the max speed matrix, using a
+    pandas rolling mean and a groupby. Kept so the vectorized engine below can
+    be checked against it; it is far too slow to use on the upload path.
+    """
     rolling_df = df[['speed_meters_sec', 'gradient_100']].rolling(window=rolling_window).mean().fillna(0)
     rolling_df['rounded_gradient_100'] = rolling_df['gradient_100'].apply(np.round)
     rolling_groupby = rolling_df.groupby('rounded_gradient_100')
@@ -69,13 +390,244 @@ def rolling_max_speed(rolling_window, df):
                             for name, group in rolling_groupby}
     return max_speed
 
+def msm_time_axis():
+    """
+    The window lengths, in seconds, of the rows of a max speed matrix: every
+    second up to MSM_DENSE_SECONDS, then MSM_WINDOWS_PER_DOUBLING
+    geometrically spaced windows (rounded to whole seconds) per doubling, up
+    to and including MAX_MINUTES. A row every second if MSM_DENSE_SECONDS is
+    None.
+    """
+    max_seconds = 60*app.config['MAX_MINUTES']
+    dense_seconds = app.config['MSM_DENSE_SECONDS']
+    windows_per_doubling = app.config['MSM_WINDOWS_PER_DOUBLING']
+    if dense_seconds is None or dense_seconds >= max_seconds:
+        return np.arange(max_seconds + 1)
+    n_windows = int(np.ceil(np.log2(max_seconds / dense_seconds) * windows_per_doubling))
+    spaced = np.rint(np.geomspace(dense_seconds, max_seconds, n_windows + 1))
+    return np.union1d(np.arange(dense_seconds + 1), spaced.astype(np.int64))
+
+def interpolate_msm(msm, time_axis, seconds=None):
+    """
+    The rows of a max speed matrix stored on time_axis (see msm_time_axis)
+    at any whole numbers of seconds (by default every second up to the
+    longest window), interpolated linearly in time between the two stored
+    windows either side. Rows which are stored are returned exactly.
+    """
+    msm = np.asarray(msm)
+    time_axis = np.asarray(time_axis)
+    if seconds is None:
+        seconds = np.arange(time_axis[-1] + 1)
+    seconds = np.asarray(seconds)
+    if len(time_axis) == time_axis[-1] + 1:
+        # A row every second, nothing to interpolate
+        return msm[seconds]
+    right = np.clip(np.searchsorted(time_axis, seconds), 1, len(time_axis) - 1)
+    left = right - 1
+    weight = ((seconds - time_axis[left]) / (time_axis[right] - time_axis[left]))
+    weight = weight.astype(np.float32)[:, None]
+    return msm[left] * (1 - weight) + msm[right] * weight
+
+def _window_lengths(windows):
+    # An integer n stands for every window from 0 to n
+    if np.ndim(windows) == 0:
+        return np.arange(int(windows) + 1)
+    return np.asarray(windows, dtype=np.int64)
+
+def max_speed_matrix(speed, gradient_100, windows, min_gradient, \
+                        max_gradient, step=None, block_cells=None, backend=None):
+    """
+    Computes the (window x gradient) max speed matrix from cumulative sums.
+    Each row holds, for each rounded gradient, the fastest mean speed over
+    any run of consecutive points as long as that row's window. Only the
+    windows asked for are computed. The work is done by one of
+    MSM_BACKENDS: the NumPy one processes windows in blocks so that at most
+    block_cells (window, position) pairs are held in memory at once,
+    scatter-maxing each block into a preallocated float32 array; the Numba
+    one fuses everything into a compiled loop per window.
+
+    Windows containing a non-finite gradient are binned at gradient 0, which
+    is what the pandas rolling mean (NaN, then fillna(0)) used to do.
+
+    If step is given the track must be uniformly sampled every step seconds
+    (see resample_track), and windows are measured in seconds rather than in
+    points: a window of t seconds then holds the fastest mean speed over any
+    ceil(t / step) consecutive rows, i.e. over the shortest whole number of
+    samples covering t seconds.
+
+    Attributes:
+        speed: array of instantaneous speeds (meters per second)
+        gradient_100: array of gradients (slope * 100), same length as speed
+        windows: the ascending window lengths (in points, or seconds if step
+                 is given) to compute, one row each (see msm_time_axis), or
+                 an integer n for every window from 0 to n
+        min_gradient, max_gradient: the gradient range kept as columns
+        step: the sampling interval in seconds of a uniformly sampled track
+        block_cells: memory budget per block, defaults to MSM_BLOCK_CELLS
+        backend: name of the backend to use, defaults to MSM_BACKEND
+    """
+    windows = _window_lengths(windows)
+    if step is not None and step != 1:
+        points, rows = np.unique(np.ceil(windows / step).astype(np.int64), \
+                                 return_inverse=True)
+        msm = max_speed_matrix(speed, gradient_100, points, \
+                                min_gradient, max_gradient, \
+                                block_cells=block_cells, backend=backend)
+        return msm[rows]
+
+    return msm_backend(backend)(speed, gradient_100, windows, \
+                                min_gradient, max_gradient, block_cells)
+
+def _gradient_cumsums(gradient_100):
+    """
+    Cumulative sums of the gradients (with non-finite ones zeroed, so they
+    cannot poison the sum) and of the number of non-finite gradients.
+    """
+    bad_gradient = ~np.isfinite(gradient_100)
+    gradient_cumsum = np.concatenate(([0.0], \
+                        np.cumsum(np.where(bad_gradient, 0.0, gradient_100))))
+    bad_cumsum = np.concatenate(([0], np.cumsum(bad_gradient)))
+    return gradient_cumsum, bad_cumsum
+
+def max_speed_matrix_numpy(speed, gradient_100, windows, min_gradient, \
+                           max_gradient, block_cells=None):
+    """
+    NumPy backend for max_speed_matrix: rolling means from cumulative sums,
+    a block of windows at a time, scatter-maxed into the matrix.
+    """
+    if block_cells is None:
+        block_cells = app.config['MSM_BLOCK_CELLS']
+    windows = _window_lengths(windows)
+    speed = np.asarray(speed, dtype=np.float64)
+    gradient_100 = np.asarray(gradient_100, dtype=np.float64)
+    n = len(speed)
+    n_gradients = max_gradient - min_gradient + 1
+    msm = np.zeros((len(windows), n_gradients), dtype=np.float32)
+    msm_flat = msm.reshape(-1)
+
+    speed_cumsum = np.concatenate(([0.0], np.cumsum(speed)))
+    gradient_cumsum, bad_cumsum = _gradient_cumsums(gradient_100)
+
+    # Windows longer than the run never fill, so their rows stay at zero
+    rows = np.flatnonzero((windows >= 1) & (windows <= n))
+    block_size = max(1, block_cells // max(n, 1))
+    for first in range(0, len(rows), block_size):
+        block_rows = rows[first:first + block_size]
+        block_windows = windows[block_rows]
+        ends = np.arange(block_windows.min(), n + 1)
+        starts = ends[None, :] - block_windows[:, None]
+        valid = starts >= 0
+        starts = np.maximum(starts, 0)
+
+        mean_speed = (speed_cumsum[ends] - speed_cumsum[starts]) / block_windows[:, None]
+        mean_gradient = (gradient_cumsum[ends] - gradient_cumsum[starts]) / block_windows[:, None]
+        mean_gradient[(bad_cumsum[ends] - bad_cumsum[starts]) > 0] = 0.0
+
+        columns = np.rint(mean_gradient) - min_gradient
+        keep = valid & (columns >= 0) & (columns < n_gradients)
+        cells = block_rows[:, None] * n_gradients + columns.astype(np.int64)
+        np.maximum.at(msm_flat, cells[keep], mean_speed[keep].astype(np.float32))
+
+    return msm
+
+def _msm_kernel(speed_cumsum, gradient_cumsum, bad_cumsum, windows, msm, min_gradient):
+    """
+    Fills msm in place, one window length (row) per iteration: the rolling
+    mean speed and gradient, the gradient column and the running max are
+    computed together for every position of the window. Rows are
+    independent, so they are spread over threads when compiled with
+    parallel=True.
+    """
+    n = len(speed_cumsum) - 1
+    n_gradients = msm.shape[1]
+    for i in prange(len(windows)):
+        window = windows[i]
+        if window < 1 or window > n:
+            continue
+        row = msm[i]
+        for end in range(window, n + 1):
+            start = end - window
+            if bad_cumsum[end] - bad_cumsum[start] > 0:
+                mean_gradient = 0.0
+            else:
+                mean_gradient = (gradient_cumsum[end] - gradient_cumsum[start]) / window
+            column = int(np.rint(mean_gradient)) - min_gradient
+            if column < 0 or column >= n_gradients:
+                continue
+            mean_speed = np.float32((speed_cumsum[end] - speed_cumsum[start]) / window)
+            if mean_speed > row[column]:
+                row[column] = mean_speed
+
+def max_speed_matrix_numba(speed, gradient_100, windows, min_gradient, \
+                           max_gradient, block_cells=None):
+    """
+    Numba backend for max_speed_matrix: the same cumulative sums as the
+    NumPy backend, with the rest fused into one compiled loop per window
+    (see _msm_kernel), so no (window, position) blocks are materialized.
+    block_cells is accepted for compatibility and ignored.
+    """
+    windows = _window_lengths(windows)
+    speed = np.asarray(speed, dtype=np.float64)
+    gradient_100 = np.asarray(gradient_100, dtype=np.float64)
+    msm = np.zeros((len(windows), max_gradient - min_gradient + 1), dtype=np.float32)
+    speed_cumsum = np.concatenate(([0.0], np.cumsum(speed)))
+    gradient_cumsum, bad_cumsum = _gradient_cumsums(gradient_100)
+    _compiled_msm_kernel(speed_cumsum, gradient_cumsum, bad_cumsum, windows, \
+                         msm, min_gradient)
+    return msm
+
+# Available max_speed_matrix backends, by name (see MSM_BACKEND)
+MSM_BACKENDS = {'numpy': max_speed_matrix_numpy}
+if njit is not None:
+    _compiled_msm_kernel = njit(parallel=True, cache=True, nogil=True)(_msm_kernel)
+    MSM_BACKENDS['numba'] = max_speed_matrix_numba
+
+def msm_backend(name=None):
+    """
+    Returns the max_speed_matrix backend called name (by default the
+    configured MSM_BACKEND), falling back to the NumPy one when it is not
+    available.
+    """
+    if name is None:
+        name = app.config['MSM_BACKEND']
+    if name not in MSM_BACKENDS:
+        if name != 'numba':
+            raise ValueError('Unknown MSM backend: {}'.format(name))
+        name = 'numpy'
+    return MSM_BACKENDS[name]
+
 def compute_max_speed_df(df):
+    """
+    A track's max speed matrix as a DataFrame, with rows indexed by the
+    window lengths of msm_time_axis (in seconds) and the gradients (as
+    integers) as columns. Use interpolate_msm for a row every second.
+    """
+    time_interval = msm_time_axis()
+    min_gradient = app.config['MIN_GRADIENT']
+    max_gradient = app.config['MAX_GRADIENT']
+    gradient_interval = np.arange(min_gradient, max_gradient + 1)
+    if 'speed_meters_sec' not in df:
+        df = prep_df(df)
+    msm = max_speed_matrix(df['speed_meters_sec'].values, \
+                            df['gradient_100'].values, time_interval, \
+                            min_gradient, max_gradient, \
+                            step=app.config['RESAMPLE_SECONDS'] or None)
+    max_speed_df = pd.DataFrame(msm, index=time_interval, \
+                                columns=gradient_interval)
+    return max_speed_df
+
+def compute_max_speed_df_rolling(df):
+    """
+    The original rolling/groupby construction of the max speed matrix, one
+    pandas pass per window size. Only used to check max_speed_matrix.
+    """
     minutes = app.config['MAX_MINUTES']
     time_interval = np.arange(60*minutes + 1)
     min_gradient = app.config['MIN_GRADIENT']
     max_gradient = app.config['MAX_GRADIENT']
     gradient_interval = np.arange(min_gradient, max_gradient + 1)
-    df = prep_df(df)
+    if 'speed_meters_sec' not in df:
+        df = prep_df(df)
     # Compute the maximum speed over all gradients which appear...
     max_speed_matrix = pd.DataFrame([rolling_max_speed(t, df) \
                                     for t in time_interval]).fillna(0)
@@ -0,0 +1,40 @@
+import sqlite3
+import flask_sqlalchemy
+from sqlalchemy.pool import NullPool, QueuePool
+
+def sqlite_engine_options(path, pragmas=(), pool_size=None, max_overflow=0):
+    """
+    create_engine options for a SQLite database file. Every new connection
+    runs the given (name, value) pragmas first. With a pool_size,
+    connections are kept in a QueuePool and may be handed from one thread
+    to the next; without one, each checkout opens (and sets up) a fresh
+    connection, which is what SQLAlchemy does for SQLite files by default.
+    """
+    def connect():
+        connection = sqlite3.connect(path, check_same_thread=False)
+        for name, value in pragmas:
+            connection.execute('PRAGMA {} = {}'.format(name, value))
+        return connection
+
+    options = {'creator': connect}
+    if pool_size:
+        options.update(poolclass=QueuePool, pool_size=pool_size, \
+                       max_overflow=max_overflow)
+    else:
+        options['poolclass'] = NullPool
+    return options
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """
+    Flask-SQLAlchemy, with SQLite database files opened as set out by
+    SQLITE_PRAGMAS, SQLITE_POOL_SIZE and SQLITE_MAX_OVERFLOW (see
+    sqlite_engine_options). Other databases are left as they were.
+    """
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername == 'sqlite' and sa_url.database not in (None, '', ':memory:'):
+            options.update(sqlite_engine_options(sa_url.database, \
+                                app.config['SQLITE_PRAGMAS'], \
+                                app.config['SQLITE_POOL_SIZE'], \
+                                app.config['SQLITE_MAX_OVERFLOW']))
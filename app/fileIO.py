@@ -1,16 +1,76 @@
-import gpxpy # Used for reading gpx files
+import hashlib
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 import numpy as np
-import app.dataProcessing
 from app import app
-from datetime import datetime
-from app.dataProcessing import compute_max_speed_df, prep_df
+from app.gpxReader import read_gpx_metadata, read_gpx_track
+from app.bandedMSM import BandedMSM
+from app.dataProcessing import interpolate_msm, msm_time_axis, prep_df, \
+                                compute_max_speed_df
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def save_upload(stream, user_id, chunk_bytes=1 << 20):
+    """
+    Copies an uploaded file to GPX_FOLDER/<user id>/<sha256>.gpx, hashing it
+    in the same pass. Identical content from the same user always lands on
+    the same file, so nothing is ever overwritten by a different upload, and
+    a file already there is left alone (keeping its mtime, which
+    msm_is_current compares against). Returns the hex digest, the filename
+    (relative to GPX_FOLDER) and whether the file is new.
+    """
+    user_directory = app.config['GPX_FOLDER'] + str(user_id) + r'/'
+    os.makedirs(user_directory, exist_ok=True)
+    sha256 = hashlib.sha256()
+    temporary_path = user_directory + 'upload-{}-{}.tmp'.format(os.getpid(), \
+                                                              threading.get_ident())
+    try:
+        with open(temporary_path, 'wb') as gpxfile:
+            for chunk in iter(lambda: stream.read(chunk_bytes), b''):
+                sha256.update(chunk)
+                gpxfile.write(chunk)
+    except Exception:
+        # E.g. a corrupt archive member (see batches.import_archive)
+        os.remove(temporary_path)
+        raise
+    digest = sha256.hexdigest()
+    filename = str(user_id) + r'/' + digest + '.gpx'
+    created = not os.path.isfile(app.config['GPX_FOLDER'] + filename)
+    if created:
+        os.replace(temporary_path, app.config['GPX_FOLDER'] + filename)
+    else:
+        os.remove(temporary_path)
+    return digest, filename, created
+
+def discard_upload(filename):
+    """
+    Deletes a file saved by save_upload which no run is going to use.
+    """
+    try:
+        os.remove(app.config['GPX_FOLDER'] + filename)
+    except OSError:
+        pass
+
+def list_gpx_files():
+    """
+    All gpx files under GPX_FOLDER, including the per-user directories, as
+    filenames relative to GPX_FOLDER.
+    """
+    gpx_directory = app.config['GPX_FOLDER']
+    gpx_files = []
+    for directory, _, filenames in os.walk(gpx_directory):
+        relative_directory = os.path.relpath(directory, gpx_directory)
+        for filename in filenames:
+            if allowed_file(filename):
+                if relative_directory != '.':
+                    filename = relative_directory + r'/' + filename
+                gpx_files.append(filename)
+    return sorted(gpx_files)
+
 def metadata_from_gpx(filename):
     """
     Gets the name, date and time from a gpx file, given the filename. Returns
@@ -21,62 +81,47 @@ def metadata_from_gpx(filename):
     if os.path.isfile(gpx_directory + filename) == False:
         return None, None, None
     else:
-        gpstracks = []
-        with open(gpx_directory + filename, 'r') as gpxfile:
-            gpx = gpxpy.parse(gpxfile)
-            name = gpx.tracks[0].name
-            timestamp = gpx.tracks[0].segments[0].points[0].time
-            date = timestamp.date()
-            time = timestamp.time()
-        return name, date, time
+        # Only reads as far as the first track point
+        return read_gpx_metadata(gpx_directory + filename)
 
 def gpx_to_csv_to_msm(run, filename):
-    df = gpx_to_csv(run, filename)
-    max_speed_df = compute_max_speed_df(df)
-    date = run.date.isoformat()
-    write_max_speed_matrix(max_speed_df, run, date)
-
-    distance = df['dist_delta_meters'].sum()
-    elevation_gain = 0 # Still need to compute this
-
+    """
+    Parses a run's gpx file once and computes and stores its max speed
+    matrix (see ingestion.Ingestion). Returns the run's summary
+    statistics.
+    """
+    from app.ingestion import Ingestion
+    ingestion = Ingestion(app.config['GPX_FOLDER'] + filename, run.user_id)
+    ingestion.parse()
+    ingestion.validate()
+    ingestion.clean()
+    ingestion.summarize()
+    ingestion.compute_msm()
     # It's a little ugly to just randomly return this data from this IO method...
-    return distance, elevation_gain
+    return ingestion.persist(run)
 
 def gpx_to_csv(run, filename):
     """
-    Parse a GPX file into a list of dictonaries, convert it to a Pandas data
+    Stream a GPX file into NumPy arrays, convert them to a Pandas data
     frame, then write it to a csv. Takes in a Run object.
     """
-
     gpx_directory = app.config['GPX_FOLDER']
+    df = read_gpx_track(gpx_directory + filename).to_df()
+    write_track_csv(df, run)
+    return df
+
+def write_track_csv(df, run):
+    """
+    Writes a run's raw track to CSV_FOLDER/<date>/<run id>.csv.
+    """
     csv_directory = app.config['CSV_FOLDER']
     date = run.date.isoformat()
     csv_date_directory = csv_directory + date + r'/'
-
-    gpstracks = []
-    with open(gpx_directory + filename, 'r') as gpxfile:
-        gpx = gpxpy.parse(gpxfile)
-        for track in gpx.tracks:
-            for segment in track.segments:
-                for point in segment.points:
-                    dict = {'Timestamp' : point.time,
-                            'Latitude' : point.latitude,
-                            'Longitude' : point.longitude,
-                            'Elevation' : point.elevation
-                            }
-                    gpstracks.append(dict)
-
-    df = pd.DataFrame(gpstracks)
-
-    minutes = 120
-    time_interval = np.arange(60*minutes + 1)
-
     csv_filename = str(run.id)
 
     os.makedirs(os.path.dirname(csv_date_directory + csv_filename + '.csv'), exist_ok=True)
-    with open(csv_date_directory + csv_filename + '.csv', 'a') as csv:
+    with open(csv_date_directory + csv_filename + '.csv', 'w') as csv:
         df.to_csv(csv, index = False)
-    return df
 
 def load_csv_to_df(filename, date):
     """
@@ -99,92 +144,388 @@ def load_csv_to_df(filename, date):
         df = pd.read_csv(csv, skiprows = rows_to_skip)
     return df
 
-def write_max_speed_matrix(df, run, date):
+# Binary max speed matrix files (.msm) start with a fixed 64 byte header.
+# Version 1 files follow it with the float32 block of the matrix which holds
+# any non-zero value: rows past the end of the run and gradients never run on
+# are all zero, so they are not stored. Version 2 files store the matrix band
+# by band (see bandedMSM.BandedMSM): the int32 column index of each visited
+# gradient, then the int32 number of rows kept for each, then the float32
+# rows of each column in turn. Version 3 files are laid out like version 2
+# ones, except that when the rows are not one per second (see
+# dataProcessing.msm_time_axis) the int32 window length of each row comes
+# first, right after the header. Readers pad any version back out to the
+# full matrix. All three versions are current; new files are written as
+# version 3.
+MSM_MAGIC = b'\x93DRMSM'
+MSM_FORMAT_VERSION = 3
+MSM_FORMAT_VERSIONS = (1, 2, 3)
+MSM_HEADER = np.dtype([('magic', 'S6'),
+                       ('version', 'u1'),
+                       ('reserved', 'u1'),
+                       ('min_gradient', '<i4'),   # gradient of column 0
+                       ('max_gradient', '<i4'),
+                       # Seconds between the points of the resampled track;
+                       # the window of each row is in the time axis
+                       ('resample_seconds', '<i4'),
+                       ('n_rows', '<i4'),         # rows of the full matrix
+                       ('first_column', '<i4'),   # column of the block's 0
+                       ('block_rows', '<i4'),     # (version 2: longest band)
+                       ('block_columns', '<i4'),  # (version 2: number of bands)
+                       ('axis_rows', '<i4'),      # rows of the stored time axis,
+                                                  # 0 for a row every second
+                       ('padding', 'V24')])
+
+def write_msm_file(path, msm, min_gradient, max_gradient, resample_seconds=1, \
+                   time_axis=None):
+    """
+    Writes a (time x gradient) max speed matrix (a 2d array or a BandedMSM)
+    to a binary .msm file, with time_axis the window length in seconds of
+    each row (by default, a row every second) and resample_seconds the step
+    of the resampled track it was computed from (see RESAMPLE_SECONDS). The file is written to a
+    temporary name and then moved into place, so readers never see a partial
+    matrix.
+    """
+    if not isinstance(msm, BandedMSM):
+        msm = BandedMSM.from_dense(msm, min_gradient, max_gradient)
+    if time_axis is not None and np.array_equal(time_axis, np.arange(msm.n_rows)):
+        time_axis = None
+
+    header = np.zeros(1, dtype=MSM_HEADER)
+    header['magic'] = MSM_MAGIC
+    header['version'] = MSM_FORMAT_VERSION
+    header['min_gradient'] = min_gradient
+    header['max_gradient'] = max_gradient
+    header['resample_seconds'] = resample_seconds
+    header['n_rows'] = msm.n_rows
+    header['first_column'] = msm.columns[0] if len(msm.columns) else 0
+    header['block_rows'] = msm.lengths.max() if len(msm.lengths) else 0
+    header['block_columns'] = len(msm.columns)
+    header['axis_rows'] = 0 if time_axis is None else len(time_axis)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as msm_file:
+        msm_file.write(header.tobytes())
+        if time_axis is not None:
+            msm_file.write(np.asarray(time_axis).astype('<i4').tobytes())
+        msm_file.write(msm.columns.astype('<i4').tobytes())
+        msm_file.write(msm.lengths.astype('<i4').tobytes())
+        msm_file.write(msm.data.astype('<f4').tobytes())
+    os.replace(path + '.tmp', path)
+
+def read_msm_header(path):
+    """
+    Reads just the header of a binary .msm file, as a dictionary, along with
+    the window length in seconds of each row (as time_axis).
+    """
+    header = np.fromfile(path, dtype=MSM_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != MSM_MAGIC:
+        raise ValueError('{} is not a max speed matrix file'.format(path))
+    if header['version'][0] not in MSM_FORMAT_VERSIONS:
+        raise ValueError('{} uses max speed matrix format version {}'.format( \
+                            path, header['version'][0]))
+    header = {name: int(header[name][0]) for name in MSM_HEADER.names \
+              if name not in ('magic', 'reserved', 'padding')}
+    # The padding of older versions is zeroed, so they read as a row a second
+    if header['axis_rows']:
+        header['time_axis'] = np.fromfile(path, dtype='<i4', offset=MSM_HEADER.itemsize, \
+                                          count=header['axis_rows']).astype(np.int64)
+    else:
+        header['time_axis'] = np.arange(header['n_rows'])
+    return header
+
+def load_msm(path, mmap=True):
+    """
+    Loads a binary .msm file. Returns its header and the stored block: a
+    BandedMSM for version 2 and 3 files, or the 2d array of a version 1
+    file. The stored values are memory-mapped read-only unless mmap is
+    False. Use expand_msm to get the full matrix, or expand_msm_per_second
+    to get it with a row every second.
+    """
+    header = read_msm_header(path)
+    if header['version'] >= 2:
+        return header, _load_bands(path, header, mmap)
+    shape = (header['block_rows'], header['block_columns'])
+    if mmap and shape[0] * shape[1] > 0:
+        block = np.memmap(path, dtype='<f4', mode='r', \
+                          offset=MSM_HEADER.itemsize, shape=shape)
+    else:
+        block = np.fromfile(path, dtype='<f4', offset=MSM_HEADER.itemsize, \
+                            count=shape[0] * shape[1]).reshape(shape)
+    return header, block
+
+def _load_bands(path, header, mmap):
+    n_bands = header['block_columns']
+    offset = MSM_HEADER.itemsize + 4*header['axis_rows']
+    index = np.fromfile(path, dtype='<i4', offset=offset, count=2*n_bands)
+    columns, lengths = index[:n_bands], index[n_bands:]
+    offset += index.nbytes
+    count = int(lengths.sum())
+    if mmap and count > 0:
+        data = np.memmap(path, dtype='<f4', mode='r', offset=offset, shape=(count,))
+    else:
+        data = np.fromfile(path, dtype='<f4', offset=offset, count=count)
+    return BandedMSM(header['n_rows'], header['min_gradient'], header['max_gradient'], \
+                     columns, lengths, data)
+
+def load_banded_msm(path, mmap=True):
+    """
+    Loads a binary .msm file of either version as a BandedMSM.
+    """
+    header, block = load_msm(path, mmap)
+    if isinstance(block, BandedMSM):
+        return block
+    return BandedMSM.from_dense(expand_msm(header, block), header['min_gradient'], \
+                                header['max_gradient'])
+
+def expand_msm(header, block):
+    """
+    Pads a stored block back out to the full (time x gradient) matrix, with
+    a row for each window of the file's time axis.
+    """
+    if isinstance(block, BandedMSM):
+        return block.to_dense()
+    n_columns = header['max_gradient'] - header['min_gradient'] + 1
+    msm = np.zeros((header['n_rows'], n_columns), dtype=np.float32)
+    first_column = header['first_column']
+    msm[:block.shape[0], first_column:first_column + block.shape[1]] = block
+    return msm
 
+def expand_msm_per_second(header, block):
+    """
+    Like expand_msm, but with a row for every second up to the longest
+    window, the seconds between stored windows being interpolated.
+    """
+    return interpolate_msm(expand_msm(header, block), header['time_axis'])
+
+def write_max_speed_matrix(df, run, date):
+    """
+    Writes a run's max speed matrix (a DataFrame with gradients as columns)
+    to MSM_FOLDER/<date>/<run id>.msm, replacing any older csv version.
+    """
     msm_directory = app.config['MSM_FOLDER']
     msm_date_directory = msm_directory  + date + r'/'
     filename = str(run.id)
 
+    gradients = [int(gradient) for gradient in df.columns]
+    write_msm_file(msm_date_directory + filename + '.msm', df.values, \
+                    gradients[0], gradients[-1], app.config['RESAMPLE_SECONDS'] or 1, \
+                    df.index.values)
+
     try:
         os.remove(msm_date_directory + filename + '.csv')
     except OSError:
         pass
 
-    os.makedirs(os.path.dirname(msm_date_directory + filename + '.csv'), exist_ok=True)
-    with open(msm_date_directory + filename + '.csv', 'a') as msm_csv:
-        df.to_csv(msm_csv, index=False)
-
     return True
 
-def csv_to_msm(filename, date):
-    df = load_csv_to_df(filename, date)
-    df = dataProcessing.prep_df(df)
-    max_speed_df = dataProcessing.compute_max_speed_df(df)
-    write_max_speed_matrix(max_speed_df, filename, date)
+def csv_to_msm(run):
+    """
+    Computes and writes a run's max speed matrix from its raw track csv (see
+    write_track_csv).
+    """
+    date = run.date.isoformat()
+    df = prep_df(load_csv_to_df(str(run.id), date))
+    max_speed_df = compute_max_speed_df(df)
+    write_max_speed_matrix(max_speed_df, run, date)
     return True
 
-def read_max_speed_matrix(filename, date):
-    msm_directory = app.config['MSM_FOLDER']
-    msm_date_directory = msm_directory + date + r'/'
-
-    with open(msm_date_directory + filename + '.csv', 'r') as msm:
+def read_max_speed_matrix_csv(path):
+    with open(path, 'r') as msm:
         rows_to_skip = 0
         line = msm.readline()
         while line.startswith('#'):
             line = msm.readline()
             rows_to_skip += 1
-    with open(msm_date_directory + filename + '.csv', 'r') as msm:
+    with open(path, 'r') as msm:
         max_speed_matrix = pd.read_csv(msm, skiprows = rows_to_skip)
 
     return max_speed_matrix
 
+def read_max_speed_matrix(filename, date):
+    """
+    Returns a run's max speed matrix as a DataFrame, with a row for every
+    second and the gradients (as strings) as columns. Falls back to the old
+    csv format for matrices which have not been converted yet.
+    """
+    msm_directory = app.config['MSM_FOLDER']
+    msm_date_directory = msm_directory + date + r'/'
+
+    if not os.path.isfile(msm_date_directory + filename + '.msm'):
+        return read_max_speed_matrix_csv(msm_date_directory + filename + '.csv')
+
+    header, block = load_msm(msm_date_directory + filename + '.msm')
+    gradient_interval = np.arange(header['min_gradient'], \
+                                  header['max_gradient'] + 1)
+    max_speed_matrix = pd.DataFrame(expand_msm_per_second(header, block), \
+                                    columns=[str(gradient) for gradient \
+                                                in gradient_interval])
+    return max_speed_matrix
+
+def convert_msm_csv(path, keep_csv=False):
+    """
+    Converts a csv max speed matrix to the binary format alongside it, and
+    (unless keep_csv is set) deletes the csv. Returns the sizes in bytes of
+    the csv and binary files.
+    """
+    df = read_max_speed_matrix_csv(path)
+    gradients = [int(gradient) for gradient in df.columns]
+    msm_file = path[:-len('.csv')] + '.msm'
+    write_msm_file(msm_file, df.values, gradients[0], gradients[-1])
+    sizes = os.path.getsize(path), os.path.getsize(msm_file)
+    if not keep_csv:
+        os.remove(path)
+    return sizes
+
+def msm_path(run):
+    """
+    The path of a run's max speed matrix.
+    """
+    msm_directory = app.config['MSM_FOLDER']
+    return msm_directory + run.date.isoformat() + r'/' + str(run.id) + '.msm'
+
+def msm_is_current(run, gpx_path):
+    """
+    Whether a run's max speed matrix exists in the binary format, is newer
+    than its gpx file, and was computed with the gradient range, time step
+    and time axis currently configured (read from the header, so the matrix
+    itself is never loaded).
+    """
+    path = msm_path(run)
+    if not os.path.isfile(path):
+        return False
+    if os.path.getmtime(path) < os.path.getmtime(gpx_path):
+        return False
+    try:
+        header = read_msm_header(path)
+    except ValueError:
+        return False
+    return msm_matches_config(header)
+
+def msm_matches_config(header):
+    """
+    Whether a max speed matrix header was written with the gradient range,
+    resampling step and time axis currently configured.
+    """
+    return header['version'] in MSM_FORMAT_VERSIONS and \
+        header['min_gradient'] == app.config['MIN_GRADIENT'] and \
+        header['max_gradient'] == app.config['MAX_GRADIENT'] and \
+        header['resample_seconds'] == (app.config['RESAMPLE_SECONDS'] or 1) and \
+        np.array_equal(header['time_axis'], msm_time_axis())
+
+def runs_for_gpx(filename):
+    """
+    All runs recorded from a gpx file. Files stored by content hash
+    (<user id>/<sha256>.gpx) are matched on the hash; older files are
+    matched, for any user, on the name, date and time in their metadata.
+    """
+    from app.models import Run
+    directory, _, basename = filename.rpartition(r'/')
+    if directory.isdigit():
+        return Run.query.filter_by(user_id=int(directory), \
+                    gpx_hash=basename[:-len('.gpx')]).all()
+    name, date, time = metadata_from_gpx(filename)
+    if name is None:
+        return []
+    return Run.query.filter_by(name=name, date=date, time=time).all()
+
 def find_unparsed_gpx():
     """
-    Go through the gpx directory and find all runs which have not yet between
-    converted to csv. Note that, if for some reason the run was converted to
-    csv, but not to msm, this function would not see that. Returns a list of
-    filenames (including the '.gpx')
+    Go through the gpx directory and find all files with at least one run
+    whose max speed matrix is missing or out of date (see msm_is_current).
+    Returns a list of filenames (including the '.gpx')
     """
-    all_files = os.listdir(gpx_directory)
-    gpx_files = [gpx_file for gpx_file in all_files if gpx_file.endswith('.gpx')]
+    gpx_directory = app.config['GPX_FOLDER']
     unparsed_gpx = []
-    for gpx_file in gpx_files:
-        _, date, _ = fileIO.metadata_from_gpx(gpx_file.replace('.gpx', ''))
-        csv_date_directory = csv_directory + date + r'/'
-        if os.path.isfile(csv_date_directory + gpx_file.replace('.gpx', '.csv')):
-            pass
-        else:
+    for gpx_file in list_gpx_files():
+        runs = runs_for_gpx(gpx_file)
+        if any(not msm_is_current(run, gpx_directory + gpx_file) for run in runs):
             unparsed_gpx.append(gpx_file)
 
     return unparsed_gpx
 
-def parse_unparsed_gpx():
+def reprocess_gpx(filename, force=False):
     """
-    Finds any unparsed gpx (using the find_unparsed_gpx function) and parses
-    them.
+    Rebuilds the max speed matrix of every run recorded from a gpx file,
+    skipping those which are already current unless force is set. The file
+    is parsed (and its matrix computed) at most once, however many runs it
+    belongs to. Returns the (run id, summary statistics) of each rebuilt
+    run, and the number skipped; the database itself is not written
+    to, so this can run in a worker process.
     """
-    unparsed_gpx = find_unparsed_gpx()
-    for gpx in unparsed_gpx:
-        try:
-            # Retrieve the metadata from the gpx file
-            filename = gpx.replace('.gpx', '')
-            name, date, time = fileIO.metadata_from_gpx(filename)
-        except:
-            return None
+    from app.ingestion import Ingestion
+    gpx_path = app.config['GPX_FOLDER'] + filename
+    stale_runs = []
+    skipped = 0
+    for run in runs_for_gpx(filename):
+        if not force and msm_is_current(run, gpx_path):
+            skipped += 1
+        else:
+            stale_runs.append(run)
+    if not stale_runs:
+        return [], skipped
 
-        csv_date_directory = csv_directory + date + r'/'
-        msm_date_directory = msm_directory + date + r'/'
+    ingestion = Ingestion(gpx_path, stale_runs[0].user_id)
+    ingestion.parse()
+    ingestion.validate()
+    ingestion.clean()
+    ingestion.summarize()
+    ingestion.compute_msm()
+    rebuilt = []
+    for run in stale_runs:
+        rebuilt.append((run.id, ingestion.persist(run)))
+    return rebuilt, skipped
 
-        # First, check if the csv file has already been created (from the gpx),
-        # and if not, create it
-        if os.path.isfile(csv_date_directory  + filename + '.csv'):
-            pass
-        else:
-            fileIO.gpx_to_csv(filename, date)
+def _init_reprocess_worker():
+    global _worker_context
+    _worker_context = app.app_context()
+    _worker_context.push()
+    # Connections must not be shared with the parent process
+    from app import db
+    db.engine.dispose()
 
-        # Next, check if the max speed matrix (msm) has already been created,
-        # and if not, create it
-        if os.path.isfile(msm_date_directory  + filename + '.csv'):
-            pass
-        else:
-            fileIO.csv_to_msm(filename, date)
+def parse_unparsed_gpx(processes, force=False, report=None):
+    """
+    Re-parses every gpx file in the gpx directory on a pool of processes,
+    rebuilding any max speed matrices which are missing or out of date (or
+    all of them, if force is set). Run summaries are written back in a single
+    commit at the end. Returns the number of runs rebuilt and skipped, and
+    the number of files which failed.
+
+    Attributes:
+        processes: the size of the process pool
+        force: rebuild every matrix, even if it is current
+        report: optional callable, given a line of text per finished file
+    """
+    from app import db
+    from app.models import Run
+    from app.ingestion import set_summary
+
+    gpx_files = list_gpx_files()
+    summaries = {}
+    skipped = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=processes, \
+                             initializer=_init_reprocess_worker) as executor:
+        futures = {executor.submit(reprocess_gpx, gpx_file, force): gpx_file \
+                    for gpx_file in gpx_files}
+        for future in as_completed(futures):
+            try:
+                rebuilt, file_skipped = future.result()
+            except Exception as e:
+                failed += 1
+                if report is not None:
+                    report('{}: failed ({})'.format(futures[future], e))
+                continue
+            skipped += file_skipped
+            for run_id, summary in rebuilt:
+                summaries[run_id] = summary
+            if report is not None:
+                report('{}: {} rebuilt, {} skipped'.format(futures[future], \
+                                                len(rebuilt), file_skipped))
+
+    for run in Run.query.filter(Run.id.in_(summaries.keys())).all():
+        set_summary(run, summaries[run.id])
+        run.complete = True
+    db.session.commit()
+
+    return len(summaries), skipped, failed
@@ -0,0 +1,195 @@
+import os
+from datetime import datetime, timezone
+from xml.etree.ElementTree import iterparse
+import numpy as np
+import pandas as pd
+
+# Rough size of one <trkpt> in bytes, used to size the arrays up front
+BYTES_PER_POINT = 120
+# Number of timestamps parsed (by numpy) in one go
+TIME_CHUNK = 4096
+
+def _local_name(tag):
+    return tag[tag.rfind('}') + 1:]
+
+def _parse_time(text):
+    """
+    Parses an ISO 8601 GPX timestamp, keeping any UTC offset as written (like
+    gpxpy does), so that .date() and .time() are the wall clock time.
+    """
+    text = text.strip()
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    return datetime.fromisoformat(text)
+
+def _utc_times(texts):
+    """
+    Converts a list of GPX timestamps to naive UTC datetime64[ns] values.
+    Plain 'Z' timestamps are parsed by numpy in one call; anything with an
+    offset falls back to datetime.
+    """
+    stripped = [text.strip() for text in texts]
+    if all(text.endswith('Z') for text in stripped):
+        return np.array([text[:-1] for text in stripped], dtype='M8[ns]')
+    return np.array([_parse_time(text).astimezone(timezone.utc) \
+                        .replace(tzinfo=None) for text in stripped], dtype='M8[ns]')
+
+class GPXTrack(object):
+    """
+    The points of a GPX file as flat NumPy arrays.
+
+    Attributes:
+        name: the name of the first track (or None)
+        start_time: the time of the first point as written in the file (so
+                    its date() and time() match read_gpx_metadata), or None
+        time: naive UTC datetime64[ns] array (NaT where a point has no time)
+        latitude, longitude, elevation: float64 arrays (elevation is NaN
+                                        where a point has none)
+    """
+    __slots__ = ('name', 'start_time', 'time', 'latitude', 'longitude', 'elevation')
+
+    def __init__(self, name, start_time, time, latitude, longitude, elevation):
+        self.name = name
+        self.start_time = start_time
+        self.time = time
+        self.latitude = latitude
+        self.longitude = longitude
+        self.elevation = elevation
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def to_df(self):
+        """
+        A DataFrame with the same columns gpx_to_csv has always produced.
+        """
+        return pd.DataFrame({'Timestamp': self.time,
+                             'Latitude': self.latitude,
+                             'Longitude': self.longitude,
+                             'Elevation': self.elevation})
+
+# The element holding the name of each kind of point
+POINT_PARENTS = {'trkpt': 'trk', 'rtept': 'rte'}
+
+def _iter_points(source, point_tags=('trkpt',)):
+    """
+    Streams a GPX file, yielding ('name', text) for the first track's name
+    and (tag, (lat, lon, ele, time)) for every <trkpt> (or, with point_tags,
+    every point of the given kinds, e.g. route points). Each point is
+    dropped from the tree as soon as it has been read, so memory stays
+    bounded however long the track is.
+    """
+    elements = []
+    name_found = False
+    name_parents = [POINT_PARENTS[tag] for tag in point_tags]
+    for event, element in iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            elements.append(element)
+            continue
+        elements.pop()
+        tag = _local_name(element.tag)
+        if tag in point_tags:
+            elevation = None
+            time = None
+            for child in element:
+                child_tag = _local_name(child.tag)
+                if child_tag == 'ele':
+                    elevation = child.text
+                elif child_tag == 'time':
+                    time = child.text
+            yield tag, (element.get('lat'), element.get('lon'), elevation, time)
+            if elements:
+                del elements[-1][:]
+        elif tag == 'name' and not name_found and elements and \
+                _local_name(elements[-1].tag) in name_parents:
+            name_found = True
+            yield 'name', element.text
+
+def read_gpx_track(path):
+    """
+    Reads every track point of a GPX file into a GPXTrack. The arrays are
+    allocated up front from the file size and grown (doubling) if needed.
+    """
+    capacity = max(os.path.getsize(path) // BYTES_PER_POINT, 16)
+    latitude = np.empty(capacity)
+    longitude = np.empty(capacity)
+    elevation = np.empty(capacity)
+    time = np.empty(capacity, dtype='M8[ns]')
+    time_texts = []
+    time_start = 0
+    name = None
+    start_time = None
+    n = 0
+
+    with open(path, 'rb') as gpxfile:
+        for kind, value in _iter_points(gpxfile):
+            if kind == 'name':
+                name = value
+                continue
+            if n == capacity:
+                capacity *= 2
+                latitude = np.resize(latitude, capacity)
+                longitude = np.resize(longitude, capacity)
+                elevation = np.resize(elevation, capacity)
+                time = np.resize(time, capacity)
+            lat, lon, ele, point_time = value
+            if n == 0 and point_time is not None:
+                start_time = _parse_time(point_time)
+            latitude[n] = lat
+            longitude[n] = lon
+            elevation[n] = np.nan if ele is None else ele
+            time_texts.append(point_time)
+            n += 1
+            if len(time_texts) == TIME_CHUNK:
+                time[time_start:n] = _chunk_times(time_texts)
+                time_texts = []
+                time_start = n
+    time[time_start:n] = _chunk_times(time_texts)
+
+    return GPXTrack(name, start_time, time[:n], latitude[:n], longitude[:n], \
+                    elevation[:n])
+
+def _chunk_times(texts):
+    if all(text is not None for text in texts):
+        return _utc_times(texts)
+    times = np.full(len(texts), np.datetime64('NaT'), dtype='M8[ns]')
+    present = [i for i, text in enumerate(texts) if text is not None]
+    times[present] = _utc_times([texts[i] for i in present])
+    return times
+
+def read_gpx_metadata(path):
+    """
+    Gets the name, date and time of a GPX file, reading only up to its first
+    track point. Returns all three as None if the file has no track points
+    (or no time on the first one).
+    """
+    name = None
+    with open(path, 'rb') as gpxfile:
+        for kind, value in _iter_points(gpxfile):
+            if kind == 'name':
+                name = value
+                continue
+            point_time = value[3]
+            if point_time is None:
+                break
+            timestamp = _parse_time(point_time)
+            return name, timestamp.date(), timestamp.time()
+    return None, None, None
+
+def read_gpx_route(source):
+    """
+    Reads a planned route (a path or file object) into a GPXTrack without
+    times: its track points, or its route points if it has no track. Any
+    times in the file are ignored.
+    """
+    points = {'trkpt': [], 'rtept': []}
+    name = None
+    for kind, value in _iter_points(source, point_tags=('trkpt', 'rtept')):
+        if kind == 'name':
+            name = value
+            continue
+        points[kind].append(value[:3])
+    route = points['trkpt'] or points['rtept']
+    values = np.array([[np.nan if value is None else value for value in point] \
+                       for point in route], dtype=np.float64).reshape(-1, 3)
+    return GPXTrack(name, None, None, values[:, 0], values[:, 1], values[:, 2])
@@ -0,0 +1,228 @@
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from app import app
+from app.aggregates import CPGAggregates
+from app.cube import MSMCube
+from app.dataProcessing import compute_max_speed_df, track_df, summarize_track, \
+                                SUMMARY_COLUMNS
+from app.fileIO import write_max_speed_matrix, write_track_csv, msm_path, \
+                        msm_matches_config, read_msm_header, load_msm, expand_msm
+from app.gpxReader import read_gpx_track
+from app.profiling import peak_rss_mb, reset_peak_rss
+
+class IngestionError(Exception):
+    """
+    Raised when an uploaded file cannot (or should not) be ingested.
+    """
+    pass
+
+def set_summary(run, summary):
+    """
+    Copies a summary (a dictionary of Run column -> value, as returned by
+    Ingestion.persist) onto a run.
+    """
+    for column, value in summary.items():
+        setattr(run, column, value)
+
+class Ingestion(object):
+    """
+    Carries one GPX file through ingestion in memory. The file is parsed
+    once, into arrays, and every later stage (validation, duplicate
+    detection, cleaning, max speed matrix, persistence) works on what the
+    previous stage left on this object. Each stage's wall time is recorded
+    in timings, in the order the stages ran.
+
+    Attributes:
+        path: the gpx file
+        user_id: the id of the user the file belongs to
+        track: the parsed GPXTrack
+        name, date, time: the run's metadata, from the track
+        df: the cleaned track (see prep_df)
+        max_speed_df: the run's max speed matrix
+        summary: the run's summary statistics (see summarize_track)
+        timings: stage name -> seconds
+        peak_rss: stage name -> the process's peak RSS (MB) during the stage,
+                  where it can be measured (see profiling.reset_peak_rss)
+    """
+    STAGES = ('parse', 'validate', 'find_duplicate', 'clean', 'summarize', \
+              'compute_msm', 'persist')
+
+    def __init__(self, path, user_id):
+        self.path = path
+        self.user_id = user_id
+        self.track = None
+        self.name = None
+        self.date = None
+        self.time = None
+        self.df = None
+        self.max_speed_df = None
+        self.summary = None
+        self.timings = OrderedDict()
+        self.peak_rss = OrderedDict()
+
+    @contextmanager
+    def timed(self, stage):
+        """
+        Records the wall time and peak RSS of the body under stage. Callers
+        can use it for work done outside the stages, e.g. the commit.
+        """
+        # Without a reset the peak would be the whole process's so far
+        measure_rss = reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+            if measure_rss:
+                self.peak_rss[stage] = peak_rss_mb()
+
+    @property
+    def points(self):
+        """
+        The number of points in the track, or None if it was never parsed.
+        """
+        return None if self.track is None else len(self.track)
+
+    def parse(self):
+        with self.timed('parse'):
+            self.track = read_gpx_track(self.path)
+            self.name = self.track.name
+            if self.track.start_time is not None:
+                self.date = self.track.start_time.date()
+                self.time = self.track.start_time.time()
+
+    def validate(self):
+        with self.timed('validate'):
+            if len(self.track) < 2:
+                raise IngestionError('The file has fewer than two track points')
+            if self.date is None or np.isnat(self.track.time).any():
+                raise IngestionError('Every track point needs a time')
+            if not (np.isfinite(self.track.latitude).all() and \
+                    np.isfinite(self.track.longitude).all()):
+                raise IngestionError('Every track point needs a position')
+
+    def find_duplicate(self, exclude_run_id=None):
+        """
+        Returns an already processed run of this user's with the same name,
+        date and time, or None.
+        """
+        from app.models import Run
+        with self.timed('find_duplicate'):
+            query = Run.query.filter_by(name=self.name, date=self.date, \
+                        time=self.time, user_id=self.user_id, complete=True)
+            if exclude_run_id is not None:
+                query = query.filter(Run.id != exclude_run_id)
+            return query.first()
+
+    def find_identical(self, run):
+        """
+        Returns an already processed run (of any user) whose gpx file had
+        exactly the same content as this run's, and whose max speed matrix
+        was computed with the current settings, or None.
+        """
+        from app.models import Run
+        if run.gpx_hash is None:
+            return None
+        with self.timed('find_identical'):
+            candidates = Run.query.filter(Run.gpx_hash == run.gpx_hash, \
+                            Run.complete == True, Run.id != run.id)
+            for candidate in candidates:
+                path = msm_path(candidate)
+                if os.path.isfile(path) and msm_matches_config(read_msm_header(path)):
+                    return candidate
+        return None
+
+    def reuse(self, source_run):
+        """
+        Takes the max speed matrix and summary of a run with identical
+        content, in place of parsing, cleaning and computing.
+        """
+        with self.timed('reuse'):
+            header, block = load_msm(msm_path(source_run))
+            gradient_interval = np.arange(header['min_gradient'], \
+                                          header['max_gradient'] + 1)
+            self.max_speed_df = pd.DataFrame(expand_msm(header, block), \
+                                             index=header['time_axis'], \
+                                             columns=gradient_interval)
+            self.summary = {column: getattr(source_run, column) \
+                            for column in SUMMARY_COLUMNS}
+
+    def clean(self):
+        with self.timed('clean'):
+            self.df = track_df(self.track.time, self.track.latitude, \
+                               self.track.longitude, self.track.elevation)
+
+    def summarize(self):
+        with self.timed('summarize'):
+            elapsed = (self.track.time[-1] - self.track.time[0]) / np.timedelta64(1, 's')
+            self.summary = summarize_track(self.df, elapsed, \
+                                           step=app.config['RESAMPLE_SECONDS'])
+
+    def compute_msm(self):
+        with self.timed('compute_msm'):
+            self.max_speed_df = compute_max_speed_df(self.df)
+
+    def persist(self, run):
+        """
+        Writes the max speed matrix for a run and folds it into the user's
+        cube and aggregates (and, if WRITE_TRACK_CSV is set, writes the raw
+        track as csv). Returns the run's summary (see set_summary); the
+        database is not touched.
+        """
+        with self.timed('persist'):
+            msm = self.max_speed_df.values
+            write_max_speed_matrix(self.max_speed_df, run, run.date.isoformat())
+            lowered = MSMCube(run.user_id).append(run.id, msm)
+            # A stale cube (see MSMCube.append) is rebuilt with the aggregates
+            if lowered is not None:
+                CPGAggregates(run.user_id).add_run(run, msm, lowered)
+            if app.config['WRITE_TRACK_CSV'] and self.track is not None:
+                write_track_csv(self.track.to_df(), run)
+        if self.summary is None:
+            self.summarize()
+        return self.summary
+
+    def process(self, run, on_stage=None):
+        """
+        Runs every stage for a run which already has a row (but is not yet
+        complete). on_stage, if given, is called with each stage's name and
+        the fraction of the stages done, e.g. to report progress.
+
+        If another run had exactly the same file, its results are reused and
+        the file is not parsed at all.
+        """
+        source_run = self.find_identical(run)
+        if source_run is not None:
+            self.reuse(source_run)
+            summary = self.persist(run)
+            if on_stage is not None:
+                on_stage('persist', 1.0)
+            return summary
+
+        stages = [self.parse, self.validate, \
+                  lambda: self._check_duplicate(run), \
+                  self.clean, self.summarize, self.compute_msm]
+        for done, (stage_name, stage) in enumerate(zip(self.STAGES, stages), 1):
+            stage()
+            if on_stage is not None:
+                on_stage(stage_name, done / float(len(self.STAGES)))
+        summary = self.persist(run)
+        if on_stage is not None:
+            on_stage('persist', 1.0)
+        return summary
+
+    def _check_duplicate(self, run):
+        duplicate = self.find_duplicate(exclude_run_id=run.id)
+        if duplicate is not None:
+            raise IngestionError('This run already exists (run {})'.format(duplicate.id))
+
+    def timings_summary(self):
+        summary = ', '.join('{} {:.3f}s'.format(stage, seconds) \
+                            for stage, seconds in self.timings.items())
+        if self.peak_rss:
+            summary += ' (peak RSS {:.0f} MB)'.format(max(self.peak_rss.values()))
+        return summary
@@ -0,0 +1,228 @@
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+from multiprocessing import Process
+from app import app, db
+from app.models import Job, Run
+from app.ingestion import Ingestion, IngestionError, set_summary
+from app.cache import invalidate_user
+from app.profiling import profiled, record_stage_metrics
+from app.prediction import PaceModel
+
+# Recorded on a job queued again by sweep_stale_jobs
+STALE_JOB_ERROR = 'Its worker stopped while running it'
+
+def available_cores():
+    """
+    The number of cores this process may run on (which can be fewer than
+    the machine has, e.g. in a container).
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def enqueue_run(run, filename, batch=None):
+    """
+    Queues a run (which must already have an id) for processing, as part of
+    a bulk import batch if given. The caller is responsible for committing
+    the session.
+    """
+    job = Job(run_id=run.id, filename=filename, status=Job.QUEUED, batch=batch)
+    db.session.add(job)
+    return job
+
+def enqueue_import(batch, filename):
+    """
+    Queues the import of an archive (a filename relative to CHUNK_FOLDER)
+    into a bulk import batch, as a job without a run. The caller is
+    responsible for committing the session.
+    """
+    job = Job(filename=filename, status=Job.QUEUED, batch=batch)
+    db.session.add(job)
+    return job
+
+def latest_jobs(run_ids):
+    """
+    The most recent job of each of the given runs which has one, as a
+    dictionary of run id -> Job.
+    """
+    if not run_ids:
+        return {}
+    latest = db.session.query(db.func.max(Job.id)).filter(Job.run_id.in_(run_ids)) \
+                .group_by(Job.run_id)
+    return {job.run_id: job for job in Job.query.filter(Job.id.in_(latest))}
+
+def claim_next_job():
+    """
+    Atomically moves the oldest queued job to running and returns it, or
+    returns None if the queue is empty. Several workers may race for the same
+    job, so the update only succeeds if the job is still queued.
+    """
+    while True:
+        job_id = db.session.query(Job.id).filter_by(status=Job.QUEUED) \
+                    .order_by(Job.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        claimed = Job.query.filter_by(id=job_id, status=Job.QUEUED) \
+                    .update({'status': Job.RUNNING, \
+                             'started': datetime.utcnow()}, \
+                            synchronize_session=False)
+        db.session.commit()
+        if claimed == 1:
+            return Job.query.get(job_id)
+
+def sweep_stale_jobs(timeout_seconds=None):
+    """
+    Jobs left running by a worker which died (e.g. was killed) would never
+    finish, so jobs running for longer than timeout_seconds (by default
+    JOB_TIMEOUT_SECONDS) are queued again, once: a job which goes stale a
+    second time, and so is likely to be what stops its worker, is marked
+    failed instead. Returns the number of jobs swept.
+    """
+    if timeout_seconds is None:
+        timeout_seconds = app.config['JOB_TIMEOUT_SECONDS']
+    now = datetime.utcnow()
+    stale = Job.query.filter(Job.status == Job.RUNNING, \
+                             Job.started < now - timedelta(seconds=timeout_seconds))
+    failed = stale.filter(Job.error == STALE_JOB_ERROR) \
+                .update({'status': Job.FAILED, 'finished': now}, \
+                        synchronize_session=False)
+    requeued = stale.filter(Job.error.is_(None)) \
+                .update({'status': Job.QUEUED, 'started': None, 'progress': 0.0, \
+                         'error': STALE_JOB_ERROR}, synchronize_session=False)
+    db.session.commit()
+    if failed or requeued:
+        app.logger.warning('Swept stale jobs: %s queued again, %s failed', requeued, failed)
+    return failed + requeued
+
+def set_progress(job, progress):
+    job.progress = progress
+    db.session.commit()
+
+def _progress_reporter(job):
+    def on_stage(stage, fraction):
+        # Leave the last few percent for the final commit
+        set_progress(job, round(0.95*fraction, 3))
+    return on_stage
+
+def _profile_path(job):
+    profile_folder = app.config['PROFILE_FOLDER']
+    if profile_folder is None:
+        return None
+    os.makedirs(profile_folder, exist_ok=True)
+    return os.path.join(profile_folder, 'job-{}.prof'.format(job.id))
+
+def process_import_job(job):
+    """
+    Runs a claimed import job (see batches.queue_chunked_upload). If the
+    archive cannot be read at all the job is marked failed; a corrupt one is
+    recorded on the batch, as for any bulk import.
+    """
+    # batches queues its jobs through this module
+    from app.batches import import_queued_archive
+    try:
+        import_queued_archive(job)
+        job.status = Job.DONE
+        job.progress = 1.0
+        job.error = None
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Job %s failed:\n%s', job.id, traceback.format_exc())
+        job.status = Job.FAILED
+        job.error = str(e)[:255]
+    job.finished = datetime.utcnow()
+    db.session.commit()
+    invalidate_user(job.batch.user_id)
+    return job
+
+def process_job(job):
+    """
+    Runs a claimed job. The run is only marked complete once its max speed
+    matrix has been written; on any error (including the run having been
+    deleted) the job is marked failed and the run is left incomplete. The
+    time each stage took (including the final commit) is recorded as
+    StageMetric rows, and if PROFILE_FOLDER is set the whole job is run
+    under cProfile. Once the run is in, the user's pace model is refitted,
+    so predictions don't have to.
+    """
+    if job.run_id is None:
+        return process_import_job(job)
+    ingestion = None
+    try:
+        run = Run.query.get(job.run_id)
+        if run is None:
+            raise IngestionError('Run {} no longer exists'.format(job.run_id))
+        ingestion = Ingestion(app.config['GPX_FOLDER'] + job.filename, run.user_id)
+        with profiled(_profile_path(job)):
+            summary = ingestion.process(run, _progress_reporter(job))
+        set_summary(run, summary)
+        run.complete = True
+        job.status = Job.DONE
+        job.progress = 1.0
+        job.error = None
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Job %s failed:\n%s', job.id, traceback.format_exc())
+        job.status = Job.FAILED
+        job.error = str(e)[:255]
+    job.finished = datetime.utcnow()
+    if ingestion is None:
+        db.session.commit()
+        return job
+    with ingestion.timed('commit'):
+        db.session.commit()
+    app.logger.info('Job %s: %s', job.id, ingestion.timings_summary())
+    record_stage_metrics(job.run_id, ingestion)
+    db.session.commit()
+    if job.status == Job.DONE:
+        # The run now shows as complete
+        invalidate_user(run.user_id)
+        # The run is in either way; predictions refit the model if this fails
+        try:
+            PaceModel(run.user_id).refresh()
+        except (OSError, ValueError):
+            app.logger.error('Refitting the pace model of user %s failed:\n%s', \
+                             run.user_id, traceback.format_exc())
+    return job
+
+def work(poll_seconds=None, burst=False):
+    """
+    The worker loop: claim and process jobs until the queue is empty, then
+    poll every poll_seconds for more. With burst=True the worker exits as
+    soon as the queue is empty. Stale jobs (see sweep_stale_jobs) are swept
+    on start and whenever the queue is empty.
+    """
+    if poll_seconds is None:
+        poll_seconds = app.config['JOB_POLL_SECONDS']
+    sweep_stale_jobs()
+    while True:
+        job = claim_next_job()
+        if job is not None:
+            process_job(job)
+        elif sweep_stale_jobs():
+            continue
+        elif burst:
+            return
+        else:
+            time.sleep(poll_seconds)
+
+def _worker_main(poll_seconds, burst):
+    with app.app_context():
+        # Connections must not be shared with the parent process
+        db.engine.dispose()
+        work(poll_seconds, burst)
+
+def start_workers(processes=None, poll_seconds=None, burst=False):
+    """
+    Starts a pool of worker processes and waits for them to finish.
+    """
+    if processes is None:
+        processes = app.config['JOB_WORKERS'] or available_cores()
+    workers = [Process(target=_worker_main, args=(poll_seconds, burst)) \
+                for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
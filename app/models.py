@@ -28,10 +28,137 @@ class Run(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     distance = db.Column(db.Float, index=True, default=0.0)
     elevation_gain = db.Column(db.Float, index=True, default=0.0)
+    # Summary statistics, set when the run is processed (see
+    # dataProcessing.summarize_track). Times are in seconds, speeds in meters
+    # per second, and the distance_* columns are the meters run in each
+    # gradient bin
+    elevation_loss = db.Column(db.Float, index=True)
+    moving_time = db.Column(db.Float, index=True)
+    elapsed_time = db.Column(db.Float, index=True)
+    best_speed_1min = db.Column(db.Float, index=True)
+    best_speed_5min = db.Column(db.Float, index=True)
+    best_speed_20min = db.Column(db.Float, index=True)
+    best_speed_60min = db.Column(db.Float, index=True)
+    distance_steep_downhill = db.Column(db.Float, index=True)
+    distance_downhill = db.Column(db.Float, index=True)
+    distance_flat = db.Column(db.Float, index=True)
+    distance_uphill = db.Column(db.Float, index=True)
+    distance_steep_uphill = db.Column(db.Float, index=True)
+    # SHA-256 of the uploaded gpx file, which is stored as
+    # GPX_FOLDER/<user id>/<gpx_hash>.gpx
+    gpx_hash = db.Column(db.String(64), index=True)
+    # Only set once the run's max speed matrix has been written
+    complete = db.Column(db.Boolean, index=True, default=False)
+    jobs = db.relationship('Job', backref='run', lazy='dynamic')
+
+    # Serves both lookups by user and the keyset-paginated run listings
+    __table_args__ = (db.Index('ix_run_user_id_date_time', 'user_id', 'date', 'time'),)
 
     def __repr__(self):
         return '<Run {}>'.format(self.name)
 
+class Job(db.Model):
+    """
+    A unit of background work: processing an uploaded GPX file into its
+    max speed matrix, or (with no run) importing a chunked upload into its
+    batch. Jobs move from queued to running, and then to
+    either done or failed; progress is a fraction between 0 and 1.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('run.id'))
+    filename = db.Column(db.String(255))
+    status = db.Column(db.String(16), index=True, default=QUEUED)
+    progress = db.Column(db.Float, default=0.0)
+    error = db.Column(db.String(255))
+    created = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    started = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    # Set for the jobs of a bulk import
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), index=True)
+
+    def __repr__(self):
+        return '<Job {} {}>'.format(self.id, self.status)
+
+    def to_dict(self):
+        return {'id': self.id,
+                'run_id': self.run_id,
+                'status': self.status,
+                'progress': self.progress,
+                'error': self.error}
+
+class Batch(db.Model):
+    """
+    A bulk import of GPX files (an archive, see batches.py). Each new run in
+    it gets a job pointing back here, as does the import itself when it is
+    left to a worker, so the import's progress is that of its jobs. The counts are of the gpx files found in the archive: queued
+    as new runs, skipped as duplicates of existing runs, or skipped as
+    invalid (no timed track points, or too large).
+    """
+    PROCESSING = 'processing'
+    DONE = 'done'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+    filename = db.Column(db.String(255))
+    created = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    files = db.Column(db.Integer, default=0)
+    queued = db.Column(db.Integer, default=0)
+    duplicates = db.Column(db.Integer, default=0)
+    invalid = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(255))
+    jobs = db.relationship('Job', backref='batch', lazy='dynamic')
+
+    def __repr__(self):
+        return '<Batch {} {}>'.format(self.id, self.filename)
+
+    def to_dict(self):
+        """
+        The import's counts, along with the number of its jobs in each state
+        and its overall progress (the mean of its jobs', counting finished
+        ones as 1), computed by the database.
+        """
+        statuses = dict(db.session.query(Job.status, db.func.count(Job.id)) \
+                            .filter(Job.batch_id == self.id).group_by(Job.status))
+        running_progress = db.session.query(db.func.sum(Job.progress)) \
+                            .filter(Job.batch_id == self.id, \
+                                    Job.status == Job.RUNNING).scalar() or 0.0
+        n_jobs = sum(statuses.values())
+        finished = statuses.get(Job.DONE, 0) + statuses.get(Job.FAILED, 0)
+        return {'id': self.id,
+                'filename': self.filename,
+                'status': self.DONE if finished == n_jobs else self.PROCESSING,
+                'progress': round((finished + running_progress) / n_jobs, 3) \
+                            if n_jobs else 1.0,
+                'files': self.files,
+                'queued': self.queued,
+                'duplicates': self.duplicates,
+                'invalid': self.invalid,
+                'error': self.error,
+                'jobs': {status: statuses.get(status, 0) for status in \
+                         (Job.QUEUED, Job.RUNNING, Job.DONE, Job.FAILED)}}
+
 @login.user_loader
 def load_user(id):
     return User.query.get(int(id))
+
+class StageMetric(db.Model):
+    """
+    How long one ingestion stage took for one run, with the worker's peak
+    resident set size (MB) during it and the run's number of GPX points (see
+    profiling.py).
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    run_id = db.Column(db.Integer, db.ForeignKey('run.id'), index=True)
+    stage = db.Column(db.String(32), index=True)
+    seconds = db.Column(db.Float)
+    peak_rss_mb = db.Column(db.Float)
+    points = db.Column(db.Integer)
+    created = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<StageMetric {} {} {:.3f}s>'.format(self.run_id, self.stage, self.seconds)
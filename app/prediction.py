@@ -0,0 +1,293 @@
+import json
+import os
+from datetime import datetime
+import numpy as np
+from app import app
+from app.aggregates import CPGAggregates
+from app.cube import MSMCube
+from app.dataProcessing import msm_time_axis, route_profile, elevation_change
+
+# The sums kept per gradient over the fitted cells of the CPG matrix, with
+# x = log(seconds) and y = log(speed): everything a least squares fit of
+# y = log_speed - exponent * x needs, and additive over cells
+SUMS = ('n', 'x', 'xx', 'y', 'xy')
+
+def _column_sums(rows, columns, speeds, log_seconds, n_columns):
+    """
+    The SUMS, per gradient column, over the cells (rows, columns) of a CPG
+    matrix with the given speeds. Cells without a speed add nothing.
+    """
+    keep = speeds > 0
+    columns = columns[keep]
+    x = log_seconds[rows[keep]]
+    y = np.log(speeds[keep].astype(np.float64))
+    return np.stack([np.bincount(columns, weights=weights, minlength=n_columns) \
+                     for weights in (np.ones_like(x), x, x*x, y, x*y)])
+
+def _gradient_features(gradients):
+    return np.stack([np.ones_like(gradients), gradients, gradients**2])
+
+def fit_gradient_model(sums, gradients):
+    """
+    The all-gradient model, log speed = c0 + c1 g + c2 g^2 - (b0 + b1 g) x,
+    fitted by least squares to every cell at once through their per gradient
+    sums (g is constant down a column). Returns (c0, c1, c2, b0, b1), or
+    None if there are too few cells.
+    """
+    n, sx, sxx, sy, sxy = sums
+    if n.sum() < 5:
+        return None
+    u = _gradient_features(gradients)           # (3, gradients)
+    w = u[:2]                                   # (1, g) multiplies x
+    normal = np.zeros((5, 5))
+    normal[:3, :3] = np.einsum('ig,jg,g->ij', u, u, n)
+    normal[:3, 3:] = -np.einsum('ig,jg,g->ij', u, w, sx)
+    normal[3:, :3] = normal[:3, 3:].T
+    normal[3:, 3:] = np.einsum('ig,jg,g->ij', w, w, sxx)
+    target = np.concatenate((u @ sy, -(w @ sxy)))
+    return np.linalg.lstsq(normal, target, rcond=None)[0]
+
+def fit_per_gradient(sums, gradients, prior, prior_weight):
+    """
+    Each gradient's own log speed and exponent, fitted to its column by
+    least squares shrunk towards the all-gradient model (prior): the prior
+    counts as prior_weight extra cells, so gradients with little data stay
+    close to the model and well-run ones follow their own curve. It must be
+    positive, or a gradient without cells has no solution.
+    """
+    if not prior_weight > 0:
+        raise ValueError('The prior weight must be positive, not {}'.format(prior_weight))
+    n, sx, sxx, sy, sxy = sums
+    c0, c1, c2, b0, b1 = prior
+    prior_log_speed = c0 + c1*gradients + c2*gradients**2
+    prior_exponent = b0 + b1*gradients
+    normal = np.empty((len(gradients), 2, 2))
+    normal[:, 0, 0] = n + prior_weight
+    normal[:, 0, 1] = normal[:, 1, 0] = -sx
+    normal[:, 1, 1] = sxx + prior_weight
+    target = np.stack([sy + prior_weight*prior_log_speed, \
+                       -sxy + prior_weight*prior_exponent], axis=1)
+    solution = np.linalg.solve(normal, target[..., None])[..., 0]
+    return solution[:, 0], solution[:, 1]
+
+class PaceCoefficients(object):
+    """
+    A fitted pace model: the fastest speed (meters per second) a runner can
+    hold for t seconds on gradient g is exp(log_speed[g]) * t**-exponent[g],
+    a power law per gradient (Riegel's model, written for speed). Holds
+    nothing but the two coefficients per gradient, so predictions never
+    touch the CPG matrix.
+
+    Attributes:
+        min_gradient: the gradient of the first coefficient
+        log_speed, exponent: one per gradient, from min_gradient up
+    """
+    # Exponents are clipped to this range, so every route has a finite time
+    MAX_EXPONENT = 0.9
+
+    def __init__(self, min_gradient, log_speed, exponent):
+        self.min_gradient = int(min_gradient)
+        self.log_speed = np.asarray(log_speed, dtype=np.float64)
+        self.exponent = np.clip(np.asarray(exponent, dtype=np.float64), \
+                                0.0, self.MAX_EXPONENT)
+
+    def _columns(self, gradients):
+        columns = np.rint(np.asarray(gradients, dtype=np.float64)).astype(np.int64)
+        return np.clip(columns - self.min_gradient, 0, len(self.log_speed) - 1)
+
+    def speed(self, seconds, gradients):
+        """
+        The predicted best speed held for seconds at each of gradients
+        (slope * 100, rounded; gradients past either end use the end one).
+        """
+        columns = self._columns(gradients)
+        return np.exp(self.log_speed[columns] - self.exponent[columns]*np.log(seconds))
+
+    def predict(self, distances, gradients, tolerance=1e-9, max_iterations=50):
+        """
+        The time in seconds to run a route at a steady effort: the time T for
+        which running each segment at the speed holdable for T seconds on its
+        gradient adds up to exactly T. Found by Newton's method on log T,
+        after summing the distance run at each gradient, so the cost depends
+        on the number of gradients rather than the length of the route.
+
+        Attributes:
+            distances: the length of each segment of the route, in meters
+            gradients: the gradient (slope * 100) of each segment
+        """
+        distance = np.bincount(self._columns(gradients), \
+                               weights=np.asarray(distances, dtype=np.float64), \
+                               minlength=len(self.log_speed))
+        used = distance > 0
+        if not used.any():
+            return 0.0
+        # T = sum(k * T**b), with k the time the distance would take at 1 s
+        k = distance[used] * np.exp(-self.log_speed[used])
+        b = self.exponent[used]
+        log_time = np.log(k.sum())
+        for _ in range(max_iterations):
+            terms = k * np.exp(b * log_time)
+            total = terms.sum()
+            residual = np.log(total) - log_time
+            step = residual / (1.0 - (terms * b).sum() / total)
+            log_time += step
+            if abs(step) < tolerance:
+                break
+        return float(np.exp(log_time))
+
+    def segment_times(self, distances, gradients):
+        """
+        The predicted time in seconds of each segment of a route (see
+        predict), adding up to the route's time.
+        """
+        total = self.predict(distances, gradients)
+        if total == 0:
+            return np.zeros(len(distances))
+        return np.asarray(distances, dtype=np.float64) / self.speed(total, gradients)
+
+    def to_dict(self):
+        return {'min_gradient': self.min_gradient,
+                'log_speed': self.log_speed.tolist(),
+                'exponent': self.exponent.tolist()}
+
+class PaceModel(object):
+    """
+    A user's pace model (see PaceCoefficients), fitted to their all-time CPG
+    matrix and stored next to their MSMCube. Only windows of at least
+    PACE_MIN_SECONDS are fitted, where the CPG reflects endurance rather
+    than acceleration.
+
+    The fit is kept as per-gradient sums over the matrix's cells (see SUMS)
+    along with a copy of the matrix they were taken from. When the user's
+    aggregates change, only the cells which changed since are taken out of
+    and put back into the sums, and the coefficients are solved again from
+    them, so a refit costs little more than comparing the two matrices.
+
+    Files, under CUBE_FOLDER/<user id>/:
+        pace_model.json: settings, aggregates version, sums and coefficients
+        pace_model.f32: the CPG matrix the sums were taken from
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.cube = MSMCube(user_id)
+        self.aggregates = CPGAggregates(user_id)
+        self.path = self.cube.directory + 'pace_model.json'
+        self.matrix_path = self.cube.directory + 'pace_model.f32'
+
+    @staticmethod
+    def _settings():
+        settings = MSMCube._configured_meta()
+        del settings['run_ids']
+        settings['min_seconds'] = app.config['PACE_MIN_SECONDS']
+        return settings
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as model_file:
+                return json.load(model_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, model, matrix):
+        np.asarray(matrix, dtype='<f4').tofile(self.matrix_path + '.tmp')
+        os.replace(self.matrix_path + '.tmp', self.matrix_path)
+        with open(self.path + '.tmp', 'w') as model_file:
+            json.dump(model, model_file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def _fitted_matrix(self, model, shape):
+        if model is None or model['settings'] != self._settings() or \
+                not os.path.isfile(self.matrix_path):
+            return np.zeros(shape, dtype=np.float32), np.zeros((len(SUMS), shape[1]))
+        return np.fromfile(self.matrix_path, dtype='<f4').reshape(shape), \
+               np.array(model['sums'])
+
+    def refresh(self):
+        """
+        Brings the model up to date with the user's CPG matrix, if their
+        aggregates have changed since it was fitted. Returns the
+        coefficients, or None if the user has no runs to fit.
+        """
+        version = self.aggregates.version()
+        model = self._read()
+        if model is not None and model['version'] == version and \
+                model['settings'] == self._settings():
+            return self._coefficients(model)
+
+        with self.cube._lock():
+            model = self._read()
+            matrix = self.cube.alltime_max()
+            if matrix is None:
+                return None
+            matrix = np.array(matrix)
+            fitted, sums = self._fitted_matrix(model, matrix.shape)
+
+            seconds = msm_time_axis()
+            log_seconds = np.log(np.maximum(seconds, 1))
+            rows, columns = np.nonzero((matrix != fitted) & \
+                    (seconds >= app.config['PACE_MIN_SECONDS'])[:, None])
+            sums += _column_sums(rows, columns, matrix[rows, columns], \
+                                 log_seconds, matrix.shape[1])
+            sums -= _column_sums(rows, columns, fitted[rows, columns], \
+                                 log_seconds, matrix.shape[1])
+
+            gradients = np.arange(app.config['MIN_GRADIENT'], \
+                                  app.config['MAX_GRADIENT'] + 1, dtype=np.float64)
+            prior = fit_gradient_model(sums, gradients)
+            model = {'settings': self._settings(), 'version': version,
+                     'fitted': datetime.utcnow().isoformat(),
+                     'sums': sums.tolist(), 'gradient_model': None,
+                     'log_speed': None, 'exponent': None}
+            if prior is not None:
+                log_speed, exponent = fit_per_gradient(sums, gradients, prior, \
+                                                       app.config['PACE_PRIOR_WEIGHT'])
+                model.update(gradient_model=prior.tolist(), \
+                             log_speed=log_speed.tolist(), exponent=exponent.tolist())
+            self._write(model, matrix)
+        return self._coefficients(model)
+
+    @staticmethod
+    def _coefficients(model):
+        if model['log_speed'] is None:
+            return None
+        return PaceCoefficients(model['settings']['min_gradient'], \
+                                model['log_speed'], model['exponent'])
+
+    def coefficients(self):
+        """
+        The stored coefficients as they are, without checking whether the
+        aggregates have changed since (see refresh). None if there are none.
+        """
+        model = self._read()
+        return None if model is None else self._coefficients(model)
+
+def estimate_route(coefficients, route, split_meters=1000):
+    """
+    Estimates the finish time and splits of a planned route (a GPXTrack with
+    at least two points, see gpxReader.read_gpx_route) run at a steady
+    effort. The route is cut into ROUTE_SEGMENT_METERS segments by gradient
+    (see dataProcessing.route_profile) and every segment is timed in one
+    vectorized pass (see PaceCoefficients.segment_times).
+
+    Returns a dictionary with the route's distance (meters), elevation gain
+    and loss (meters), time (seconds) and splits: one per split_meters, the
+    last covering whatever is left, each with its distance from the start,
+    its own time and the elapsed time.
+    """
+    edges, _, gradients = route_profile(route.latitude, route.longitude, route.elevation, \
+                                        app.config['ROUTE_SEGMENT_METERS'], \
+                                        app.config['ELEVATION_FILTER_POINTS'])
+    times = coefficients.segment_times(np.diff(edges), gradients)
+    elapsed = np.concatenate(([0.0], np.cumsum(times)))
+    marks = np.append(np.arange(split_meters, edges[-1], split_meters), edges[-1])
+    split_elapsed = np.interp(marks, edges, elapsed)
+    split_times = np.diff(split_elapsed, prepend=0.0)
+    gain, loss = elevation_change(route.elevation, app.config['ELEVATION_HYSTERESIS'])
+    return {'distance': float(edges[-1]),
+            'elevation_gain': gain,
+            'elevation_loss': loss,
+            'time': float(elapsed[-1]),
+            'splits': [{'distance': float(mark), 'time': float(split_time), \
+                        'elapsed': float(total)} \
+                       for mark, split_time, total in zip(marks, split_times, split_elapsed)]}
@@ -0,0 +1,95 @@
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+
+def reset_peak_rss():
+    """
+    Resets this process's peak resident set size to its current one, so
+    that peak_rss_mb measures from here. Only Linux allows it; returns
+    whether it worked.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """
+    The peak resident set size of this process (in MB) since the last
+    reset_peak_rss, or since it started. None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    # In kilobytes
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+@contextmanager
+def profiled(path):
+    """
+    Runs the body under cProfile and dumps the stats to path (readable with
+    pstats or snakeviz). Does nothing if path is None, so callers can make
+    profiling opt-in.
+    """
+    if path is None:
+        yield None
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+def record_stage_metrics(run_id, ingestion):
+    """
+    Adds a StageMetric row for each stage an Ingestion ran. The caller is
+    responsible for committing the session.
+    """
+    from app import db
+    from app.models import StageMetric
+    for stage, seconds in ingestion.timings.items():
+        db.session.add(StageMetric(run_id=run_id, stage=stage, seconds=seconds, \
+                                   peak_rss_mb=ingestion.peak_rss.get(stage), \
+                                   points=ingestion.points))
+
+def stage_percentiles(days=None):
+    """
+    Return the 50th and 95th percentile wall time (in seconds) of each
+    ingestion stage, with the number of samples and the highest peak RSS
+    (in MB) seen during the stage, over the last days days (or all time), as
+    a list of dictionaries in stage order.
+    """
+    from app import db
+    from app.ingestion import Ingestion
+    from app.models import StageMetric
+    query = db.session.query(StageMetric.stage, StageMetric.seconds, \
+                             StageMetric.peak_rss_mb)
+    if days is not None:
+        query = query.filter(StageMetric.created >= \
+                             datetime.utcnow() - timedelta(days=days))
+    samples = {}
+    for stage, seconds, peak_rss in query:
+        samples.setdefault(stage, ([], []))
+        samples[stage][0].append(seconds)
+        if peak_rss is not None:
+            samples[stage][1].append(peak_rss)
+
+    order = ['find_identical', 'reuse'] + list(Ingestion.STAGES) + ['commit']
+    stages = sorted(samples, key=lambda stage: (order.index(stage) \
+                                                if stage in order else len(order), stage))
+    percentiles = []
+    for stage in stages:
+        seconds, peak_rss = samples[stage]
+        p50, p95 = np.percentile(seconds, [50, 95])
+        percentiles.append({'stage': stage, 'count': len(seconds), 'p50': p50, \
+                            'p95': p95, 'peak_rss_mb': max(peak_rss) if peak_rss else None})
+    return percentiles
@@ -1,19 +1,52 @@
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, jsonify, abort
 from app import app, db
 from app.forms import LoginForm, RegistrationForm
 from flask_login import current_user, login_user, logout_user, login_required
-from app.models import User, Run
+from app.models import User, Job, Batch
 from werkzeug.urls import url_parse
-from werkzeug import secure_filename
-import os
-from app.fileIO import allowed_file, metadata_from_gpx, gpx_to_csv_to_msm
+from werkzeug.http import parse_content_range_header
+from app.fileIO import allowed_file
+from app.batches import queue_upload, DUPLICATE, NO_TRACK, INVALID, \
+                        archive_type, import_archive, UPLOAD_ID, received_bytes, \
+                        append_chunk, queue_chunked_upload, expire_chunks
+from app.cache import cached, get_cache, invalidate_user
+from app.jobs import latest_jobs
+from app.runSelection import list_runs, run_key_to_str, run_key_from_str
+
+def run_page(user_id, before):
+    """
+    One page of a user's run listing, newest first, and the cursor for the
+    next page (None if this is the last one).
+    """
+    per_page = app.config['RUNS_PER_PAGE']
+    runs = list_runs(user_id, before, per_page + 1)
+    if len(runs) <= per_page:
+        return runs, None
+    last = runs[per_page - 1]
+    return runs[:per_page], run_key_to_str((last['date'], last['time'], last['id']))
+
+def requested_page(user_id):
+    """
+    The page of a user's runs asked for by the request's `before` argument.
+    """
+    before = request.args.get('before')
+    if before is not None:
+        try:
+            before = run_key_from_str(before)
+        except ValueError:
+            abort(400)
+    return cached(user_id, 'runs', run_page, user_id, before)
 
 @app.route('/')
 @app.route('/index')
 @login_required
 def index():
-    runs = Run.query.filter_by(user_id=current_user.id)
-    return render_template('index.html', title='Home', runs=runs)
+    runs, next_page = requested_page(current_user.id)
+    # Jobs change state without the listing being invalidated, so they are
+    # looked up on every request
+    jobs = latest_jobs([run['id'] for run in runs if not run['complete']])
+    return render_template('index.html', title='Home', runs=runs, jobs=jobs, \
+                           next_page=next_page)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -63,28 +96,114 @@ def upload():
             flash('Please select a GPX file to upload')
             return redirect(request.url)
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            name, date, time = metadata_from_gpx(filename)
-            run = Run.query.filter_by(name=name, date=date, time=time, \
-                                        user_id=current_user.id)
-            if run.first() is not None:
+            job, problem = queue_upload(file.stream, current_user.id)
+            if problem == DUPLICATE:
                 flash('This run already exists in the database')
                 return redirect(request.url)
-            run = Run(name=name, date=date, time=time, user_id=current_user.id)
-            distance, elevation_gain = gpx_to_csv_to_msm(run, filename)
-            # Distance and elevation_gain do not yet work
-            run.distance = distance
-            run.elevation_gain = elevation_gain
-            db.session.add(run)
+            if problem == NO_TRACK:
+                flash('That file has no timed track points')
+                return redirect(request.url)
+            if problem == INVALID:
+                flash('That file is not a valid GPX file')
+                return redirect(request.url)
             db.session.commit()
-            flash(name + ' successfully uploaded and processed.')
+            invalidate_user(current_user.id)
+            flash('{} successfully uploaded and queued for processing (job {}).' \
+                  .format(job.run.name, job.id))
             return redirect(url_for('index'))
     return render_template('upload.html', title='Upload')
 
+def batch_response(batch, status):
+    response = jsonify(batch.to_dict())
+    response.status_code = status
+    response.headers['Location'] = url_for('batch_status', batch_id=batch.id)
+    return response
+
+@app.route('/upload/batch', methods=['POST'])
+@login_required
+def upload_batch():
+    """
+    Bulk import: takes a zip or tar archive of gpx files (or a single gpx
+    file) as the multipart field 'file', queues every new run in it, and
+    returns the batch (see Batch.to_dict) with 202 and its URL in Location.
+    """
+    file = request.files.get('file')
+    if file is None or archive_type(file.filename) is None:
+        abort(400)
+    batch = import_archive(file.stream, file.filename, current_user.id)
+    invalidate_user(current_user.id)
+    return batch_response(batch, 202)
+
+@app.route('/upload/chunks/<upload_id>', methods=['GET', 'PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """
+    Resumable chunked upload of an archive (or gpx file), under an id chosen
+    by the client. Each PUT carries the next chunk as its body, with a
+    Content-Range header (bytes start-end/total) and the archive's name in
+    the filename query argument; GET returns how many bytes have arrived, to
+    resume from after a failure. A chunk which doesn't start there gets 409,
+    and an upload longer than MAX_UPLOAD_BYTES gets 413. Once the last chunk
+    is in, the batch is returned as by upload_batch, but the archive is
+    imported by a worker: its counts fill in as the import job runs.
+    """
+    if not UPLOAD_ID.match(upload_id):
+        abort(400)
+    if request.method == 'GET':
+        return jsonify({'upload_id': upload_id, \
+                        'received': received_bytes(current_user.id, upload_id)})
+
+    filename = request.args.get('filename', '')
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if archive_type(filename) is None or content_range is None or \
+            content_range.units != 'bytes' or content_range.length is None:
+        abort(400)
+    if content_range.length > app.config['MAX_UPLOAD_BYTES']:
+        abort(413)
+    if content_range.start == 0:
+        # A good time to clear out uploads which were given up on
+        expire_chunks()
+    try:
+        received = append_chunk(current_user.id, upload_id, request.stream, \
+                                content_range.start, content_range.stop)
+    except ValueError as e:
+        response = jsonify({'upload_id': upload_id, 'error': str(e), \
+                            'received': received_bytes(current_user.id, upload_id)})
+        response.status_code = 409
+        return response
+    if received < content_range.length:
+        return jsonify({'upload_id': upload_id, 'received': received})
+    batch = queue_chunked_upload(current_user.id, upload_id, filename)
+    return batch_response(batch, 202)
+
+@app.route('/batches/<int:batch_id>')
+@login_required
+def batch_status(batch_id):
+    batch = Batch.query.get_or_404(batch_id)
+    if batch.user_id != current_user.id:
+        abort(404)
+    return jsonify(batch.to_dict())
+
 @app.route('/user/<username>')
 @login_required
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    runs = Run.query.filter_by(user_id=user.id)
-    return render_template('user.html', user=user, runs=runs)
+    runs, next_page = requested_page(user.id)
+    return render_template('user.html', user=user, runs=runs, next_page=next_page)
+
+@app.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = Job.query.get_or_404(job_id)
+    owner = job.run if job.run is not None else job.batch
+    if owner.user_id != current_user.id:
+        abort(404)
+    return jsonify(job.to_dict())
+
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    cache = get_cache()
+    if cache is None:
+        return jsonify({'type': None})
+    return jsonify(cache.stats())
@@ -0,0 +1,236 @@
+from datetime import datetime, time
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, or_, func
+from app import app, db
+from app.models import Run
+from app.fileIO import msm_path, load_msm, expand_msm_per_second, load_banded_msm
+from app.bandedMSM import maximum_reduce
+
+class RunHandle(object):
+    """
+    A lightweight reference to a run, holding only the columns needed to list
+    it. Its max speed matrix is only read from disk (memory-mapped) the first
+    time it is asked for.
+
+    Attributes:
+        id, name, date, time, distance: as on the Run model
+    """
+    __slots__ = ('id', 'name', 'date', 'time', 'distance', '_msm')
+
+    def __init__(self, id, name, date, time, distance):
+        self.id = id
+        self.name = name
+        self.date = date
+        self.time = time
+        self.distance = distance
+        self._msm = None
+
+    def __repr__(self):
+        return '<RunHandle {} {}>'.format(self.id, self.name)
+
+    @property
+    def key(self):
+        """
+        The keyset pagination cursor for this run: pass it as `after` to get
+        the runs following it.
+        """
+        return (self.date, self.time, self.id)
+
+    def msm(self):
+        """
+        The run's max speed matrix as a (time x gradient) float32 array, with
+        a row for every second.
+        """
+        if self._msm is None:
+            self._msm = expand_msm_per_second(*load_msm(msm_path(self)))
+        return self._msm
+
+    def banded_msm(self):
+        """
+        The run's max speed matrix as a BandedMSM (memory-mapped, and never
+        densified), for reductions over many runs. Its rows are the windows
+        of the file's time axis, not every second.
+        """
+        return load_banded_msm(msm_path(self))
+
+    def _retrieve_msm(self):
+        """
+        The run's max speed matrix as a DataFrame with the gradients (as
+        strings) as columns, like fileIO.read_max_speed_matrix.
+        """
+        gradient_interval = np.arange(app.config['MIN_GRADIENT'], \
+                                      app.config['MAX_GRADIENT'] + 1)
+        return pd.DataFrame(self.msm(), columns=[str(gradient) for gradient \
+                                                    in gradient_interval])
+
+    def speed_at_gradient(self, gradient):
+        """
+        Return a Pandas series with the maximum speed over all time_offset
+        frames at a given gradient.
+
+        Attributes:
+            gradient: An integer specifying slope * 100 (rounded)
+        """
+        return self._retrieve_msm()[str(gradient)]
+
+def runs_max(runs):
+    """
+    The CPG matrix (time x gradient) of any selection of RunHandles (e.g.
+    from select_runs): the element-wise maximum of their max speed
+    matrices, folded in band by band, with a row for each window of
+    msm_time_axis (so the matrices must be current, see
+    fileIO.msm_matches_config). None if there are no runs.
+    """
+    return maximum_reduce(run.banded_msm() for run in runs)
+
+def _parse_date(value):
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+def _after_key(query, key, descending=False):
+    """
+    Restricts a query to the runs after key = (date, time, id) in that
+    order (or before it, if descending), for keyset pagination.
+    """
+    key_date, key_time, key_id = key
+    if descending:
+        return query.filter(or_(Run.date < key_date, and_(Run.date == key_date, \
+                    or_(Run.time < key_time, and_(Run.time == key_time, \
+                                                  Run.id < key_id)))))
+    return query.filter(or_(Run.date > key_date, and_(Run.date == key_date, \
+                or_(Run.time > key_time, and_(Run.time == key_time, \
+                                              Run.id > key_id)))))
+
+def run_key_to_str(key):
+    """
+    Formats a (date, time, id) run key for use in a URL.
+    """
+    key_date, key_time, key_id = key
+    return '{}_{}_{}'.format(key_date.isoformat(), key_time.isoformat(), key_id)
+
+def run_key_from_str(text):
+    """
+    Parses a run key formatted by run_key_to_str. Raises ValueError if it is
+    malformed.
+    """
+    key_date, key_time, key_id = text.split('_')
+    return (_parse_date(key_date), time.fromisoformat(key_time), int(key_id))
+
+def list_runs(user_id, before=None, limit=None):
+    """
+    Return the columns shown on a user's listing pages for their runs,
+    including ones still being processed, newest first, as a list of
+    dictionaries with the keys id, name, date, time and complete. The query
+    walks the (user_id, date, time) index, so a page costs the same however
+    many runs the user has.
+
+    Attributes:
+        user_id: the id of the user whose runs are listed
+        before: the key of the last run of the previous page, or None for
+                the first page
+        limit: the maximum number of runs to return
+    """
+    query = db.session.query(Run.id, Run.name, Run.date, Run.time, Run.complete) \
+                .filter(Run.user_id == user_id)
+    if before is not None:
+        query = _after_key(query, before, descending=True)
+    query = query.order_by(Run.date.desc(), Run.time.desc(), Run.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [row._asdict() for row in query]
+
+def select_runs(user_id, start_date=None, end_date=None, min_distance=None, \
+                max_distance=None, after=None, limit=None):
+    """
+    Return a list of RunHandles for a user's complete runs, oldest first,
+    filtered on the indexed date and distance columns. Only the listed
+    columns are selected, and no run files are touched.
+
+    Attributes:
+        user_id: the id of the user whose runs are selected
+        start_date, end_date: dates (or strings in the format YYYY-MM-DD),
+                                inclusive
+        min_distance, max_distance: distances in meters, inclusive
+        after: the key of the last run of the previous page (keyset
+                pagination), or None for the first page
+        limit: the maximum number of runs to return
+    """
+    query = db.session.query(Run.id, Run.name, Run.date, Run.time, Run.distance) \
+                .filter(Run.user_id == user_id, Run.complete == True)
+    if start_date is not None:
+        query = query.filter(Run.date >= _parse_date(start_date))
+    if end_date is not None:
+        query = query.filter(Run.date <= _parse_date(end_date))
+    if min_distance is not None:
+        query = query.filter(Run.distance >= min_distance)
+    if max_distance is not None:
+        query = query.filter(Run.distance <= max_distance)
+    if after is not None:
+        query = _after_key(query, after)
+    query = query.order_by(Run.date, Run.time, Run.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [RunHandle(*row) for row in query]
+
+def runs_by_date(user_id, start_date, end_date):
+    """
+    Return a list containing RunHandles for all of a user's runs which
+    occurred between the given dates (inclusive).
+
+    Attributes:
+        user_id: the id of the user whose runs are returned
+        start_date: A string in the format YYYY-MM-DD
+        end_date: A string in the format YYYY-MM-DD
+    """
+    try:
+        start_date = _parse_date(start_date)
+        end_date = _parse_date(end_date)
+    except ValueError:
+        return 'Invalid dates'
+
+    if start_date > end_date:
+        return None
+
+    return select_runs(user_id, start_date, end_date)
+
+# strftime formats grouping dates into periods, for period_totals. Weeks
+# are ISO weeks (Monday to Sunday), which strftime has no format for, so
+# they are named by the date of their Monday instead (see _period_bucket)
+PERIOD_FORMATS = {'month': '%Y-%m', 'year': '%Y'}
+
+def _period_bucket(period):
+    if period == 'week':
+        # The coming Sunday (or the day itself, if a Sunday), less six days.
+        # Unlike strftime's %W, this keeps a week spanning New Year whole
+        return func.date(Run.date, 'weekday 0', '-6 days')
+    return func.strftime(PERIOD_FORMATS[period], Run.date)
+
+def period_totals(user_id, period='week', start_date=None, end_date=None):
+    """
+    Return a user's totals per ISO week, calendar month or year, computed
+    entirely by the database from the stored run summaries, as a list of
+    dictionaries (oldest first) with the keys period (e.g. '2018-03' or, for
+    weeks, the date of their Monday, e.g. '2018-02-26'), runs, distance, elevation_gain, elevation_loss and
+    moving_time.
+
+    Attributes:
+        user_id: the id of the user whose runs are totalled
+        period: 'week', 'month' or 'year'
+        start_date, end_date: dates (or strings in the format YYYY-MM-DD),
+                                inclusive
+    """
+    bucket = _period_bucket(period).label('period')
+    query = db.session.query(bucket, func.count(Run.id).label('runs'), \
+                func.sum(Run.distance).label('distance'), \
+                func.sum(Run.elevation_gain).label('elevation_gain'), \
+                func.sum(Run.elevation_loss).label('elevation_loss'), \
+                func.sum(Run.moving_time).label('moving_time')) \
+                .filter(Run.user_id == user_id, Run.complete == True)
+    if start_date is not None:
+        query = query.filter(Run.date >= _parse_date(start_date))
+    if end_date is not None:
+        query = query.filter(Run.date <= _parse_date(end_date))
+    query = query.group_by(bucket).order_by(bucket)
+    return [row._asdict() for row in query]
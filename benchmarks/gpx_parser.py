@@ -0,0 +1,79 @@
+"""
+Compares the streaming GPX reader (app.gpxReader) with gpxpy on the bundled
+GPX files: time and peak Python memory for reading a whole track into a
+DataFrame and for reading just the metadata, and checks both give the same
+points.
+
+Run from the repository root:
+    python benchmarks/gpx_parser.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+import gpxpy
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app
+from app.gpxReader import read_gpx_track, read_gpx_metadata
+
+gpx_directories = [app.config['GPX_FOLDER'], r'development/data/gpx/']
+
+def gpxpy_df(path):
+    with open(path, 'r') as gpxfile:
+        gpx = gpxpy.parse(gpxfile)
+    gpstracks = [{'Timestamp' : point.time,
+                  'Latitude' : point.latitude,
+                  'Longitude' : point.longitude,
+                  'Elevation' : point.elevation}
+                 for track in gpx.tracks
+                 for segment in track.segments
+                 for point in segment.points]
+    return pd.DataFrame(gpstracks)
+
+def gpxpy_metadata(path):
+    with open(path, 'r') as gpxfile:
+        gpx = gpxpy.parse(gpxfile)
+    timestamp = gpx.tracks[0].segments[0].points[0].time
+    return gpx.tracks[0].name, timestamp.date(), timestamp.time()
+
+def measure(function, *args):
+    """
+    Returns the result, wall time and peak traced memory (MB) of a call.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    print('{:<45} {:>6}  {:>17}  {:>17}  {:>15}  {:>5}'.format('file', 'pts', \
+            'gpxpy s / MB', 'stream s / MB', 'metadata ms', 'same'))
+    for gpx_directory in gpx_directories:
+        for filename in sorted(os.listdir(gpx_directory)):
+            if not filename.endswith('.gpx'):
+                continue
+            path = gpx_directory + filename
+            old, old_time, old_peak = measure(gpxpy_df, path)
+            new, new_time, new_peak = measure(lambda p: read_gpx_track(p).to_df(), path)
+            old_meta, old_meta_time, _ = measure(gpxpy_metadata, path)
+            new_meta, new_meta_time, _ = measure(read_gpx_metadata, path)
+
+            old_seconds = (pd.to_datetime(old['Timestamp']) - \
+                           pd.to_datetime(old['Timestamp']).iloc[0]).dt.total_seconds()
+            new_seconds = (new['Timestamp'] - new['Timestamp'].iloc[0]).dt.total_seconds()
+            same = len(old) == len(new) and old_meta == new_meta and \
+                np.allclose(old_seconds, new_seconds) and \
+                np.allclose(old[['Latitude', 'Longitude', 'Elevation']].values.astype(float), \
+                            new[['Latitude', 'Longitude', 'Elevation']].values, equal_nan=True)
+            print('{:<45} {:>6}  {:7.3f} / {:6.1f}  {:7.3f} / {:6.1f}  {:6.1f} / {:6.2f}  {:>5}'.format( \
+                    filename, len(new), old_time, old_peak, new_time, new_peak, \
+                    1000*old_meta_time, 1000*new_meta_time, str(same)))
+
+if __name__ == '__main__':
+    main()
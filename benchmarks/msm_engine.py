@@ -0,0 +1,87 @@
+"""
+Checks the vectorized max speed matrix engine against the original
+rolling/groupby construction, and times both, on the bundled GPX files.
+With --backends, every available max_speed_matrix backend (see
+app.dataProcessing.MSM_BACKENDS) is also timed and checked against the
+NumPy one.
+
+Run from the repository root:
+    python benchmarks/msm_engine.py [--skip-rolling] [--backends]
+"""
+import os
+import sys
+import time
+import gpxpy
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app
+from app.dataProcessing import compute_max_speed_df, compute_max_speed_df_rolling, \
+                                prep_df, max_speed_matrix, msm_time_axis, MSM_BACKENDS
+
+gpx_directories = [app.config['GPX_FOLDER'], r'development/data/gpx/']
+
+def load_gpx_df(path):
+    with open(path, 'r') as gpxfile:
+        gpx = gpxpy.parse(gpxfile)
+    gpstracks = [{'Timestamp' : point.time,
+                  'Latitude' : point.latitude,
+                  'Longitude' : point.longitude,
+                  'Elevation' : point.elevation}
+                 for track in gpx.tracks
+                 for segment in track.segments
+                 for point in segment.points]
+    return pd.DataFrame(gpstracks)
+
+def compare_backends(df):
+    """
+    Times each backend on an already prepared track, and counts the cells
+    where it differs from the NumPy backend.
+    """
+    args = (df['speed_meters_sec'].values, df['gradient_100'].values, \
+            msm_time_axis(), app.config['MIN_GRADIENT'], \
+            app.config['MAX_GRADIENT'])
+    kwargs = {'step': app.config['RESAMPLE_SECONDS'] or None}
+    reference = max_speed_matrix(*args, backend='numpy', **kwargs)
+    line = ''
+    for name in sorted(MSM_BACKENDS):
+        # Run once first so that compile time is not counted
+        max_speed_matrix(*args, backend=name, **kwargs)
+        start = time.perf_counter()
+        msm = max_speed_matrix(*args, backend=name, **kwargs)
+        elapsed = time.perf_counter() - start
+        line += '  {} {:7.3f}s ({} differ)'.format(name, elapsed, \
+                                                  (msm != reference).sum())
+    return line
+
+def main(skip_rolling=False, backends=False):
+    for gpx_directory in gpx_directories:
+        for filename in sorted(os.listdir(gpx_directory)):
+            if not filename.endswith('.gpx'):
+                continue
+            df = load_gpx_df(gpx_directory + filename)
+
+            start = time.perf_counter()
+            fast = compute_max_speed_df(df.copy())
+            fast_time = time.perf_counter() - start
+            line = '{:<45} {:>6} pts  vectorized {:7.3f}s'.format(filename, \
+                                                        len(df), fast_time)
+
+            if not skip_rolling:
+                start = time.perf_counter()
+                slow = compute_max_speed_df_rolling(df.copy())
+                slow_time = time.perf_counter() - start
+                # The engine stores float32 and only the windows of the time
+                # axis, so compare those at float32 precision
+                slow = slow.loc[fast.index]
+                mismatched = ~np.isclose(fast.values, slow.values.astype(float), \
+                                         rtol=1e-5, atol=1e-5)
+                line += '  rolling {:7.3f}s  speed-up {:6.0f}x  mismatched cells {}'.format( \
+                            slow_time, slow_time / fast_time, mismatched.sum())
+            if backends:
+                line += compare_backends(prep_df(df.copy()))
+            print(line)
+
+if __name__ == '__main__':
+    main(skip_rolling='--skip-rolling' in sys.argv, backends='--backends' in sys.argv)
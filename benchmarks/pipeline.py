@@ -0,0 +1,201 @@
+"""
+Times each step of the ingestion and CPG pipeline on synthetic GPX tracks
+(see synthetic.py) of 10 minutes to 12 hours sampled every 1, 2 and 5
+seconds: reading metadata, converting to csv, preparing the track, the max
+speed matrix, writing and reading .msm files, and reducing 10, 100 and 1,000
+matrices to a CPG matrix (band by band, and densified for comparison).
+Everything is written to a temporary directory.
+
+The results go to a JSON file (by default benchmarks/results/<commit>.json)
+so that two commits can be compared on the same machine:
+
+    python benchmarks/pipeline.py [--quick] [--output results.json]
+    python benchmarks/pipeline.py --compare old.json new.json
+
+Run from the repository root.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app
+from app.models import Run
+from app.cube import MSMCube
+from app.dataProcessing import prep_df, compute_max_speed_df
+from app.fileIO import metadata_from_gpx, gpx_to_csv, write_msm_file, load_msm, \
+                        expand_msm, load_banded_msm
+from app.bandedMSM import maximum_reduce
+from synthetic import write_synthetic_gpx
+
+DURATIONS = (10, 60, 180, 720)
+STEPS = (1, 2, 5)
+RUN_COUNTS = (10, 100, 1000)
+# Appending to a cube writes a full matrix per run (1.7 MB with a row every
+# second), so the largest run count is left out for it
+CUBE_RUN_COUNTS = (10, 100)
+
+def measure(function, *args, repeat=3, budget=2.0):
+    """
+    Times a call repeat times, or just once if it takes longer than budget
+    seconds. Returns the timings and the result of the last call.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+        if timings[-1] > budget:
+            break
+    return timings, result
+
+class Results(object):
+    def __init__(self):
+        self.results = []
+
+    def add(self, name, params, timings):
+        self.results.append({'name': name, 'params': params,
+                             'min': min(timings), 'median': float(np.median(timings)),
+                             'repeat': len(timings)})
+        print('{:<24} {:<40} {:9.4f}s'.format(name, json.dumps(params, sort_keys=True), \
+                                              min(timings)))
+
+def reduce_msm_files(paths):
+    return maximum_reduce(load_banded_msm(path) for path in paths)
+
+def reduce_dense_msm_files(paths):
+    cpg = None
+    for path in paths:
+        msm = expand_msm(*load_msm(path))
+        cpg = msm if cpg is None else np.maximum(cpg, msm, out=cpg)
+    return cpg
+
+def fill_cube(user_id, matrices):
+    cube = MSMCube(user_id)
+    for run_id, msm in enumerate(matrices):
+        cube.append(run_id, msm)
+    return np.array(cube.alltime_max())
+
+def run_benchmarks(workdir, durations, run_counts, cube_run_counts):
+    for folder in ('GPX_FOLDER', 'CSV_FOLDER', 'MSM_FOLDER', 'CUBE_FOLDER'):
+        app.config[folder] = os.path.join(workdir, folder.lower()) + r'/'
+        os.makedirs(app.config[folder])
+    results = Results()
+    msm_paths = []
+    matrices = []
+
+    for minutes in durations:
+        for step in STEPS:
+            params = {'minutes': minutes, 'step': step}
+            filename = 'synthetic-{}-{}.gpx'.format(minutes, step)
+            params['points'] = write_synthetic_gpx(app.config['GPX_FOLDER'] + filename, \
+                                                   minutes, step, seed=minutes + step)
+            run = Run(id=len(msm_paths) + 1, date=date(2018, 1, 1))
+
+            timings, _ = measure(metadata_from_gpx, filename)
+            results.add('metadata_from_gpx', params, timings)
+            timings, df = measure(gpx_to_csv, run, filename)
+            results.add('gpx_to_csv', params, timings)
+            timings, prepared = measure(lambda: prep_df(df.copy()))
+            results.add('prep_df', params, timings)
+            timings, max_speed_df = measure(compute_max_speed_df, prepared, repeat=1)
+            results.add('compute_max_speed_df', params, timings)
+
+            msm = max_speed_df.values
+            path = app.config['MSM_FOLDER'] + '{}.msm'.format(run.id)
+            time_axis = max_speed_df.index.values
+            timings, _ = measure(lambda: write_msm_file(path, msm, app.config['MIN_GRADIENT'], \
+                                                        app.config['MAX_GRADIENT'], \
+                                                        time_axis=time_axis))
+            results.add('write_msm', params, timings)
+            timings, _ = measure(lambda: expand_msm(*load_msm(path)))
+            results.add('read_msm', params, timings)
+            msm_paths.append(path)
+            matrices.append(msm)
+
+    # The matrices above are reused in turn, so the reductions read warm files
+    for count in run_counts:
+        paths = [msm_paths[i % len(msm_paths)] for i in range(count)]
+        timings, _ = measure(reduce_msm_files, paths)
+        results.add('cpg_from_msm_files', {'runs': count}, timings)
+        timings, _ = measure(reduce_dense_msm_files, paths)
+        results.add('cpg_from_dense_msm_files', {'runs': count}, timings)
+    for count in cube_run_counts:
+        timings, _ = measure(fill_cube, count, \
+                             [matrices[i % len(matrices)] for i in range(count)], repeat=1)
+        results.add('cpg_from_cube', {'runs': count}, timings)
+        cube = MSMCube(count)
+        timings, _ = measure(lambda: np.array(cube.alltime_max()))
+        results.add('cube_alltime_max', {'runs': count}, timings)
+    return results.results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], \
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def compare(old_path, new_path):
+    """
+    Prints the ratio of the new to the old minimum time of every benchmark
+    the two result files have in common.
+    """
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file), json.load(new_file)
+    key = lambda result: (result['name'], json.dumps(result['params'], sort_keys=True))
+    old_results = {key(result): result for result in old['results']}
+    print('{} ({}) -> {} ({})'.format(old['commit'], old['timestamp'], \
+                                      new['commit'], new['timestamp']))
+    for result in new['results']:
+        previous = old_results.get(key(result))
+        if previous is None:
+            continue
+        ratio = result['min'] / previous['min']
+        flag = '  slower' if ratio > 1.1 else ('  faster' if ratio < 0.9 else '')
+        print('{:<24} {:<40} {:9.4f}s -> {:9.4f}s  {:5.2f}x{}'.format(result['name'], \
+                key(result)[1], previous['min'], result['min'], ratio, flag))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--quick', action='store_true', \
+                        help='Only the 10 and 60 minute tracks, and up to 100 runs')
+    parser.add_argument('--output', help='Where to write the JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), \
+                        help='Compare two result files instead of running')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    durations = DURATIONS[:2] if args.quick else DURATIONS
+    run_counts = RUN_COUNTS[:2] if args.quick else RUN_COUNTS
+    commit = git_commit()
+    workdir = tempfile.mkdtemp(prefix='dash-running-benchmarks-')
+    try:
+        with app.app_context():
+            results = run_benchmarks(workdir, durations, run_counts, CUBE_RUN_COUNTS)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(os.path.dirname(__file__), 'results', \
+                                         '{}.json'.format(commit))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump({'commit': commit, 'timestamp': datetime.now().isoformat(),
+                   'machine': platform.machine(), 'processor': platform.processor(),
+                   'python': platform.python_version(), 'numpy': np.__version__,
+                   'msm_backend': app.config['MSM_BACKEND'], 'quick': args.quick,
+                   'results': results}, output_file, indent=1)
+    print('Wrote', output)
+
+if __name__ == '__main__':
+    main()
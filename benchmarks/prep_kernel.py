@@ -0,0 +1,76 @@
+"""
+Compares the fused track preparation kernel (app.dataProcessing.prep_track)
+with the column-at-a-time pandas version it replaced, on the bundled GPX
+files: wall time, peak Python memory, and the largest difference in
+distance and speed. Both are run without resampling so that rows line up
+one-to-one with GPX points.
+
+Run from the repository root:
+    python benchmarks/prep_kernel.py
+"""
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app
+from app.dataProcessing import haversine_np, prep_track
+from app.gpxReader import read_gpx_track
+
+gpx_directories = [app.config['GPX_FOLDER'], r'development/data/gpx/']
+
+def pandas_prep(df):
+    """
+    The per-point pandas preparation, as it was before prep_track.
+    """
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+    df['sec_elapsed'] = (df['Timestamp'] - df['Timestamp'].iloc[0]).dt.total_seconds()
+    df['dist_delta_meters'] = haversine_np(df['Longitude'].shift(), df['Latitude'].shift(),
+                                           df['Longitude'], df['Latitude']).fillna(0)
+    df['elev_delta_meters'] = df['Elevation'].diff().fillna(0)
+    df['time_delta_sec'] = df['Timestamp'].diff().fillna(pd.Timedelta(0)).dt.total_seconds()
+    df['speed_meters_sec'] = (df['dist_delta_meters'] / df['time_delta_sec']).fillna(0)
+    df['gradient'] = (df['elev_delta_meters'] / df['dist_delta_meters']).fillna(0)
+    too_steep = df['gradient'].abs() > 1
+    df.loc[too_steep, 'gradient'] = np.median(df['gradient'].values)
+    df['gradient_100'] = 100 * df['gradient']
+    return df.drop(['Latitude', 'Longitude'], axis=1)
+
+def kernel_prep(track):
+    return prep_track(track.time, track.latitude, track.longitude, track.elevation)
+
+def measure(function, *args):
+    """
+    Returns the result, wall time and peak traced memory (MB) of a call.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    print('{:<45} {:>6}  {:>16}  {:>16}  {:>9}'.format('file', 'pts', \
+            'pandas ms / MB', 'kernel ms / MB', 'max diff'))
+    for gpx_directory in gpx_directories:
+        for filename in sorted(os.listdir(gpx_directory)):
+            if not filename.endswith('.gpx'):
+                continue
+            track = read_gpx_track(gpx_directory + filename)
+            if len(track) < 2:
+                continue
+            old, old_time, old_peak = measure(pandas_prep, track.to_df())
+            new, new_time, new_peak = measure(kernel_prep, track)
+            diff = max(np.max(np.abs(old[column].values - new[column])) \
+                       for column in ['dist_delta_meters', 'speed_meters_sec', 'gradient_100'])
+            print('{:<45} {:>6}  {:7.2f} / {:6.2f}  {:7.2f} / {:6.2f}  {:9.2e}'.format( \
+                    filename, len(track), 1000*old_time, old_peak, \
+                    1000*new_time, new_peak, diff))
+
+if __name__ == '__main__':
+    main()
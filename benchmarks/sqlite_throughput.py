@@ -0,0 +1,132 @@
+"""
+Concurrent read/write throughput of the app database on SQLite, with
+SQLAlchemy's defaults (rollback journal, full sync, a new connection per
+checkout) and with the configured settings (SQLITE_PRAGMAS and
+SQLITE_POOL_SIZE, see app.database). Writer processes add a run and its
+job and commit, as an upload does; reader processes fetch the first page
+of the run listing, as the index page does. Each setup gets a fresh
+database in a temporary directory, seeded with a few thousand runs.
+
+Run from the repository root:
+    python benchmarks/sqlite_throughput.py [--seconds 5] [--writers 4] [--readers 4]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, time as time_of_day
+from multiprocessing import Process, Queue
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app import app, db
+from app.database import sqlite_engine_options
+from app.models import User, Run, Job
+
+SEED_RUNS = 5000
+
+def setups():
+    return (('defaults', {}),
+            ('configured', {'pragmas': app.config['SQLITE_PRAGMAS'],
+                            'pool_size': app.config['SQLITE_POOL_SIZE'],
+                            'max_overflow': app.config['SQLITE_MAX_OVERFLOW']}))
+
+def make_engine(path, options):
+    return create_engine('sqlite:///' + path, **sqlite_engine_options(path, **options))
+
+def seed(path, options):
+    engine = make_engine(path, options)
+    db.metadata.create_all(engine)
+    session = Session(bind=engine)
+    session.add(User(id=1, username='runner', email='runner@example.com'))
+    session.add_all(Run(name='Seed run {}'.format(i), user_id=1, \
+                        date=date(2015 + i % 5, 1 + i % 12, 1 + i % 28), \
+                        time=time_of_day(i % 24, i % 60), complete=True) \
+                    for i in range(SEED_RUNS))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+def writer(path, options, seconds, results):
+    engine = make_engine(path, options)
+    writes = errors = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        session = Session(bind=engine)
+        try:
+            run = Run(name='Upload', user_id=1, date=date.today(), \
+                      time=time_of_day(12, 0), complete=False)
+            session.add(run)
+            session.flush()
+            session.add(Job(run_id=run.id, filename='upload.gpx', status=Job.QUEUED))
+            session.commit()
+            writes += 1
+        except OperationalError:
+            session.rollback()
+            errors += 1
+        finally:
+            session.close()
+    results.put(('write', writes, errors))
+
+def reader(path, options, seconds, results):
+    engine = make_engine(path, options)
+    reads = errors = 0
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        session = Session(bind=engine)
+        try:
+            session.query(Run.id, Run.name, Run.date, Run.time, Run.complete) \
+                .filter(Run.user_id == 1) \
+                .order_by(Run.date.desc(), Run.time.desc(), Run.id.desc()) \
+                .limit(app.config['RUNS_PER_PAGE']).all()
+            reads += 1
+        except OperationalError:
+            errors += 1
+        finally:
+            session.close()
+    results.put(('read', reads, errors))
+
+def measure(path, options, seconds, writers, readers):
+    results = Queue()
+    processes = [Process(target=writer, args=(path, options, seconds, results)) \
+                    for _ in range(writers)]
+    processes += [Process(target=reader, args=(path, options, seconds, results)) \
+                    for _ in range(readers)]
+    for process in processes:
+        process.start()
+    totals = {'write': [0, 0], 'read': [0, 0]}
+    for _ in processes:
+        kind, count, errors = results.get()
+        totals[kind][0] += count
+        totals[kind][1] += errors
+    for process in processes:
+        process.join()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{} writers, {} readers, {:.0f}s each'.format(args.writers, args.readers, \
+                                                        args.seconds))
+    for name, options in setups():
+        workdir = tempfile.mkdtemp(prefix='dash-running-sqlite-')
+        try:
+            path = os.path.join(workdir, 'app.db')
+            seed(path, options)
+            totals = measure(path, options, args.seconds, args.writers, args.readers)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        (writes, write_errors), (reads, read_errors) = totals['write'], totals['read']
+        print('{:<12} writes {:8.1f}/s ({} locked)   reads {:8.1f}/s ({} locked)'.format( \
+                name, writes / args.seconds, write_errors, reads / args.seconds, read_errors))
+
+if __name__ == '__main__':
+    main()
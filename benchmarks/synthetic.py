@@ -0,0 +1,70 @@
+"""
+Synthetic GPX tracks for the benchmarks: a runner on rolling terrain, with
+speed falling on climbs, GPS-like position and elevation noise, a wandering
+heading and the occasional stop. Tracks are seeded, so the same arguments
+always give the same file.
+"""
+from datetime import datetime, timedelta
+import numpy as np
+
+START_TIME = datetime(2018, 1, 1, 7, 0, 0)
+START_LATITUDE = 33.70
+START_LONGITUDE = -117.80
+METERS_PER_DEGREE = 111320.0
+
+def synthetic_track(minutes, step, seed=0):
+    """
+    Returns the times (seconds from the start), latitudes, longitudes and
+    elevations of a synthetic run lasting minutes, sampled every step
+    seconds.
+    """
+    rng = np.random.RandomState(seed)
+    seconds = np.arange(0, 60*minutes + 1, step, dtype=np.float64)
+    n = len(seconds)
+
+    # Terrain: a few hills of different wavelengths along the distance run
+    # (approximated here by time at the base pace), plus some GPS noise
+    base_distance = 3.0 * seconds
+    elevation = 100.0
+    for wavelength, amplitude in ((3000.0, 40.0), (800.0, 10.0), (250.0, 3.0)):
+        phase = rng.uniform(0, 2*np.pi)
+        elevation = elevation + amplitude * np.sin(2*np.pi*base_distance/wavelength + phase)
+    gradient = np.gradient(elevation, base_distance + 1e-9)
+
+    # Slower uphill, faster (a little) downhill, with noise and a few stops
+    speed = 3.0 * (1 - 4*np.clip(gradient, -0.05, 0.3)) + rng.normal(0, 0.3, n)
+    stops = rng.rand(n) < step / 900.0
+    for start in np.flatnonzero(stops):
+        speed[start:start + int(rng.randint(5, 60) / step) + 1] = 0.0
+    speed = np.clip(speed, 0.0, 7.0)
+    distance = speed * step
+
+    heading = np.cumsum(rng.normal(0, 0.05, n))
+    latitude = START_LATITUDE + np.cumsum(distance * np.cos(heading)) / METERS_PER_DEGREE
+    longitude = START_LONGITUDE + np.cumsum(distance * np.sin(heading)) / \
+                (METERS_PER_DEGREE * np.cos(np.radians(START_LATITUDE)))
+    latitude += rng.normal(0, 1.5, n) / METERS_PER_DEGREE
+    longitude += rng.normal(0, 1.5, n) / METERS_PER_DEGREE
+    elevation = elevation + rng.normal(0, 0.2, n)
+    return seconds, latitude, longitude, elevation
+
+def write_synthetic_gpx(path, minutes, step, seed=0, name=None):
+    """
+    Writes a synthetic run (see synthetic_track) to path as GPX 1.1.
+    Returns the number of track points.
+    """
+    seconds, latitude, longitude, elevation = synthetic_track(minutes, step, seed)
+    name = name or 'Synthetic {} min run every {} s'.format(minutes, step)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<gpx version="1.1" creator="Dash Running benchmarks" '
+             'xmlns="http://www.topografix.com/GPX/1/1">',
+             '<trk><name>{}</name><trkseg>'.format(name)]
+    for second, lat, lon, ele in zip(seconds, latitude, longitude, elevation):
+        time = START_TIME + timedelta(seconds=float(second))
+        lines.append('<trkpt lat="{:.7f}" lon="{:.7f}"><ele>{:.1f}</ele>'
+                     '<time>{}Z</time></trkpt>'.format(lat, lon, ele, \
+                                                      time.isoformat()))
+    lines.append('</trkseg></trk></gpx>')
+    with open(path, 'w') as gpx_file:
+        gpx_file.write('\n'.join(lines))
+    return len(seconds)
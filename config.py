@@ -9,6 +9,18 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Set on every new SQLite connection: write-ahead logging lets listings
+    # read while an upload or worker writes, NORMAL only syncs at WAL
+    # checkpoints (a power cut can lose the last commits, but never corrupt
+    # the database), and writers wait up to busy_timeout milliseconds for
+    # the lock instead of failing with "database is locked"
+    SQLITE_PRAGMAS = (('journal_mode', 'WAL'),
+                      ('synchronous', 'NORMAL'),
+                      ('busy_timeout', 30000))
+    # Connections kept open per process (None opens one per checkout), and
+    # how many more may be opened under load
+    SQLITE_POOL_SIZE = 5
+    SQLITE_MAX_OVERFLOW = 10
 
     # File upload settings
     ALLOWED_EXTENSIONS = set(['gpx'])
@@ -16,8 +28,80 @@ class Config(object):
     GPX_FOLDER = UPLOAD_FOLDER
     CSV_FOLDER = r'data/csv/'
     MSM_FOLDER = r'data/msm/'
+    CUBE_FOLDER = r'data/cube/'
+    # Chunked uploads are assembled here until their last chunk arrives, may
+    # be at most MAX_UPLOAD_BYTES long, and are deleted if no chunk arrives
+    # for CHUNK_EXPIRY_SECONDS
+    CHUNK_FOLDER = r'data/uploads/'
+    MAX_UPLOAD_BYTES = 4 * 2**30
+    CHUNK_EXPIRY_SECONDS = 24 * 3600
+    # Files in a bulk import larger than this (in bytes) are skipped, and
+    # the runs queued are committed IMPORT_COMMIT_FILES files at a time
+    MAX_GPX_BYTES = 64 * 2**20
+    IMPORT_COMMIT_FILES = 100
+    # Also keep the raw track of each upload as csv in CSV_FOLDER
+    WRITE_TRACK_CSV = False
+    # Length of the rolling CPG aggregate, in days
+    ROLLING_DAYS = 90
 
     # File processing settings
     MAX_MINUTES = 120 #120
     MIN_GRADIENT = -30
     MAX_GRADIENT = 30
+    # Tracks are resampled to one row every RESAMPLE_SECONDS seconds (set to
+    # None to keep one row per GPX point), and gaps longer than PAUSE_SECONDS
+    # are treated as pauses
+    RESAMPLE_SECONDS = 1
+    PAUSE_SECONDS = 30
+    # Optional cleaning: median-filter elevation over this many points, and
+    # cap speeds (meters per second) at MAX_SPEED_METERS_SEC. None turns
+    # either off
+    ELEVATION_FILTER_POINTS = None
+    MAX_SPEED_METERS_SEC = None
+    # Run summaries: elevation changes smaller than ELEVATION_HYSTERESIS
+    # meters are ignored, and rows slower than MOVING_SPEED_METERS_SEC don't
+    # count as moving
+    ELEVATION_HYSTERESIS = 3
+    MOVING_SPEED_METERS_SEC = 0.5
+    # Upper bound on (window, position) pairs held in memory at once while
+    # building a max speed matrix
+    MSM_BLOCK_CELLS = 2**22
+    # 'numba' (compiled, used when numba is installed, otherwise falls back
+    # to 'numpy') or 'numpy'
+    MSM_BACKEND = 'numba'
+    # Max speed matrices keep a row for every window of up to
+    # MSM_DENSE_SECONDS seconds, then MSM_WINDOWS_PER_DOUBLING geometrically
+    # spaced rows per doubling of the window up to MAX_MINUTES; the seconds
+    # in between are interpolated. Set MSM_DENSE_SECONDS to None for a row
+    # every second
+    MSM_DENSE_SECONDS = 120
+    MSM_WINDOWS_PER_DOUBLING = 24
+    # Pace prediction (see prediction.py): only CPG windows of at least
+    # PACE_MIN_SECONDS are fitted, and each gradient's own fit is shrunk
+    # towards the all-gradient model as if by PACE_PRIOR_WEIGHT extra
+    # windows (must be positive), so rarely run gradients borrow from their
+    # neighbours
+    PACE_MIN_SECONDS = 60
+    PACE_PRIOR_WEIGHT = 20
+    # Planned routes are timed in segments of (at most) this many meters
+    ROUTE_SEGMENT_METERS = 50
+
+    # Runs shown per page on the run listings
+    RUNS_PER_PAGE = 25
+
+    # If set, every job is run under cProfile and the stats are dumped to
+    # PROFILE_FOLDER/job-<id>.prof
+    PROFILE_FOLDER = None
+
+    # View cache: 'memory' (per process), 'filesystem' (shared, under
+    # CACHE_FOLDER) or None to turn caching off
+    CACHE_TYPE = 'memory'
+    CACHE_MAX_BYTES = 64 * 2**20
+    CACHE_FOLDER = r'data/cache/'
+
+    # Background job settings. JOB_WORKERS = None uses one worker per core
+    JOB_WORKERS = None
+    JOB_POLL_SECONDS = 1
+    # Jobs still running after this many seconds are taken to have lost
+    # their worker (see jobs.sweep_stale_jobs)
+    JOB_TIMEOUT_SECONDS = 3600
@@ -0,0 +1,48 @@
+"""Bulk import batches
+
+Revision ID: 3c9f1e7a5b20
+Revises: 8e1b5d7c3a29
+Create Date: 2026-10-18 15:02:17.481339
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9f1e7a5b20'
+down_revision = '8e1b5d7c3a29'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('batch',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('files', sa.Integer(), nullable=True),
+    sa.Column('queued', sa.Integer(), nullable=True),
+    sa.Column('duplicates', sa.Integer(), nullable=True),
+    sa.Column('invalid', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_batch_created'), 'batch', ['created'], unique=False)
+    op.create_index(op.f('ix_batch_user_id'), 'batch', ['user_id'], unique=False)
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.Integer(), nullable=True))
+        batch_op.create_index(op.f('ix_job_batch_id'), ['batch_id'], unique=False)
+        batch_op.create_foreign_key('fk_job_batch_id_batch', 'batch', ['batch_id'], ['id'])
+
+
+def downgrade():
+    with op.batch_alter_table('job') as batch_op:
+        batch_op.drop_constraint('fk_job_batch_id_batch', type_='foreignkey')
+        batch_op.drop_index(op.f('ix_job_batch_id'))
+        batch_op.drop_column('batch_id')
+    op.drop_index(op.f('ix_batch_user_id'), table_name='batch')
+    op.drop_index(op.f('ix_batch_created'), table_name='batch')
+    op.drop_table('batch')
@@ -0,0 +1,49 @@
+"""Job queue table and Run.complete
+
+Revision ID: 5b1e0c7d9a42
+Revises: 236c1726ba02
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e0c7d9a42'
+down_revision = '236c1726ba02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('job',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('filename', sa.String(length=255), nullable=True),
+    sa.Column('status', sa.String(length=16), nullable=True),
+    sa.Column('progress', sa.Float(), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('started', sa.DateTime(), nullable=True),
+    sa.Column('finished', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['run.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_created'), 'job', ['created'], unique=False)
+    op.create_index(op.f('ix_job_status'), 'job', ['status'], unique=False)
+    # Runs uploaded before the job queue were processed synchronously, so
+    # they are already complete
+    with op.batch_alter_table('run') as batch_op:
+        batch_op.add_column(sa.Column('complete', sa.Boolean(), nullable=True, \
+                                        server_default=sa.true()))
+        batch_op.create_index(op.f('ix_run_complete'), ['complete'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('run') as batch_op:
+        batch_op.drop_index(op.f('ix_run_complete'))
+        batch_op.drop_column('complete')
+    op.drop_index(op.f('ix_job_status'), table_name='job')
+    op.drop_index(op.f('ix_job_created'), table_name='job')
+    op.drop_table('job')
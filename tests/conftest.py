@@ -0,0 +1,73 @@
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+GPX_SAMPLES = os.path.join(ROOT, 'development', 'data', 'gpx')
+sys.path.insert(0, ROOT)
+
+# The database URL is read when the app is imported, so point it at a
+# throwaway file first
+os.environ['DATABASE_URL'] = 'sqlite:///' + \
+    os.path.join(tempfile.mkdtemp(prefix='dash-running-tests-'), 'test.db')
+
+from app import app as flask_app, db
+from app.models import User
+
+FOLDERS = ('GPX_FOLDER', 'CSV_FOLDER', 'MSM_FOLDER', 'CUBE_FOLDER', \
+           'CHUNK_FOLDER', 'CACHE_FOLDER')
+
+def sample_gpx(name):
+    return os.path.join(GPX_SAMPLES, name)
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """
+    The app with its data folders under tmp_path, caching off and an empty
+    database.
+    """
+    for folder in FOLDERS:
+        monkeypatch.setitem(flask_app.config, folder, str(tmp_path / folder.lower()) + r'/')
+    monkeypatch.setitem(flask_app.config, 'CACHE_TYPE', None)
+    monkeypatch.setitem(flask_app.config, 'TESTING', True)
+    monkeypatch.setitem(flask_app.config, 'WTF_CSRF_ENABLED', False)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def user(app):
+    user = User(username='runner', email='runner@example.com')
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+@pytest.fixture
+def client(app, user):
+    """
+    A test client logged in as user.
+    """
+    client = app.test_client()
+    client.post('/login', data={'username': 'runner', 'password': 'password'})
+    return client
+
+def upload(client, path):
+    with open(path, 'rb') as gpx_file:
+        return client.post('/upload', \
+                           data={'file': (gpx_file, os.path.basename(path))}, \
+                           content_type='multipart/form-data')
+
+@pytest.fixture
+def processed(client, user):
+    """
+    Two of the sample runs, uploaded as user and processed by the worker.
+    """
+    from app.jobs import work
+    for name in ('Hannaford_Dr_with_Ling.gpx', 'Orchard_Hills_with_Ling_and_Almond.gpx'):
+        upload(client, sample_gpx(name))
+    work(burst=True)
+    return user.runs.filter_by(complete=True).all()
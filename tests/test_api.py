@@ -0,0 +1,53 @@
+import json
+import numpy as np
+from app.aggregates import CPGAggregates
+
+def cpg(client, query=''):
+    response = client.get('/api/users/runner/cpg' + query)
+    return response.status_code, json.loads(response.data) if response.status_code == 200 else None
+
+def test_processed_runs(processed):
+    assert len(processed) == 2
+
+def test_cpg_open_ended_range(client, processed):
+    _, alltime = cpg(client)
+    status, since = cpg(client, '?start=2000-01-01')
+    assert status == 200
+    assert since['speed'] == alltime['speed']
+    status, until = cpg(client, '?end=2100-01-01')
+    assert status == 200
+    assert until['speed'] == alltime['speed']
+
+def test_cpg_range_after_last_run(client, processed):
+    status, later = cpg(client, '?start=9999-01-01')
+    assert status == 200
+    assert not np.any(np.array([later['speed'][gradient] for gradient in later['speed']]))
+
+def test_range_max_to_last_representable_date(processed, user):
+    aggregates = CPGAggregates(user.id)
+    np.testing.assert_array_equal(aggregates.range_max('1900-01-01', '9999-12-31'), \
+                                  aggregates.range_max())
+
+def test_cpg_resolution_is_bounded(client, processed):
+    assert cpg(client, '?resolution=1000')[0] == 200
+    assert cpg(client, '?resolution=1001')[0] == 400
+    assert cpg(client, '?resolution=1000000000')[0] == 400
+
+ROUTE = b'''<gpx><rte>
+<rtept lat="42.0" lon="-71.0"><ele>10</ele></rtept>
+<rtept lat="42.01" lon="-71.0"><ele>20</ele></rtept>
+%s
+</rte></gpx>'''
+
+def route_estimate(client, query='', extra=b''):
+    response = client.post('/api/users/runner/route-estimate' + query, data=ROUTE % extra)
+    return response.status_code
+
+def test_route_estimate_split_is_bounded(client, processed):
+    assert route_estimate(client, '?split=100') == 200
+    assert route_estimate(client, '?split=0.001') == 400
+    assert route_estimate(client, '?split=1e9') == 400
+    assert route_estimate(client, '?split=nan') == 400
+
+def test_route_estimate_point_without_position(client, processed):
+    assert route_estimate(client, extra=b'<rtept><ele>30</ele></rtept>') == 400
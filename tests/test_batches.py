@@ -0,0 +1,115 @@
+import io
+import os
+import json
+import time
+import tarfile
+import zipfile
+from conftest import sample_gpx
+from app.models import Run, Job, Batch
+from app.batches import chunk_path, expire_chunks
+from app.jobs import work
+
+def zip_archive(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    buffer.seek(0)
+    return buffer
+
+def test_corrupt_member_is_counted_invalid(client, user):
+    with open(sample_gpx('Hannaford_Dr_with_Ling.gpx'), 'rb') as gpx_file:
+        valid = gpx_file.read()
+    archive = zip_archive([('runs/first.gpx', valid),
+                           ('runs/corrupt.gpx', b'<gpx><trk><trkseg><trkpt lat='),
+                           ('runs/empty.gpx', b'')])
+
+    response = client.post('/upload/batch', \
+                           data={'file': (archive, 'runs.zip')}, \
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    result = json.loads(response.data)
+    assert (result['files'], result['queued'], result['invalid']) == (3, 1, 2)
+    assert result['error'] is None
+    batch = Batch.query.get(result['id'])
+    assert batch.invalid == 2
+    assert Run.query.filter_by(user_id=user.id).count() == 1
+
+def test_corrupt_single_upload_is_rejected(client, user):
+    response = client.post('/upload', \
+                           data={'file': (io.BytesIO(b'<gpx><trk'), 'broken.gpx')}, \
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 302
+    assert Run.query.filter_by(user_id=user.id).count() == 0
+
+def tar_archive(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as archive:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+def test_truncated_archive_keeps_queued_runs(app, client, user):
+    contents = []
+    for name in ('Hannaford_Dr_with_Ling.gpx', 'Orchard_Hills_with_Ling_and_Almond.gpx', \
+                 'Final_San_Diego_run.gpx'):
+        with open(sample_gpx(name), 'rb') as gpx_file:
+            contents.append((name, gpx_file.read()))
+    archive = tar_archive(contents)
+    # Cut the archive off half way through the last file
+    truncated = archive[:len(archive) - 1024 - len(contents[-1][1]) // 2]
+
+    response = client.post('/upload/batch', \
+                           data={'file': (io.BytesIO(truncated), 'runs.tar')}, \
+                           content_type='multipart/form-data')
+
+    result = json.loads(response.data)
+    assert (result['files'], result['queued'], result['invalid']) == (3, 2, 1)
+    assert result['error'] is not None
+    assert Run.query.filter_by(user_id=user.id).count() == 2
+    assert Job.query.filter_by(status=Job.QUEUED).count() == 2
+    user_directory = os.path.join(app.config['GPX_FOLDER'], str(user.id))
+    assert len(os.listdir(user_directory)) == 2
+
+def put_chunk(client, upload_id, content, start, length, filename='runs.tar'):
+    return client.put('/upload/chunks/{}?filename={}'.format(upload_id, filename), \
+                      data=content, headers={'Content-Range': 'bytes {}-{}/{}' \
+                          .format(start, start + len(content) - 1, length)})
+
+def test_chunked_upload_is_imported_by_a_worker(client, user):
+    with open(sample_gpx('Hannaford_Dr_with_Ling.gpx'), 'rb') as gpx_file:
+        archive = tar_archive([('run.gpx', gpx_file.read())])
+    half = len(archive) // 2
+
+    assert put_chunk(client, 'upload-0001', archive[:half], 0, len(archive)).status_code == 200
+    response = put_chunk(client, 'upload-0001', archive[half:], half, len(archive))
+
+    assert response.status_code == 202
+    result = json.loads(response.data)
+    assert (result['status'], result['files'], result['jobs']['queued']) == ('processing', 0, 1)
+    work(burst=True)
+    result = json.loads(client.get(response.headers['Location']).data)
+    assert (result['status'], result['files'], result['queued']) == ('done', 1, 1)
+    assert result['jobs']['done'] == 2
+    assert Run.query.filter_by(user_id=user.id, complete=True).count() == 1
+    assert os.listdir(os.path.dirname(chunk_path(user.id, 'upload-0001'))) == []
+
+def test_chunked_upload_size_is_capped(app, client, user):
+    too_long = app.config['MAX_UPLOAD_BYTES'] + 1
+    assert put_chunk(client, 'upload-0002', b'x' * 10, 0, too_long).status_code == 413
+
+def test_abandoned_chunks_expire(app, client, user):
+    put_chunk(client, 'upload-0003', b'x' * 10, 0, 100)
+    put_chunk(client, 'upload-0004', b'x' * 10, 0, 100)
+    abandoned = chunk_path(user.id, 'upload-0003')
+    a_day_ago = time.time() - app.config['CHUNK_EXPIRY_SECONDS'] - 1
+    os.utime(abandoned, (a_day_ago, a_day_ago))
+
+    expire_chunks()
+
+    assert not os.path.exists(abandoned)
+    assert os.path.exists(chunk_path(user.id, 'upload-0004'))
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from app.cube import MSMCube
+
+@pytest.fixture
+def cube(app, monkeypatch):
+    cube = MSMCube(1)
+    cube.rebuilds = 0
+    rebuild_max = cube._rebuild_max
+
+    def counted(meta):
+        cube.rebuilds += 1
+        rebuild_max(meta)
+    monkeypatch.setattr(cube, '_rebuild_max', counted)
+    return cube
+
+def matrices(cube, n_runs, seed=0):
+    shape = cube._slab_shape(cube._configured_meta())
+    return np.random.RandomState(seed).uniform(0, 5, (n_runs,) + shape).astype(np.float32)
+
+def assert_max_is_current(cube):
+    np.testing.assert_array_equal(cube.alltime_max(), np.asarray(cube.runs()).max(axis=0))
+
+def test_replacing_unchanged_run_skips_rebuild(cube):
+    msms = matrices(cube, 3)
+    for run_id, msm in enumerate(msms):
+        assert not cube.append(run_id, msm)
+    assert not cube.append(1, msms[1])
+    assert not cube.append(1, msms[1] + 1)
+    assert cube.rebuilds == 0
+    assert_max_is_current(cube)
+
+def test_replacing_run_below_maximum_skips_rebuild(cube):
+    msms = matrices(cube, 2)
+    msms[0] = 10.0
+    for run_id, msm in enumerate(msms):
+        cube.append(run_id, msm)
+    assert cube.append(1, msms[1] / 2)
+    assert cube.rebuilds == 0
+    assert_max_is_current(cube)
+
+def test_replacing_maximum_rebuilds(cube):
+    msms = matrices(cube, 2)
+    for run_id, msm in enumerate(msms):
+        cube.append(run_id, msm)
+    assert cube.append(0, msms[0] / 2)
+    assert cube.rebuilds == 1
+    assert_max_is_current(cube)
+
+def test_forced_reprocess_keeps_maxima(processed, user):
+    from app.aggregates import CPGAggregates
+    from app.fileIO import list_gpx_files, reprocess_gpx
+    cube = MSMCube(user.id)
+    alltime = np.array(cube.alltime_max())
+    ranged = CPGAggregates(user.id).range_max()
+    for filename in list_gpx_files():
+        rebuilt, _ = reprocess_gpx(filename, force=True)
+        assert len(rebuilt) == 1
+    np.testing.assert_array_equal(cube.alltime_max(), alltime)
+    np.testing.assert_array_equal(CPGAggregates(user.id).range_max(), ranged)
+
+def test_stale_cube_is_left_alone(app, cube, monkeypatch):
+    msms = matrices(cube, 2)
+    cube.append(0, msms[0])
+    with open(cube.runs_path, 'rb') as runs_file:
+        stored = runs_file.read()
+    windows_per_doubling = app.config['MSM_WINDOWS_PER_DOUBLING']
+    monkeypatch.setitem(app.config, 'MSM_WINDOWS_PER_DOUBLING', windows_per_doubling // 2)
+
+    assert cube.append(1, msms[1][:len(cube._configured_meta()['time_axis'])]) is None
+    assert cube.alltime_max() is None
+    with open(cube.runs_path, 'rb') as runs_file:
+        assert runs_file.read() == stored
+    monkeypatch.setitem(app.config, 'MSM_WINDOWS_PER_DOUBLING', windows_per_doubling)
+    assert cube.run_ids() == [0]
+    assert_max_is_current(cube)
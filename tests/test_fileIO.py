@@ -0,0 +1,28 @@
+from datetime import date
+import numpy as np
+from conftest import sample_gpx
+from app.models import Run
+from app.dataProcessing import compute_max_speed_df, msm_time_axis
+from app.fileIO import gpx_to_csv, csv_to_msm, load_msm, expand_msm, msm_path, \
+                        write_msm_file, read_msm_header
+from app.gpxReader import read_gpx_track
+
+def test_csv_to_msm(app, monkeypatch):
+    name = 'Hannaford_Dr_with_Ling.gpx'
+    monkeypatch.setitem(app.config, 'GPX_FOLDER', sample_gpx(''))
+    run = Run(id=1, date=date(2018, 1, 1))
+    gpx_to_csv(run, name)
+
+    assert csv_to_msm(run)
+    expected = compute_max_speed_df(read_gpx_track(sample_gpx(name)).to_df())
+    np.testing.assert_array_equal(expand_msm(*load_msm(msm_path(run))), expected.values)
+
+def test_msm_header_records_resampling_and_windows(app, tmp_path):
+    time_axis = msm_time_axis()
+    msm = np.ones((len(time_axis), 3), dtype=np.float32)
+    path = str(tmp_path / 'run.msm')
+    write_msm_file(path, msm, -1, 1, 2, time_axis)
+
+    header = read_msm_header(path)
+    assert header['resample_seconds'] == 2
+    np.testing.assert_array_equal(header['time_axis'], time_axis)
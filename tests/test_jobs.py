@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from conftest import upload, sample_gpx
+from app import db
+from app.models import Run, Job
+from app.jobs import work, sweep_stale_jobs, STALE_JOB_ERROR
+
+SAMPLE = sample_gpx('Hannaford_Dr_with_Ling.gpx')
+
+def test_job_of_deleted_run_fails(client, user):
+    upload(client, SAMPLE)
+    Run.query.delete()
+    db.session.commit()
+
+    work(burst=True)
+    job = Job.query.one()
+    assert job.status == Job.FAILED
+    assert 'no longer exists' in job.error
+
+def test_pace_model_failure_keeps_the_run(app, client, user, monkeypatch):
+    monkeypatch.setitem(app.config, 'PACE_PRIOR_WEIGHT', 0)
+    upload(client, SAMPLE)
+    upload(client, sample_gpx('Orchard_Hills_with_Ling_and_Almond.gpx'))
+
+    work(burst=True)
+    assert [job.status for job in Job.query.order_by(Job.id)] == [Job.DONE, Job.DONE]
+    assert Run.query.filter_by(complete=True).count() == 2
+
+def stall(job, hours):
+    job.status = Job.RUNNING
+    job.started = datetime.utcnow() - timedelta(hours=hours)
+    db.session.commit()
+
+def test_stale_jobs_are_queued_again_once(client, user):
+    upload(client, SAMPLE)
+    upload(client, sample_gpx('Orchard_Hills_with_Ling_and_Almond.gpx'))
+    stale, running = Job.query.order_by(Job.id).all()
+    stall(stale, 2)
+    stall(running, 0)
+
+    assert sweep_stale_jobs() == 1
+    assert (stale.status, stale.error) == (Job.QUEUED, STALE_JOB_ERROR)
+    assert running.status == Job.RUNNING
+
+    stall(stale, 2)
+    assert sweep_stale_jobs() == 1
+    assert stale.status == Job.FAILED
+
+def test_worker_picks_up_stale_jobs(client, user):
+    upload(client, SAMPLE)
+    stall(Job.query.one(), 2)
+
+    work(burst=True)
+    job = Job.query.one()
+    assert (job.status, job.error) == (Job.DONE, None)
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+from conftest import GPX_SAMPLES, sample_gpx
+from app.dataProcessing import compute_max_speed_df, compute_max_speed_df_rolling, prep_df, \
+                                max_speed_matrix, msm_time_axis, _median_filter, \
+                                elevation_change
+from app.gpxReader import read_gpx_track
+
+SAMPLE_FILES = sorted(name for name in os.listdir(GPX_SAMPLES) if name.endswith('.gpx'))
+
+@pytest.fixture
+def short_axis(app, monkeypatch):
+    # The rolling construction takes a pandas pass per window, so only the
+    # first minute of windows is compared, with the log-spaced part of the
+    # axis starting early enough to be covered too
+    monkeypatch.setitem(app.config, 'MAX_MINUTES', 1)
+    monkeypatch.setitem(app.config, 'MSM_DENSE_SECONDS', 20)
+    return app
+
+def assert_matches_rolling(df):
+    fast = compute_max_speed_df(df.copy())
+    slow = compute_max_speed_df_rolling(df.copy()).loc[fast.index]
+    # The engine stores float32
+    np.testing.assert_allclose(fast.values, slow.values.astype(np.float64), \
+                               rtol=1e-5, atol=1e-5, equal_nan=True)
+
+@pytest.mark.parametrize('filename', SAMPLE_FILES)
+def test_matches_rolling_construction(short_axis, filename):
+    assert_matches_rolling(read_gpx_track(sample_gpx(filename)).to_df())
+
+def test_missing_gradients_match_rolling_construction(short_axis):
+    df = prep_df(read_gpx_track(sample_gpx(SAMPLE_FILES[0])).to_df())
+    df.loc[df.index[::37], 'gradient_100'] = np.nan
+    assert_matches_rolling(df)
+
+@pytest.mark.parametrize('step', [None, 2])
+def test_backends_agree(app, step):
+    pytest.importorskip('numba')
+    rng = np.random.RandomState(0)
+    speed = rng.uniform(0, 6, 5000)
+    gradient_100 = rng.normal(0, 8, 5000)
+    gradient_100[rng.rand(5000) < 0.01] = np.nan
+    gradient_100[rng.rand(5000) < 0.005] = np.inf
+    gradient_100[rng.rand(5000) < 0.005] = -np.inf
+    args = (speed, gradient_100, msm_time_axis(), app.config['MIN_GRADIENT'], \
+            app.config['MAX_GRADIENT'])
+    np.testing.assert_array_equal(max_speed_matrix(*args, step=step, backend='numba'), \
+                                  max_speed_matrix(*args, step=step, backend='numpy'))
+
+@pytest.mark.parametrize('window', [1, 2, 3, 4, 5])
+def test_median_filter_keeps_every_point(window):
+    values = np.arange(10.0)
+    filtered = _median_filter(values, window)
+    assert filtered.shape == values.shape
+    # A straight line is its own running median away from the ends
+    inner = slice(window, -window)
+    np.testing.assert_array_equal(filtered[inner], values[inner] + (0.5 if window % 2 == 0 else 0))
+
+def backlash_change(values, half_width):
+    gain = loss = 0.0
+    filtered = values[0]
+    for value in values:
+        if value - half_width > filtered:
+            gain += value - half_width - filtered
+            filtered = value - half_width
+        elif value + half_width < filtered:
+            loss += filtered - value - half_width
+            filtered = value + half_width
+    return gain, loss
+
+def test_elevation_change_matches_point_by_point_filter():
+    random = np.random.default_rng(0)
+    elevation = np.cumsum(random.normal(0, 1, 5000)).round(1)
+    elevation[::50] = elevation[1::50]
+    for hysteresis in (0.0, 1.0, 5.0):
+        np.testing.assert_allclose(elevation_change(elevation, hysteresis), \
+                                   backlash_change(elevation, hysteresis / 2))
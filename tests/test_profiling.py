@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from app.ingestion import Ingestion
+from app.profiling import reset_peak_rss
+
+def test_peak_rss_is_per_stage():
+    if not reset_peak_rss():
+        pytest.skip('The peak RSS cannot be reset here')
+    ingestion = Ingestion(None, None)
+    with ingestion.timed('large'):
+        np.ones(2**25).sum()
+    with ingestion.timed('small'):
+        pass
+    # 256 MB were touched in the first stage, and freed before the second
+    assert ingestion.peak_rss['large'] - ingestion.peak_rss['small'] > 200
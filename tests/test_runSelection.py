@@ -0,0 +1,20 @@
+from datetime import date
+from app import db
+from app.models import Run
+from app.runSelection import period_totals
+
+def add_run(user, day, distance):
+    db.session.add(Run(user_id=user.id, date=day, distance=distance, complete=True))
+
+def test_weeks_span_new_year(user):
+    # Monday to Sunday around New Year 2019, then the next Monday
+    add_run(user, date(2018, 12, 31), 5000.0)
+    add_run(user, date(2019, 1, 2), 8000.0)
+    add_run(user, date(2019, 1, 6), 3000.0)
+    add_run(user, date(2019, 1, 7), 10000.0)
+    db.session.commit()
+
+    totals = period_totals(user.id, 'week')
+
+    assert [(week['period'], week['runs'], week['distance']) for week in totals] == \
+        [('2018-12-31', 3, 16000.0), ('2019-01-07', 1, 10000.0)]
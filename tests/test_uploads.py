@@ -0,0 +1,81 @@
+import io
+import os
+import time
+from conftest import upload, sample_gpx
+from app import db
+from app.models import Run, Job
+from app.ingestion import Ingestion
+from app.fileIO import find_unparsed_gpx
+from app.jobs import work
+
+SAMPLE = sample_gpx('Hannaford_Dr_with_Ling.gpx')
+
+def fail_jobs():
+    Job.query.update({'status': Job.FAILED, 'error': 'Worker crashed'})
+    db.session.commit()
+
+def test_upload_flashes_job(client, user):
+    response = upload(client, SAMPLE)
+    job = Job.query.one()
+    page = client.get('/index').data.decode()
+    assert response.status_code == 302
+    assert 'job {}'.format(job.id) in page
+    assert '/jobs/{}'.format(job.id) in page
+
+def test_queued_run_is_a_duplicate(client, user):
+    upload(client, SAMPLE)
+    upload(client, SAMPLE)
+    assert Run.query.count() == 1
+    assert Job.query.count() == 1
+
+def test_failed_run_is_queued_again(client, user):
+    upload(client, SAMPLE)
+    fail_jobs()
+    run = Run.query.one()
+    assert 'failed: Worker crashed' in client.get('/index').data.decode()
+
+    upload(client, SAMPLE)
+    assert Run.query.count() == 1
+    assert [job.status for job in run.jobs.order_by(Job.id)] == [Job.FAILED, Job.QUEUED]
+    work(burst=True)
+    assert Run.query.one().complete
+
+    upload(client, SAMPLE)
+    assert run.jobs.count() == 2
+
+def test_progress_counts_stages(app, user):
+    # With a hash, looking for an identical run is timed too, but is no stage
+    run = Run(user_id=user.id, gpx_hash='0' * 64, complete=False)
+    db.session.add(run)
+    db.session.flush()
+    fractions = []
+    Ingestion(SAMPLE, user.id).process(run, lambda stage, fraction: fractions.append(fraction))
+    assert fractions == [done / float(len(Ingestion.STAGES)) \
+                         for done in range(1, len(Ingestion.STAGES))] + [1.0]
+
+def user_files(app, user):
+    return sorted(os.listdir(app.config['GPX_FOLDER'] + str(user.id)))
+
+def test_duplicate_upload_leaves_file_alone(app, client, user):
+    upload(client, SAMPLE)
+    work(burst=True)
+    path = app.config['GPX_FOLDER'] + Job.query.one().filename
+    modified = os.path.getmtime(path)
+    time.sleep(0.01)
+
+    upload(client, SAMPLE)
+    assert os.path.getmtime(path) == modified
+    assert find_unparsed_gpx() == []
+    assert user_files(app, user) == [os.path.basename(path)]
+
+def test_rejected_uploads_leave_no_files(app, client, user):
+    upload(client, SAMPLE)
+    files = user_files(app, user)
+    with open(SAMPLE, 'rb') as gpx_file:
+        same_run = gpx_file.read() + b'\n'
+    rejected = [same_run, b'<gpx><trk><trkseg></trkseg></trk></gpx>', b'<gpx><trk']
+    for content in rejected:
+        client.post('/upload', data={'file': (io.BytesIO(content), 'run.gpx')}, \
+                    content_type='multipart/form-data')
+    assert Run.query.count() == 1
+    assert user_files(app, user) == files